@@ -0,0 +1,304 @@
+# analytics.py
+"""
+Vectorized sales analytics over the whole sale history.
+
+Sale lines are loaded into columnar NumPy arrays (line id, sale id, item id,
+quantity, price, cost and sale time as epoch seconds) and cached on disk next
+to the database as one .npy file per column. Loading reads the reporting
+snapshot (and the archive databases) in chunks and only fetches lines added
+since the cache was written; if older lines were changed or deleted (the
+totals in sales_margin_daily no longer add up) the cache is rebuilt from
+scratch. Archiving keeps those totals, so it does not invalidate the cache.
+In memory the last history is kept until the database or its reporting
+snapshot changes (database.cached_read), so repeated reports load nothing.
+
+Every report below is a handful of NumPy operations over those arrays
+(bincount, unique, cumsum), so tens of millions of lines take seconds:
+
+    h = analytics.load_history()
+    analytics.abc_classification(h)
+    analytics.hour_heatmap(h)
+
+update_forecasts() is the batch job behind reorder points: it derives each
+item's daily demand and its variability and stores them in item_forecasts,
+where stock screens look them up by item id.
+
+NumPy is optional for the rest of the application; only this module needs it.
+"""
+import calendar
+import json
+import os
+import time
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import database
+
+CHUNK_SIZE = 200_000    # Sale lines fetched per query page
+FORECAST_DAYS = 90      # Demand history used for forecasts
+LEAD_TIME_DAYS = 7      # Days between ordering and receiving stock
+SERVICE_Z = 1.65        # Safety stock in standard deviations (~95% of lead times without a stock-out)
+CACHE_VERSION = 1
+COLUMNS = ("id", "sale_id", "item_id", "quantity", "price_each", "cost_each", "ts")
+_DTYPES = {"id": "i8", "sale_id": "i8", "item_id": "i8", "quantity": "f8",
+           "price_each": "f8", "cost_each": "f8", "ts": "i8"}
+
+# Sale times are local time; they are stored as if they were UTC so that
+# ts // 86400 is the local day and (ts // 3600) % 24 the local hour.
+# Lines of an archive still being filled are skipped while they are in the hot database too.
+_LINES_SQL = """
+    SELECT sd.id, sd.sale_id, sd.item_id, sd.quantity, sd.price_each, sd.cost_each,
+           CAST(strftime('%s', s.datetime) AS INTEGER)
+    FROM {schema}.sale_details sd JOIN {schema}.sales s ON s.id = sd.sale_id
+    WHERE sd.id > ? {skip_hot}
+    ORDER BY sd.id
+    LIMIT ?
+"""
+_SKIP_HOT = "AND NOT EXISTS (SELECT 1 FROM main.sale_details h WHERE h.id = sd.id)"
+
+class SalesHistory:
+    """Sale lines as parallel NumPy arrays (archived periods first, then by line id)"""
+
+    def __init__(self, columns):
+        for name in COLUMNS:
+            setattr(self, name, columns[name])
+
+    def __len__(self):
+        return len(self.id)
+
+    @property
+    def revenue(self):
+        return self.quantity * self.price_each
+
+    @property
+    def day(self):
+        """Local day number (days since 1970-01-01)"""
+        return self.ts // 86400
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("analytics needs NumPy (pip install numpy)")
+
+# ---------- Loading and cache ----------
+def get_cache_dir(db_path=None):
+    base, _ = os.path.splitext(db_path or database.DB_NAME)
+    return f"{base}_analytics"
+
+def _fetch(conn, after_id, schema="main", skip_hot=False):
+    """Sale lines with id > after_id as a dict of arrays, read CHUNK_SIZE rows at a time"""
+    dtype = np.dtype([(name, _DTYPES[name]) for name in COLUMNS])
+    sql = _LINES_SQL.format(schema=schema, skip_hot=_SKIP_HOT if skip_hot else "")
+    chunks = []
+    conn.row_factory = None  # Plain tuples go straight into np.fromiter
+    while True:
+        chunk = np.fromiter(conn.execute(sql, (after_id, CHUNK_SIZE)), dtype=dtype)
+        if not len(chunk):
+            break
+        chunks.append(chunk)
+        after_id = int(chunk["id"][-1])
+        if len(chunk) < CHUNK_SIZE:
+            break
+    data = np.concatenate(chunks) if chunks else np.empty(0, dtype=dtype)
+    return {name: np.ascontiguousarray(data[name]) for name in COLUMNS}
+
+def _totals(conn):
+    """(quantity, revenue) of all sale lines, from the maintained aggregates"""
+    row = conn.execute(
+        "SELECT COALESCE(SUM(quantity), 0), COALESCE(SUM(revenue), 0) FROM sales_margin_daily"
+    ).fetchone()
+    return float(row[0]), float(row[1])
+
+def _read_cache(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != CACHE_VERSION:
+            return None, None
+        columns = {name: np.load(os.path.join(cache_dir, f"{name}.npy")) for name in COLUMNS}
+    except (OSError, ValueError):
+        return None, None
+    return meta, columns
+
+def _write_cache(cache_dir, columns, meta):
+    os.makedirs(cache_dir, exist_ok=True)
+    for name in COLUMNS:
+        tmp_path = os.path.join(cache_dir, f"{name}.tmp.npy")
+        np.save(tmp_path, columns[name])
+        os.replace(tmp_path, os.path.join(cache_dir, f"{name}.npy"))
+    # meta.json last: a cache interrupted before this is seen as stale
+    with open(os.path.join(cache_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+@database.cached_read(maxsize=1, snapshot=True)
+def load_history(db_path=None, use_cache=True):
+    """
+    All sale lines as a SalesHistory. With use_cache the on-disk cache is
+    extended with new lines (or rebuilt when history changed) and saved.
+    """
+    _require_numpy()
+    started = time.monotonic()
+    cache_dir = get_cache_dir(db_path)
+    meta, columns = _read_cache(cache_dir) if use_cache else (None, None)
+    conn = database.get_report_connection(db_path=db_path)
+    try:
+        quantity, revenue = _totals(conn)
+        if columns is not None:
+            new = _fetch(conn, meta["last_id"])
+            # Cached + new lines must add up to today's totals, else old lines changed
+            expected_q = meta["quantity"] + float(new["quantity"].sum())
+            expected_r = meta["revenue"] + float((new["quantity"] * new["price_each"]).sum())
+            if abs(expected_q - quantity) <= 1e-6 * max(1.0, abs(quantity)) and \
+                    abs(expected_r - revenue) <= 1e-6 * max(1.0, abs(revenue)):
+                if len(new["id"]):
+                    columns = {name: np.concatenate((columns[name], new[name])) for name in COLUMNS}
+                else:
+                    return SalesHistory(columns)
+            else:
+                columns = None
+        if columns is None:
+            # Archived periods first, then the hot database
+            parts = [_fetch(conn, 0, schema, status != "done")
+                     for attached, _ in database.archive_batches(conn, db_path=db_path)
+                     for schema, status in attached]
+            parts.append(_fetch(conn, 0))
+            columns = {name: np.concatenate([p[name] for p in parts]) for name in COLUMNS}
+    finally:
+        conn.close()
+
+    if use_cache:
+        _write_cache(cache_dir, columns, {
+            "version": CACHE_VERSION,
+            "last_id": int(columns["id"][-1]) if len(columns["id"]) else 0,
+            "lines": len(columns["id"]),
+            "quantity": quantity,
+            "revenue": revenue,
+            "built_s": round(time.monotonic() - started, 3),
+        })
+    return SalesHistory(columns)
+
+# ---------- Reports ----------
+def abc_classification(h, a_share=0.8, b_share=0.95):
+    """
+    ABC classes by revenue: the items making the first a_share of revenue are
+    A, up to b_share B, the rest C. Returns rows sorted by revenue.
+    """
+    item_ids, idx = np.unique(h.item_id, return_inverse=True)
+    revenue = np.bincount(idx, weights=h.revenue, minlength=len(item_ids))
+    order = np.argsort(revenue)[::-1]
+    revenue = revenue[order]
+    total = revenue.sum()
+    cum_share = np.cumsum(revenue) / total if total else np.zeros_like(revenue)
+    # An item belongs to the class its revenue starts in
+    start_share = cum_share - (revenue / total if total else 0)
+    classes = np.where(start_share < a_share, "A", np.where(start_share < b_share, "B", "C"))
+    return [
+        {"item_id": int(i), "revenue": float(r), "cum_share": round(float(c), 4), "class": str(k)}
+        for i, r, c, k in zip(item_ids[order], revenue, cum_share, classes)
+    ]
+
+def sales_velocity(h, days=30, now=None, limit=None):
+    """Units sold per day over the last days days, per item, fastest first"""
+    now = now if now is not None else int(np.max(h.ts)) if len(h) else 0
+    mask = h.ts > now - days * 86400
+    item_ids, idx = np.unique(h.item_id[mask], return_inverse=True)
+    units = np.bincount(idx, weights=h.quantity[mask], minlength=len(item_ids))
+    order = np.argsort(units)[::-1][:limit]
+    return [{"item_id": int(i), "units": float(u), "per_day": round(float(u) / days, 4)}
+            for i, u in zip(item_ids[order], units[order])]
+
+def moving_average(h, window=7, item_id=None, measure="revenue"):
+    """
+    Daily revenue (or units with measure="quantity") and its trailing
+    window-day moving average, optionally for one item. Days without sales
+    count as zero.
+    """
+    mask = h.item_id == item_id if item_id is not None else slice(None)
+    values = (h.revenue if measure == "revenue" else h.quantity)[mask]
+    days = h.day[mask]
+    if not len(days):
+        return []
+    first = int(days.min())
+    daily = np.bincount(days - first, weights=values)
+    csum = np.cumsum(np.concatenate(([0.0], daily)))
+    n = np.minimum(np.arange(1, len(daily) + 1), window)
+    ma = (csum[1:] - csum[np.arange(len(daily)) + 1 - n]) / n
+    dates = (np.arange(len(daily)) + first).astype("datetime64[D]").astype(str).tolist()
+    return [{"day": d, "value": float(v), "moving_average": round(float(m), 4)}
+            for d, v, m in zip(dates, daily, ma)]
+
+def basket_sizes(h, max_lines=20):
+    """Lines and units per sale: summary statistics and a histogram of lines per sale"""
+    if not len(h):
+        return {"sales": 0}
+    sale_ids, idx, lines = np.unique(h.sale_id, return_inverse=True, return_counts=True)
+    units = np.bincount(idx, weights=h.quantity)
+    value = np.bincount(idx, weights=h.revenue)
+    hist = np.bincount(np.minimum(lines, max_lines), minlength=max_lines + 1)
+    return {
+        "sales": int(len(sale_ids)),
+        "lines_mean": round(float(lines.mean()), 3),
+        "lines_median": float(np.median(lines)),
+        "lines_p90": float(np.percentile(lines, 90)),
+        "units_mean": round(float(units.mean()), 3),
+        "value_mean": round(float(value.mean()), 2),
+        # hist[n] = sales with n lines; the last bucket is max_lines or more
+        "lines_histogram": {str(n): int(c) for n, c in enumerate(hist) if n and c},
+    }
+
+WEEKDAYS = ("الاثنين", "الثلاثاء", "الأربعاء", "الخميس", "الجمعة", "السبت", "الأحد")
+
+def hour_heatmap(h, measure="revenue"):
+    """7 x 24 matrix (Monday first) of revenue, units or lines by weekday and hour"""
+    weekday = (h.day + 3) % 7  # 1970-01-01 was a Thursday
+    hour = (h.ts // 3600) % 24
+    weights = {"revenue": h.revenue, "quantity": h.quantity, "lines": None}[measure]
+    return np.bincount(weekday * 24 + hour, weights=weights, minlength=7 * 24).reshape(7, 24)
+
+# ---------- Forecasts ----------
+def _local_now():
+    """Current local time on the same scale as SalesHistory.ts"""
+    return calendar.timegm(time.localtime())
+
+def compute_forecasts(h, days=FORECAST_DAYS, lead_time_days=LEAD_TIME_DAYS, service_z=SERVICE_Z, now=None):
+    """
+    Daily demand mean and standard deviation of every item ever sold, over
+    the last days days (or since its first sale, if newer), days without
+    sales counting as zero. reorder_point = demand during the lead time plus
+    service_z standard deviations of it. Returns a dict of arrays.
+    """
+    today = (now if now is not None else _local_now()) // 86400
+    first_day = today - days + 1
+    item_ids, idx = np.unique(h.item_id, return_inverse=True)
+    n = len(item_ids)
+    # Days of history per item: from its first sale ever, at most days
+    first_sale = np.full(n, today, dtype="i8")
+    np.minimum.at(first_sale, idx, h.day)
+    span = np.clip(today - first_sale + 1, 1, days)
+
+    mask = (h.day >= first_day) & (h.day <= today)
+    cell = idx[mask] * days + (h.day[mask] - first_day)
+    daily = np.bincount(cell, weights=h.quantity[mask], minlength=n * days).reshape(n, days)
+    total = daily.sum(axis=1)
+    mean = total / span
+    # Variance over the item's span; days before its first sale hold zeros and are not counted
+    var = np.maximum((daily ** 2).sum(axis=1) / span - mean ** 2, 0)
+    std = np.sqrt(var)
+    reorder_point = mean * lead_time_days + service_z * std * np.sqrt(lead_time_days)
+    return {"item_id": item_ids, "demand_per_day": mean, "demand_std": std,
+            "reorder_point": reorder_point, "history_days": span}
+
+def update_forecasts(days=FORECAST_DAYS, lead_time_days=LEAD_TIME_DAYS, service_z=SERVICE_Z):
+    """Recompute all item forecasts from the cached history and store them"""
+    import models
+
+    h = load_history()
+    f = compute_forecasts(h, days, lead_time_days, service_z)
+    rows = list(zip(f["item_id"].tolist(), f["demand_per_day"].round(4).tolist(),
+                    f["demand_std"].round(4).tolist(), f["reorder_point"].round(2).tolist(),
+                    f["history_days"].tolist()))
+    models.save_item_forecasts(rows, datetime.now().isoformat(timespec="seconds"))
+    return {"items": len(rows), "lines": len(h), "days": days, "lead_time_days": lead_time_days}
@@ -0,0 +1,172 @@
+# archive.py
+"""
+Hot/cold archiving of sales.
+
+archive_period("2023") moves the sales of a closed period, a year "YYYY" or
+a month "YYYY-MM", into <db>_archive_2023.db next to the database, together
+with their lines. The move runs in chunks of CHUNK_SIZE sales. Each chunk is
+copied and committed in the archive first, then deleted from the hot
+database in one write job, so a run can be interrupted at any point and
+simply be started again. Ids are kept, so archived rows never collide with
+hot ones.
+
+Deletes made by archiving are neither captured for sync (replicas keep their
+own history) nor taken out of sales_margin_daily, and the stock ledger is
+left alone. Reports attach the archives a date range needs, a few at a
+time (see database.archive_batches / archive_source).
+
+    python cli.py archive 2023
+"""
+import json
+import os
+import sqlite3
+import time
+from datetime import date, datetime
+
+import database
+from database import ARCHIVED_TABLES, get_connection, run_write
+
+CHUNK_SIZE = 1000   # Sales moved per transaction
+
+_ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sales (
+    id INTEGER PRIMARY KEY,
+    datetime TEXT NOT NULL,
+    total_price REAL NOT NULL DEFAULT 0,
+    created_at TEXT
+);
+CREATE TABLE IF NOT EXISTS sale_details (
+    id INTEGER PRIMARY KEY,
+    sale_id INTEGER NOT NULL,
+    item_id INTEGER NOT NULL,
+    quantity REAL NOT NULL,
+    price_each REAL NOT NULL,
+    created_at TEXT,
+    cost_each REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_sales_datetime ON sales(datetime);
+CREATE INDEX IF NOT EXISTS idx_sale_details_sale_id ON sale_details(sale_id);
+CREATE INDEX IF NOT EXISTS idx_sale_details_item_id ON sale_details(item_id);
+"""
+
+def period_range(period):
+    """First day and the day after the last day of "YYYY" or "YYYY-MM" """
+    try:
+        if len(period) == 4:
+            year = int(period)
+            return date(year, 1, 1), date(year + 1, 1, 1)
+        year, month = (int(p) for p in period.split("-"))
+        return date(year, month, 1), date(year + month // 12, month % 12 + 1, 1)
+    except ValueError:
+        raise ValueError(f"Period must be YYYY or YYYY-MM, not {period!r}")
+
+def archive_file_name(period, db_path=None):
+    base = os.path.splitext(os.path.basename(db_path or database.DB_NAME))[0]
+    return f"{base}_archive_{period}.db"
+
+def _open_archive(path):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode = DELETE;")  # One self-contained file
+    conn.executescript(_ARCHIVE_SCHEMA)
+    return conn
+
+def _insert_sql(table):
+    columns = ARCHIVED_TABLES[table]
+    marks = ", ".join("?" * len(columns.split(",")))
+    return f"INSERT OR REPLACE INTO {table} ({columns}) VALUES ({marks})"
+
+def _delete_chunk(conn, period, ids, total_price, ranges):
+    """
+    Remove archived sales from the hot database without touching sync
+    capture or margins. ranges: (first/last sale id, first/last line id) of
+    the chunk, None when it has no lines.
+    """
+    conn.execute("UPDATE trigger_control SET suppress_capture = 1, archiving = 1 WHERE id=1")
+    try:
+        lines = conn.execute("DELETE FROM sale_details WHERE sale_id IN (SELECT value FROM json_each(?))",
+                             (ids,)).rowcount
+        sales = conn.execute("DELETE FROM sales WHERE id IN (SELECT value FROM json_each(?))",
+                             (ids,)).rowcount
+    finally:
+        conn.execute("UPDATE trigger_control SET suppress_capture = 0, archiving = 0 WHERE id=1")
+    # Id ranges let a single sale or line be found in its archive (see database.archive_batches)
+    conn.execute("""
+        UPDATE archives SET sales = sales + :sales, lines = lines + :lines,
+            total_price = total_price + :total_price,
+            first_sale_id = COALESCE(MIN(first_sale_id, :first_sale), first_sale_id, :first_sale),
+            last_sale_id = COALESCE(MAX(last_sale_id, :last_sale), last_sale_id, :last_sale),
+            first_line_id = COALESCE(MIN(first_line_id, :first_line), first_line_id, :first_line),
+            last_line_id = COALESCE(MAX(last_line_id, :last_line), last_line_id, :last_line)
+        WHERE period = :period
+    """, dict(zip(("first_sale", "last_sale", "first_line", "last_line"), ranges),
+              sales=sales, lines=lines, total_price=total_price, period=period))
+    return sales, lines
+
+def archive_period(period, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Move the sales of a closed period into its archive database.
+    progress(summary) is called after every chunk. Returns the summary.
+    """
+    start, end = period_range(period)
+    if end > date.today():
+        raise ValueError(f"Period {period} is not closed yet")
+    start, end = start.isoformat(), end.isoformat()
+    file_name = archive_file_name(period)
+
+    # Registered before the first chunk moves, so reports never miss moved rows
+    def _register(conn):
+        conn.execute("""
+            INSERT INTO archives (period, file_name, start_date, end_date) VALUES (?, ?, ?, ?)
+            ON CONFLICT (period) DO UPDATE SET status='archiving'
+        """, (period, file_name, start, end))
+    run_write(_register)
+
+    summary = {"period": period, "file": file_name, "sales": 0, "lines": 0}
+    started = time.monotonic()
+    arc = _open_archive(database.get_archive_path(file_name))
+    hot = get_connection()
+    try:
+        while True:
+            sales = hot.execute(f"""
+                SELECT {ARCHIVED_TABLES['sales']} FROM sales
+                WHERE datetime >= ? AND datetime < ?
+                ORDER BY id LIMIT ?
+            """, (start, end, chunk_size)).fetchall()
+            if not sales:
+                break
+            ids = json.dumps([r["id"] for r in sales])
+            lines = hot.execute(f"""
+                SELECT {ARCHIVED_TABLES['sale_details']} FROM sale_details
+                WHERE sale_id IN (SELECT value FROM json_each(?))
+            """, (ids,)).fetchall()
+            # Archive commit first: a crash in between leaves rows in both files, never in neither
+            with arc:
+                arc.executemany(_insert_sql("sales"), [tuple(r) for r in sales])
+                arc.executemany(_insert_sql("sale_details"), [tuple(r) for r in lines])
+            line_ids = [r["id"] for r in lines]
+            ranges = (sales[0]["id"], sales[-1]["id"],
+                      min(line_ids) if line_ids else None, max(line_ids) if line_ids else None)
+            moved_sales, moved_lines = run_write(
+                _delete_chunk, period, ids, sum(r["total_price"] for r in sales), ranges
+            )
+            summary["sales"] += moved_sales
+            summary["lines"] += moved_lines
+            if progress:
+                progress(summary)
+    finally:
+        hot.close()
+        arc.close()
+
+    def _finish(conn):
+        conn.execute("UPDATE archives SET status='done', archived_at=? WHERE period=?",
+                     (datetime.now().isoformat(timespec="seconds"), period))
+    run_write(_finish)
+    summary["elapsed_s"] = round(time.monotonic() - started, 2)
+    return summary
+
+def get_archives():
+    conn = get_connection()
+    try:
+        return conn.execute("SELECT * FROM archives ORDER BY start_date").fetchall()
+    finally:
+        conn.close()
@@ -0,0 +1,409 @@
+# cli.py
+"""
+Headless command-line entry point for batch jobs (cron / Task Scheduler).
+
+Imports only database and models (no PyQt5, cv2 or pyzbar). Every command
+prints one JSON document on stdout and exits non-zero on failure.
+
+    python cli.py --db store.db backup --out backups/store.db
+    python cli.py report top-items --limit 20
+    python cli.py export sales --start 2024-01-01 --end 2024-12-31 --out sales.csv
+    python cli.py import-items catalog.csv
+    python cli.py maintenance --shutdown
+    python cli.py reprint 120 121 122 --out /dev/usb/lp0
+    python cli.py reconcile --repair
+    python cli.py invoices --start 2024-01-01 --end 2024-12-31 --out invoices/ --workers 4
+    python cli.py po create order.csv --supplier "Acme"
+    python cli.py receive delivery.csv --po 7
+    python cli.py analytics abc --limit 50
+    python cli.py archive 2023
+    python cli.py export-columnar --out lake/
+    python cli.py search-sales --item 6111234567890 --start 2024-03-01
+"""
+import argparse
+import contextlib
+import csv
+import json
+import sys
+
+import database
+import models
+
+def _rows(rows):
+    return [dict(r) for r in rows]
+
+# ---------- Commands ----------
+def cmd_backup(args):
+    path = database.backup_database(args.out)
+    return {"backup_path": path}
+
+def cmd_stats(args):
+    return database.get_database_stats()
+
+def cmd_report(args):
+    if args.name == "summary":
+        latest = models.get_latest_sale()
+        return {
+            "sales_total": models.get_sales_total(),
+            "sales_today": models.get_sales_summary_today(),
+            "sales_count": models.get_sales_count(),
+            "items_count": models.get_items_count(),
+            "latest_sale": dict(latest) if latest else None,
+        }
+    if args.name == "top-items":
+        return _rows(models.get_top_selling_items(args.limit))
+    if args.name == "by-category":
+        return _rows(models.get_sales_summary_by_category())
+    if args.name == "low-stock":
+        return _rows(models.get_low_stock_items(args.threshold))
+    if args.name == "sales-range":
+        if not (args.start and args.end):
+            raise ValueError("sales-range needs --start and --end")
+        return _rows(models.get_sales_by_date_range(args.start, args.end))
+    if args.name == "margin-daily":
+        return _rows(models.get_margin_by_day(args.start, args.end))
+    if args.name == "margin-category":
+        return _rows(models.get_margin_by_category(args.start, args.end))
+    raise ValueError(f"Unknown report: {args.name}")
+
+_EXPORT_QUERIES = {
+    "items": ("""
+        SELECT i.id, i.name, i.barcode, i.price, i.cost, i.stock_count, c.name AS category_name, i.add_date
+        FROM items i LEFT JOIN categories c ON c.id = i.category_id
+        ORDER BY i.id
+    """, False),
+    "sales": ("""
+        SELECT id, datetime, total_price FROM {sales} AS sales
+        WHERE (? IS NULL OR datetime >= ?) AND (? IS NULL OR datetime < ?)
+        ORDER BY id
+    """, True),
+    "sale-details": ("""
+        SELECT sd.id, sd.sale_id, s.datetime, sd.item_id, i.name, i.barcode, sd.quantity, sd.price_each,
+               sd.cost_each
+        FROM {sale_details} sd
+        JOIN {sales} s ON s.id = sd.sale_id
+        LEFT JOIN items i ON i.id = sd.item_id
+        WHERE (? IS NULL OR s.datetime >= ?) AND (? IS NULL OR s.datetime < ?)
+        ORDER BY sd.id
+    """, True),
+}
+
+def _export_cursors(conn, sql, params, dated, start, end):
+    """Cursors of an export query; read each one to the end before taking the next"""
+    if not dated:
+        yield conn.execute(sql, params)
+        return
+    # Sales tables: read archived periods the range reaches as well, a few archives at a time
+    for attached, hot in database.archive_batches(conn, start, end):
+        sources = {t: database.archive_source(t, attached, hot) for t in database.ARCHIVED_TABLES}
+        yield conn.execute(sql.format(**sources), params)
+
+def cmd_export(args):
+    sql, dated = _EXPORT_QUERIES[args.table]
+    # --end is inclusive of the whole day
+    end = f"{args.end}T99" if args.end else None
+    params = (args.start, args.start, end, end) if dated else ()
+    conn = database.get_connection()
+    try:
+        count = 0
+        with open(args.out, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f) if args.format == "csv" else None
+            for n, cur in enumerate(_export_cursors(conn, sql, params, dated, args.start, args.end)):
+                columns = [d[0] for d in cur.description]
+                if writer is not None:
+                    if n == 0:
+                        writer.writerow(columns)
+                    for row in cur:
+                        writer.writerow(row)
+                        count += 1
+                else:
+                    for row in cur:
+                        f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n")
+                        count += 1
+        return {"table": args.table, "rows": count, "path": args.out, "format": args.format}
+    finally:
+        conn.close()
+
+def cmd_import_items(args):
+    with open(args.file, newline="", encoding="utf-8-sig") as f:
+        rows = [r for r in csv.DictReader(f) if (r.get("name") or "").strip()]
+    result = models.import_items(rows)
+    result["rows"] = len(rows)
+    return result
+
+def cmd_maintenance(args):
+    import maintenance
+
+    if args.enable_incremental_vacuum:
+        conn = database.get_connection()
+        try:
+            return [maintenance.run_task(conn, "enable_incremental_vacuum", maintenance.enable_incremental_vacuum)]
+        finally:
+            conn.close()
+    if args.shutdown:
+        return maintenance.run_shutdown_maintenance()
+    return maintenance.run_idle_maintenance(force=args.force)
+
+def cmd_sync(args):
+    import sync
+
+    return sync.sync_databases(database.DB_NAME, args.peer, args.batch_size)
+
+def cmd_reprint(args):
+    import receipts
+
+    row = models.get_settings()
+    settings = dict(row) if row else {"shop_name": "", "contact": "", "location": "", "currency": ""}
+    sink = receipts.HtmlFileSink(args.out) if args.format == "html" else receipts.EscPosSink(args.out, width=args.width)
+    queue = receipts.PrintQueue(sink)
+    try:
+        printed = queue.reprint_sales(
+            args.sale_ids, settings["shop_name"], settings["contact"], settings["location"], settings["currency"]
+        ).result()
+    finally:
+        queue.stop()
+    return {"requested": len(args.sale_ids), "printed": printed, "path": args.out, "format": args.format}
+
+def cmd_reconcile(args):
+    result = models.reconcile_stock(full=args.full, repair=args.repair)
+    result["drift"] = _rows(models.get_stock_drift())
+    return result
+
+def cmd_invoices(args):
+    import invoices
+
+    def progress(s):
+        print(f"{s['sales']} sales, {s['files']} files", file=sys.stderr)
+
+    return invoices.export_invoices(args.out, args.start, args.end, args.mode, args.workers,
+                                    args.batch_size, progress)
+
+def _read_csv(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return list(csv.DictReader(f))
+
+def cmd_po(args):
+    if args.action == "list":
+        return _rows(models.get_purchase_orders(None if args.all else "open"))
+    if not args.file:
+        raise ValueError("po create needs a CSV file")
+    index = models.get_stock_index()
+    lines, unmatched = [], []
+    for r in _read_csv(args.file):
+        entry = index.get((r.get("barcode") or "").strip())
+        if entry is None:
+            unmatched.append(r.get("barcode"))
+            continue
+        lines.append((entry[0], float(r.get("quantity") or 0), float(r.get("cost") or 0)))
+    if not lines:
+        raise ValueError("no line of the file matches an item barcode")
+    po_id = models.create_purchase_order(args.supplier, lines)
+    return {"po_id": po_id, "lines": len(lines), "unmatched": unmatched}
+
+def cmd_receive(args):
+    import services
+
+    if args.po:
+        delivery = services.Delivery.from_purchase_order(args.po)
+        if not args.file:
+            delivery.receive_as_ordered()
+    else:
+        delivery = services.Delivery.open(args.supplier)
+    if args.supplier:
+        delivery.supplier = args.supplier
+    unmatched = delivery.import_rows(_read_csv(args.file)) if args.file else []
+    receipt_id = delivery.post(args.note)
+    return {"receipt_id": receipt_id, "po_id": args.po, "lines": len(delivery.lines),
+            "total_cost": delivery.total_cost, "unmatched": unmatched}
+
+def cmd_analytics(args):
+    import analytics
+
+    h = analytics.load_history(use_cache=not args.no_cache)
+    if args.name == "abc":
+        return analytics.abc_classification(h)[:args.limit]
+    if args.name == "velocity":
+        return analytics.sales_velocity(h, args.days, limit=args.limit)
+    if args.name == "moving-average":
+        return analytics.moving_average(h, args.window, args.item)[-args.days:]
+    if args.name == "baskets":
+        return analytics.basket_sizes(h)
+    if args.name == "heatmap":
+        return dict(zip(analytics.WEEKDAYS, analytics.hour_heatmap(h).round(2).tolist()))
+    raise ValueError(f"Unknown analysis: {args.name}")
+
+def cmd_forecast(args):
+    import analytics
+
+    result = analytics.update_forecasts(args.days, args.lead_time)
+    result["low_stock"] = _rows(models.get_low_stock_items())[:args.limit]
+    return result
+
+def cmd_archive(args):
+    import archive
+
+    if not args.period:
+        return _rows(archive.get_archives())
+
+    def progress(s):
+        print(f"{s['sales']} sales, {s['lines']} lines moved", file=sys.stderr)
+
+    return archive.archive_period(args.period, args.chunk_size, progress)
+
+def cmd_export_columnar(args):
+    import columnar
+
+    def progress(month, s):
+        print(f"{month}: {s['sales']} sales, {s['sale_details']} lines so far", file=sys.stderr)
+
+    return columnar.export_columnar(args.out, args.format, args.full, progress)
+
+def cmd_search_sales(args):
+    filters = {"sale_id": args.id, "start": args.start, "end": args.end,
+               "amount_min": args.min, "amount_max": args.max, "item": args.item}
+    return {
+        "count": models.count_sales(**filters),
+        "sales": _rows(models.search_sales(**filters, before_id=args.before, limit=args.limit)),
+    }
+
+# ---------- Entry point ----------
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cli.py", description="Store manager batch operations")
+    parser.add_argument("--db", default=database.DB_NAME, help="database file (default: store.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("backup", help="consistent copy of the database")
+    p.add_argument("--out", help="backup file path (default: store_backup_<timestamp>.db)")
+    p.set_defaults(func=cmd_backup)
+
+    p = sub.add_parser("stats", help="table counts, size, fragmentation and WAL size")
+    p.set_defaults(func=cmd_stats)
+
+    p = sub.add_parser("report", help="sales and stock reports")
+    p.add_argument("name", choices=("summary", "top-items", "by-category", "low-stock", "sales-range",
+                                    "margin-daily", "margin-category"))
+    p.add_argument("--limit", type=int, default=10)
+    p.add_argument("--threshold", type=float, default=models.LOW_STOCK_THRESHOLD,
+                   help="low-stock level of items without a forecast")
+    p.add_argument("--start", help="YYYY-MM-DD")
+    p.add_argument("--end", help="YYYY-MM-DD (inclusive)")
+    p.set_defaults(func=cmd_report)
+
+    p = sub.add_parser("export", help="export a table to CSV or JSON lines")
+    p.add_argument("table", choices=sorted(_EXPORT_QUERIES))
+    p.add_argument("--out", required=True)
+    p.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+    p.add_argument("--start", help="YYYY-MM-DD (sales tables only)")
+    p.add_argument("--end", help="YYYY-MM-DD, inclusive (sales tables only)")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("import-items", help="insert/update items from a CSV file")
+    p.add_argument("file", help="CSV with columns name, barcode, price, stock_count, category")
+    p.set_defaults(func=cmd_import_items)
+
+    p = sub.add_parser("maintenance", help="checkpoint, optimize, vacuum and check")
+    p.add_argument("--force", action="store_true", help="run all idle tasks even if not due")
+    p.add_argument("--shutdown", action="store_true", help="run the end-of-day tasks (TRUNCATE checkpoint)")
+    p.add_argument("--enable-incremental-vacuum", action="store_true",
+                   help="convert the database to auto_vacuum=INCREMENTAL (rewrites the file)")
+    p.set_defaults(func=cmd_maintenance)
+
+    p = sub.add_parser("sync", help="exchange changes with another replica database file")
+    p.add_argument("peer", help="path of the other replica")
+    p.add_argument("--batch-size", type=int, default=500)
+    p.set_defaults(func=cmd_sync)
+
+    p = sub.add_parser("reprint", help="print receipts of saved sales")
+    p.add_argument("sale_ids", nargs="+", type=int)
+    p.add_argument("--out", required=True, help="printer device, pty or file to append to")
+    p.add_argument("--format", choices=("escpos", "html"), default="escpos")
+    p.add_argument("--width", type=int, default=48, help="characters per line (32 for 58 mm paper)")
+    p.set_defaults(func=cmd_reprint)
+
+    p = sub.add_parser("reconcile", help="find (and optionally repair) stock drift")
+    p.add_argument("--full", action="store_true", help="check every item, not only changed ones")
+    p.add_argument("--repair", action="store_true", help="set drifted stock to the expected value")
+    p.set_defaults(func=cmd_reconcile)
+
+    p = sub.add_parser("invoices", help="PDF invoices for past sales (resumable)")
+    p.add_argument("--out", required=True, help="output directory (holds the resume manifest)")
+    p.add_argument("--start", help="YYYY-MM-DD")
+    p.add_argument("--end", help="YYYY-MM-DD (inclusive)")
+    p.add_argument("--mode", choices=("per-sale", "merged"), default="per-sale")
+    p.add_argument("--workers", type=int, help="render processes (default: CPU count)")
+    p.add_argument("--batch-size", type=int, default=50, help="sales per render task")
+    p.set_defaults(func=cmd_invoices)
+
+    p = sub.add_parser("po", help="create or list purchase orders")
+    p.add_argument("action", choices=("create", "list"))
+    p.add_argument("file", nargs="?", help="CSV with columns barcode, quantity, cost")
+    p.add_argument("--supplier")
+    p.add_argument("--all", action="store_true", help="list received orders too")
+    p.set_defaults(func=cmd_po)
+
+    p = sub.add_parser("receive", help="post a goods delivery to stock in one transaction")
+    p.add_argument("file", nargs="?", help="CSV with columns barcode, quantity, cost (optional with --po)")
+    p.add_argument("--po", type=int, help="purchase order being delivered (without a file: as ordered)")
+    p.add_argument("--supplier")
+    p.add_argument("--note")
+    p.set_defaults(func=cmd_receive)
+
+    p = sub.add_parser("analytics", help="vectorized sales analytics over all history (needs NumPy)")
+    p.add_argument("name", choices=("abc", "velocity", "moving-average", "baskets", "heatmap"))
+    p.add_argument("--days", type=int, default=30, help="velocity window / days of moving average shown")
+    p.add_argument("--window", type=int, default=7, help="moving average window in days")
+    p.add_argument("--item", type=int, help="moving average of one item id")
+    p.add_argument("--limit", type=int, default=100)
+    p.add_argument("--no-cache", action="store_true", help="read all lines, don't use or update the cache")
+    p.set_defaults(func=cmd_analytics)
+
+    p = sub.add_parser("forecast", help="recompute demand forecasts and reorder points (needs NumPy)")
+    p.add_argument("--days", type=int, default=90, help="days of sales history to use")
+    p.add_argument("--lead-time", type=int, default=7, help="days from ordering to delivery")
+    p.add_argument("--limit", type=int, default=20, help="low-stock items to list")
+    p.set_defaults(func=cmd_forecast)
+
+    p = sub.add_parser("archive", help="move a closed period of sales into an archive database")
+    p.add_argument("period", nargs="?", help="YYYY or YYYY-MM (omit to list archives)")
+    p.add_argument("--chunk-size", type=int, default=1000, help="sales moved per transaction")
+    p.set_defaults(func=cmd_archive)
+
+    p = sub.add_parser("export-columnar", help="sales history as month-partitioned Parquet / Arrow files")
+    p.add_argument("--out", required=True, help="output directory (holds the incremental state)")
+    p.add_argument("--format", choices=("parquet", "arrow"), default="parquet")
+    p.add_argument("--full", action="store_true", help="rewrite every month, not only new or changed ones")
+    p.set_defaults(func=cmd_export_columnar)
+
+    p = sub.add_parser("search-sales", help="find sales by id, day range, amount or contained item")
+    p.add_argument("--id", type=int)
+    p.add_argument("--start", help="YYYY-MM-DD")
+    p.add_argument("--end", help="YYYY-MM-DD (inclusive)")
+    p.add_argument("--min", type=float, help="minimum sale total")
+    p.add_argument("--max", type=float, help="maximum sale total")
+    p.add_argument("--item", help="sales with an item whose name contains this or whose barcode starts with it")
+    p.add_argument("--before", type=int, help="next page: sales with a smaller id than this")
+    p.add_argument("--limit", type=int, default=50)
+    p.set_defaults(func=cmd_search_sales)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    database.DB_NAME = args.db
+    try:
+        # setup_database reports progress with print(); keep stdout pure JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            database.setup_database()
+        result = args.func(args)
+        status = 0
+    except Exception as e:
+        result = {"error": str(e), "type": type(e).__name__}
+        status = 1
+    finally:
+        database.shutdown_writers()
+    json.dump({"command": args.command, "ok": status == 0, "result": result},
+              sys.stdout, ensure_ascii=False, default=str)
+    sys.stdout.write("\n")
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+# columnar.py
+"""
+Columnar export of the sales history for offline analysis.
+
+Writes sales and sale_details partitioned by sale month, plus snapshots of
+items and categories, as Parquet (zstd) or Arrow IPC files in a Hive-style
+layout that pyarrow.dataset, DuckDB, Polars or Spark read directly:
+
+    out/sales/month=2024-01/part.parquet
+    out/sale_details/month=2024-01/part.parquet
+    out/items/part.parquet
+    out/categories/part.parquet
+
+Rows are streamed from SQLite BATCH_ROWS at a time into the file writer,
+so memory stays flat however large a month is. Archived periods (see
+archive.py) are included. export_state.json in the output directory keeps
+a fingerprint per month (quantity and revenue of its sale lines). A later
+run writes only months that are new or whose lines changed, and always the
+current month. Files are written under a temporary name and renamed, so a
+partition is never half written.
+
+    python cli.py export-columnar --out lake/ --format parquet
+
+pyarrow is optional for the rest of the application; only this module needs it.
+"""
+import json
+import os
+import time
+from datetime import date, timedelta
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+import database
+
+BATCH_ROWS = 50_000     # Rows per record batch
+STATE_NAME = "export_state.json"
+FORMATS = {"parquet": "parquet", "arrow": "arrow"}  # format -> file extension
+
+# (column, arrow type name); timestamps are read as ISO text and cast
+_SCHEMAS = {
+    "sales": [("id", "int64"), ("datetime", "timestamp"), ("total_price", "float64"),
+              ("created_at", "string")],
+    "sale_details": [("id", "int64"), ("sale_id", "int64"), ("item_id", "int64"),
+                     ("quantity", "float64"), ("price_each", "float64"), ("cost_each", "float64"),
+                     ("sale_datetime", "timestamp"), ("created_at", "string")],
+    "items": [("id", "int64"), ("name", "string"), ("barcode", "string"), ("category_id", "int64"),
+              ("price", "float64"), ("cost", "float64"), ("stock_count", "float64"),
+              ("add_date", "string"), ("updated_at", "string")],
+    "categories": [("id", "int64"), ("name", "string"), ("created_at", "string")],
+}
+
+_MONTH_SQL = {
+    "sales": """
+        SELECT id, datetime, total_price, created_at FROM {sales} AS s
+        WHERE datetime >= ? AND datetime < ? ORDER BY id
+    """,
+    "sale_details": """
+        SELECT sd.id, sd.sale_id, sd.item_id, sd.quantity, sd.price_each, sd.cost_each,
+               s.datetime, sd.created_at
+        FROM {sales} AS s JOIN {sale_details} AS sd ON sd.sale_id = s.id
+        WHERE s.datetime >= ? AND s.datetime < ? ORDER BY sd.id
+    """,
+}
+
+_SNAPSHOT_SQL = {
+    "items": """
+        SELECT id, name, barcode, category_id, price, cost, stock_count, add_date, updated_at
+        FROM items ORDER BY id
+    """,
+    "categories": "SELECT id, name, created_at FROM categories ORDER BY id",
+}
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("columnar export needs pyarrow (pip install pyarrow)")
+
+def _schema(table):
+    types = {"int64": pa.int64(), "float64": pa.float64(), "string": pa.string(),
+             "timestamp": pa.timestamp("s")}
+    return pa.schema([(name, types[t]) for name, t in _SCHEMAS[table]])
+
+def _record_batch(rows, schema):
+    columns = list(zip(*rows))
+    arrays = []
+    for field, values in zip(schema, columns):
+        if pa.types.is_timestamp(field.type):
+            arrays.append(pa.array(values, pa.string()).cast(field.type))
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def _chunks(cursor):
+    while True:
+        rows = cursor.fetchmany(BATCH_ROWS)
+        if not rows:
+            break
+        yield rows
+
+def _write(chunks, table, path, fmt):
+    """Stream chunks of rows into one file; returns the row count"""
+    schema = _schema(table)
+    tmp_path = path + ".tmp"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(tmp_path, schema, compression="zstd")
+        write_batch = writer.write_batch
+    else:
+        sink = pa.OSFile(tmp_path, "wb")
+        writer = pa.ipc.new_file(sink, schema)
+        write_batch = writer.write_batch
+    count = 0
+    try:
+        for rows in chunks:
+            write_batch(_record_batch(rows, schema))
+            count += len(rows)
+    finally:
+        writer.close()
+        if fmt != "parquet":
+            sink.close()
+    os.replace(tmp_path, path)
+    return count
+
+def _next_month(month):
+    year, m = (int(p) for p in month.split("-"))
+    return f"{year + m // 12:04d}-{m % 12 + 1:02d}"
+
+def _month_chunks(conn, sql, month):
+    """Row chunks of a month query over the hot database and the archives the month reaches"""
+    bounds = (f"{month}-01", f"{_next_month(month)}-01")
+    last_day = (date.fromisoformat(bounds[1]) - timedelta(days=1)).isoformat()
+    for attached, hot in database.archive_batches(conn, bounds[0], last_day):
+        sources = {t: database.archive_source(t, attached, hot) for t in database.ARCHIVED_TABLES}
+        yield from _chunks(conn.execute(sql.format(**sources), bounds))
+
+def _month_fingerprints(conn):
+    """{month: [quantity, revenue]} of sale lines, from the maintained daily aggregates"""
+    rows = conn.execute("""
+        SELECT substr(day, 1, 7), ROUND(SUM(quantity), 6), ROUND(SUM(revenue), 6)
+        FROM sales_margin_daily GROUP BY 1 ORDER BY 1
+    """).fetchall()
+    return {r[0]: [r[1], r[2]] for r in rows}
+
+def _load_state(out_dir):
+    try:
+        with open(os.path.join(out_dir, STATE_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_state(out_dir, state):
+    tmp_path = os.path.join(out_dir, STATE_NAME + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp_path, os.path.join(out_dir, STATE_NAME))
+
+def export_columnar(out_dir, fmt="parquet", full=False, progress=None):
+    """
+    Export to out_dir. Unless full, months already exported with an
+    unchanged fingerprint are skipped. Returns a summary.
+    """
+    _require_pyarrow()
+    ext = FORMATS[fmt]
+    os.makedirs(out_dir, exist_ok=True)
+    state = {} if full else _load_state(out_dir)
+    if state.get("format") not in (None, fmt):
+        state = {}  # Other format in this directory: start over
+    months_state = state.get("months", {})
+    current_month = date.today().isoformat()[:7]
+    summary = {"out_dir": out_dir, "format": fmt, "months_written": 0, "months_skipped": 0,
+               "sales": 0, "sale_details": 0}
+    started = time.monotonic()
+
+    conn = database.get_report_connection()
+    conn.row_factory = None
+    try:
+        for month, fingerprint in _month_fingerprints(conn).items():
+            if month != current_month and months_state.get(month) == fingerprint:
+                summary["months_skipped"] += 1
+                continue
+            for table, sql in _MONTH_SQL.items():
+                path = os.path.join(out_dir, table, f"month={month}", f"part.{ext}")
+                summary[table] += _write(_month_chunks(conn, sql, month), table, path, fmt)
+            months_state[month] = fingerprint
+            summary["months_written"] += 1
+            # Saved after every month, so an interrupted export resumes where it stopped
+            _save_state(out_dir, {"format": fmt, "months": months_state})
+            if progress:
+                progress(month, summary)
+        for table, sql in _SNAPSHOT_SQL.items():
+            summary[table] = _write(_chunks(conn.execute(sql)), table, os.path.join(out_dir, table, f"part.{ext}"), fmt)
+    finally:
+        conn.close()
+
+    _save_state(out_dir, {"format": fmt, "months": months_state,
+                          "exported_at": date.today().isoformat()})
+    summary["elapsed_s"] = round(time.monotonic() - started, 2)
+    return summary
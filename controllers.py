@@ -1,14 +1,20 @@
 # controllers.py (fixed custom price calculation)
+import csv
 import os
-from datetime import datetime
+import sys
+from datetime import date, datetime
 from PyQt5.QtWidgets import QFileDialog, QTableWidgetItem, QMessageBox, QInputDialog, QCompleter
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer, QObject, pyqtSignal
 from PyQt5.QtGui import QFont
-from PyQt5.QtPrintSupport import QPrinter, QPrintDialog
-from PyQt5.QtGui import QTextDocument
 
 from ui_main import MainUI
+import database
 import models
+import receipts
+from services import (
+    ServiceError, CartRegister, CheckoutService, InventoryService, SalesAmendmentService, StocktakeSession,
+    Delivery, fmt_qty, fmt_money, stock_status
+)
 
 try:
     import cv2
@@ -23,23 +29,79 @@ except Exception:
 ASSETS_PHOTOS_DIR = os.path.join("assets", "photos")
 os.makedirs(ASSETS_PHOTOS_DIR, exist_ok=True)
 
-ALLOWED_BARCODE_LENGTHS = {8, 12, 13}
+WATCH_INTERVAL_MS = 1000  # How often the database is checked for changes by other processes
 
-def is_valid_barcode(code: str) -> bool:
-    return code.isdigit() and (len(code) in ALLOWED_BARCODE_LENGTHS)
+STOCK_PAGE_SIZE = 100  # Items per stock table window
+# Stock table column -> models.ITEM_SORT_COLUMNS key (status sorts by stock level)
+STOCK_SORT_COLUMNS = {1: "name", 2: "category", 3: "barcode", 4: "price", 5: "stock", 6: "stock", 8: "add_date"}
 
-def fmt_qty(val):
-    return f"{val:.0f}" if val == int(val) else f"{val:.1f}"
+SALES_PAGE_SIZE = 200      # Sales per sales table page
+SALES_COUNT_LIMIT = 10000  # Matches counted for the page label; beyond it shown as "more than"
 
-def fmt_money(val):
-    return f"{val:.0f}" if val == int(val) else f"{val:.2f}"
+# Tables shown by each view that refreshes itself when they change
+VIEW_TABLES = {
+    "stock": ("categories", "items", "item_forecasts"),
+    "sales": ("sales", "sale_details"),
+}
+
+class ChangeWatcher(QObject):
+    """Polls the database and emits tables_changed([table, ...]) after any commit to them"""
+    tables_changed = pyqtSignal(list)
+
+    def __init__(self, parent=None, interval_ms=WATCH_INTERVAL_MS):
+        super().__init__(parent)
+        self.detector = database.ChangeDetector()
+        self._last = self.detector.versions()
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self.poll)
+        self._timer.start(interval_ms)
+
+    def versions(self):
+        return self.detector.versions()
+
+    def poll(self):
+        try:
+            current = self.detector.versions()
+        except Exception as e:
+            print(f"Change watcher: {e}", file=sys.stderr)
+            return
+        changed = sorted(t for t, v in current.items() if self._last.get(t) != v)
+        self._last = current
+        if changed:
+            self.tables_changed.emit(changed)
 
 class Controller(MainUI):
+    # Emitted from the printer thread; Qt queues it to the GUI thread
+    print_failed = pyqtSignal(list, str)
+
     def __init__(self):
         super().__init__()
 
         self.currency = "د.ج"
-        self.current_bill_items = []  # List to track items in the current bill
+        self.carts = CartRegister()  # Current bill plus parked ones, journaled
+        self.checkout_service = CheckoutService()
+        self.inventory = InventoryService()
+        self.sales_amendments = SalesAmendmentService()
+        self.print_queue = receipts.PrintQueue(
+            receipts.default_sink(), on_error=lambda failed, e: self.print_failed.emit(failed, str(e))
+        )
+        self._unprinted = []  # Receipts of failed print jobs, offered for reprint
+        self._print_warning = None
+        self.print_failed.connect(self._on_print_failed)
+
+        # Views remember the table versions they show and reload when those move,
+        # whichever process wrote; hidden views catch up when their tab is opened
+        self._view_versions = {}
+        self.watcher = ChangeWatcher(self)
+        self.watcher.tables_changed.connect(self._on_tables_changed)
+        self.tabs.currentChanged.connect(lambda _: self._refresh_stale_views())
+
+        # Stock table window: filters, sort and page all run in SQL
+        self._stock_page = 0
+        self._stock_sort = ("id", True)  # (models.ITEM_SORT_COLUMNS key, descending)
+        # Sales table pages: before_id of each page opened so far (keyset paging)
+        self._sales_pages = [None]
+        self._sales_last_id = None
 
         # Setup window controls
         self.btn_min.clicked.connect(self.showMinimized)
@@ -63,6 +125,11 @@ class Controller(MainUI):
         self.btn_print_bill.clicked.connect(self._bill_print)
         self.btn_scanner_info.clicked.connect(self._show_scanner_info)
         self.btn_add_custom.clicked.connect(self._add_custom_item)
+        self.btn_bill_park.clicked.connect(self._bill_park)
+        self.btn_bill_resume.clicked.connect(self._bill_resume)
+
+        # Restore open bills left by a crash or restart once the window is up
+        QTimer.singleShot(0, self._bill_offer_recovery)
 
         # Manual price checkbox signal
         self.chk_manual.stateChanged.connect(self._toggle_manual_price)
@@ -82,21 +149,88 @@ class Controller(MainUI):
         self.btn_stk_delete.clicked.connect(self._stock_delete)
         self.btn_stk_refresh.clicked.connect(self._load_stock_table)
         self.tbl_stock.clicked.connect(self._stock_fill_form_from_selection)
+        self.btn_stk_prev.clicked.connect(lambda: self._stock_go_page(-1))
+        self.btn_stk_next.clicked.connect(lambda: self._stock_go_page(1))
+        self.tbl_stock.horizontalHeader().sectionClicked.connect(self._stock_sort_by)
+        self.tbl_stock.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        # Typing is debounced; choosing from a list filters at once
+        self._stock_filter_timer = QTimer(self)
+        self._stock_filter_timer.setSingleShot(True)
+        self._stock_filter_timer.setInterval(250)
+        self._stock_filter_timer.timeout.connect(self._stock_apply_filters)
+        self.stk_filter_text.textChanged.connect(lambda _: self._stock_filter_timer.start())
+        self.stk_filter_price_min.valueChanged.connect(lambda _: self._stock_filter_timer.start())
+        self.stk_filter_price_max.valueChanged.connect(lambda _: self._stock_filter_timer.start())
+        self.cmb_stk_filter_cat.currentIndexChanged.connect(lambda _: self._stock_apply_filters())
+        self.cmb_stk_filter_status.currentIndexChanged.connect(lambda _: self._stock_apply_filters())
 
         # Sales signals
         self.btn_sale_refresh.clicked.connect(self._load_sales_tab)
         self.btn_sale_view.clicked.connect(self._sales_view_selected)
+        self.btn_sale_reprint.clicked.connect(self._sales_reprint_selected)
         self.btn_sale_delete.clicked.connect(self._sales_delete_selected)
         self.btn_sale_delete_item.clicked.connect(self._sales_delete_item)
         self.btn_sale_update_item.clicked.connect(self._sales_update_item)
         self.tbl_sales.itemSelectionChanged.connect(self._sales_view_selected)
+        self.btn_sales_prev.clicked.connect(self._sales_prev_page)
+        self.btn_sales_next.clicked.connect(self._sales_next_page)
+        self._sales_search_timer = QTimer(self)
+        self._sales_search_timer.setSingleShot(True)
+        self._sales_search_timer.setInterval(300)
+        self._sales_search_timer.timeout.connect(self._sales_apply_search)
+        for edit in (self.sales_filter_id, self.sales_filter_item, self.sales_filter_from, self.sales_filter_to):
+            edit.textChanged.connect(lambda _: self._sales_search_timer.start())
+        for spin in (self.sales_filter_min, self.sales_filter_max):
+            spin.valueChanged.connect(lambda _: self._sales_search_timer.start())
 
         # Settings
         self.btn_settings_save.clicked.connect(self._save_settings_from_tab)
 
+        # Stocktake
+        self.stocktake = None
+        self._stocktake_rows = {}  # item_id -> table row
+        self.btn_st_start.clicked.connect(self._stocktake_start)
+        self.btn_st_commit.clicked.connect(self._stocktake_commit)
+        self.btn_st_cancel.clicked.connect(self._stocktake_cancel)
+        self.st_barcode.returnPressed.connect(self._stocktake_scan)
+        self._stocktake_set_enabled(False)
+
+        # Receiving
+        self.delivery = None
+        self._receiving_rows = {}  # item_id -> table row
+        self.btn_rcv_start.clicked.connect(self._receiving_start)
+        self.btn_rcv_import.clicked.connect(self._receiving_import)
+        self.btn_rcv_as_ordered.clicked.connect(self._receiving_as_ordered)
+        self.btn_rcv_post.clicked.connect(self._receiving_post)
+        self.btn_rcv_cancel.clicked.connect(self._receiving_close)
+        self.rcv_barcode.returnPressed.connect(self._receiving_scan)
+        self._receiving_refresh_orders()
+        self._receiving_set_enabled(False)
+
         # Responsive tables
         self._setup_responsive_tables()
 
+    def _view_loaders(self):
+        return {
+            "stock": (self.tbl_stock, self._load_stock_table),
+            "sales": (self.tbl_sales, self._load_sales_tab),
+        }
+
+    def _mark_view_loaded(self, view):
+        """Record the versions a view is about to show (taken before it reads)"""
+        self._view_versions[view] = self.watcher.versions()
+
+    def _refresh_stale_views(self):
+        current = self.watcher.versions()
+        for view, (table, load) in self._view_loaders().items():
+            seen = self._view_versions.get(view, {})
+            if table.isVisible() and any(current.get(t) != seen.get(t) for t in VIEW_TABLES[view]):
+                load()
+
+    def _on_tables_changed(self, tables):
+        if any(t in tables for view_tables in VIEW_TABLES.values() for t in view_tables):
+            self._refresh_stale_views()
+
     def _setup_autocomplete(self):
         # Setup autocomplete with just product names, not barcodes
         all_items = models.get_items()
@@ -109,6 +243,11 @@ class Controller(MainUI):
         # Connect completer selection to fill other fields
         completer.activated.connect(self._on_autocomplete_selected)
 
+    @property
+    def cart(self):
+        """The bill shown in the bill tab"""
+        return self.carts.active
+
     def _toggle_max_restore(self):
         if self.isMaximized():
             self.showNormal()
@@ -195,6 +334,15 @@ class Controller(MainUI):
         self.stk_cat.clear()
         for c in cats:
             self.stk_cat.addItem(c["name"], c["id"])
+        # The filter list keeps its selection and doesn't re-run the query
+        selected = self.cmb_stk_filter_cat.currentData()
+        self.cmb_stk_filter_cat.blockSignals(True)
+        self.cmb_stk_filter_cat.clear()
+        self.cmb_stk_filter_cat.addItem("كل التصنيفات", None)
+        for c in cats:
+            self.cmb_stk_filter_cat.addItem(c["name"], c["id"])
+        self.cmb_stk_filter_cat.setCurrentIndex(max(0, self.cmb_stk_filter_cat.findData(selected)))
+        self.cmb_stk_filter_cat.blockSignals(False)
 
     def _add_new_category(self):
         name, ok = QInputDialog.getText(self, "تصنيف جديد", "اسم التصنيف:")
@@ -246,27 +394,17 @@ class Controller(MainUI):
     def _stock_add(self):
         try:
             name = self.stk_name.text().strip()
-            if not name:
-                self.msg("تنبيه", "الرجاء إدخال الاسم.")
-                return
             barcode = self.stk_barcode.text().strip()
-            if barcode and not is_valid_barcode(barcode):
-                self.msg("خطأ", "الباركود غير صالح")
-                return
             cat_id = self.stk_cat.currentData()
             price = float(self.stk_price.value())
             qty = float(self.stk_qty.value())
-            
-            # Prevent negative stock
-            if qty < 0:
-                self.msg("خطأ", "لا يمكن إضافة كمية مخزون سالبة.")
-                return
-                
             photo = self.stk_photo.text().strip() or None
-            models.add_item(name, cat_id, barcode or None, price, qty, photo)
+            self.inventory.add_item(name, cat_id, barcode, price, qty, photo)
             self._load_stock_table()
             self.msg("تم", "تمت إضافة الصنف.")
             self._clear_stock_form()
+        except ServiceError as e:
+            self.msg("تنبيه", str(e))
         except Exception as e:
             QMessageBox.warning(self, "خطأ", f"تعذر إضافة الصنف:\n{e}")
 
@@ -278,26 +416,16 @@ class Controller(MainUI):
         item_id = int(self.tbl_stock.item(row, 0).text())
         try:
             name = self.stk_name.text().strip()
-            if not name:
-                self.msg("تنبيه", "الرجاء إدخال الاسم.")
-                return
             barcode = self.stk_barcode.text().strip()
-            if barcode and not is_valid_barcode(barcode):
-                self.msg("خطأ", "الباركود غير صالح")
-                return
             cat_id = self.stk_cat.currentData()
             price = float(self.stk_price.value())
             qty = float(self.stk_qty.value())
-            
-            # Prevent negative stock
-            if qty < 0:
-                self.msg("خطأ", "لا يمكن إضافة كمية مخزون سالبة.")
-                return
-                
             photo = self.stk_photo.text().strip() or None
-            models.update_item(item_id, name, cat_id, barcode or None, price, qty, photo)
+            self.inventory.update_item(item_id, name, cat_id, barcode, price, qty, photo)
             self._load_stock_table()
             self.msg("تم", "تم تعديل الصنف.")
+        except ServiceError as e:
+            self.msg("تنبيه", str(e))
         except Exception as e:
             QMessageBox.warning(self, "خطأ", f"تعذر تعديل الصنف:\n{e}")
 
@@ -339,8 +467,42 @@ class Controller(MainUI):
         self.stk_photo.setText(self.tbl_stock.item(row, 7).text())
         self.set_preview_image(self.tbl_stock.item(row, 7).text())
 
+    def _stock_filters(self):
+        return {
+            "text": self.stk_filter_text.text().strip() or None,
+            "category_id": self.cmb_stk_filter_cat.currentData(),
+            "status": self.cmb_stk_filter_status.currentData(),
+            "price_min": self.stk_filter_price_min.value() or None,
+            "price_max": self.stk_filter_price_max.value() or None,
+        }
+
+    def _stock_apply_filters(self):
+        self._stock_page = 0
+        self._load_stock_table()
+
+    def _stock_go_page(self, step):
+        self._stock_page = max(0, self._stock_page + step)
+        self._load_stock_table()
+
+    def _stock_sort_by(self, column):
+        sort = STOCK_SORT_COLUMNS.get(column)
+        if sort is None:
+            return
+        current, descending = self._stock_sort
+        descending = not descending if sort == current else False
+        self._stock_sort = (sort, descending)
+        self.tbl_stock.horizontalHeader().setSortIndicator(column, Qt.DescendingOrder if descending else Qt.AscendingOrder)
+        self._stock_apply_filters()
+
     def _load_stock_table(self):
-        items = models.get_items()
+        self._mark_view_loaded("stock")
+        filters = self._stock_filters()
+        total = models.count_items(**filters)
+        pages = max(1, -(-total // STOCK_PAGE_SIZE))
+        self._stock_page = min(self._stock_page, pages - 1)
+        sort, descending = self._stock_sort
+        items = models.query_items(**filters, sort=sort, descending=descending,
+                                   limit=STOCK_PAGE_SIZE, offset=self._stock_page * STOCK_PAGE_SIZE)
         self.tbl_stock.setRowCount(0)
         for r in items:
             row = self.tbl_stock.rowCount()
@@ -360,15 +522,27 @@ class Controller(MainUI):
                 stock_item.setForeground(Qt.red)
             self.tbl_stock.setItem(row, 5, stock_item)
             
-            status_text = "نفد المخزون" if stock_count <= 0 else "متاح"
+            # Low means at or below the item's forecast reorder point
+            status, days_left = stock_status(stock_count, r["reorder_point"], r["demand_per_day"])
+            if status == "out":
+                status_text = "نفد المخزون"
+            elif status == "low":
+                status_text = "منخفض" + (f" - يكفي {days_left:.0f} يوم" if days_left is not None else "")
+            else:
+                status_text = "متاح"
             status_item = QTableWidgetItem(status_text)
-            if stock_count <= 0:
+            if status == "out":
                 status_item.setForeground(Qt.red)
+            elif status == "low":
+                status_item.setForeground(Qt.darkYellow)
             self.tbl_stock.setItem(row, 6, status_item)
             self.tbl_stock.setItem(row, 7, QTableWidgetItem(r["photo_path"] or ""))
             self.tbl_stock.setItem(row, 8, QTableWidgetItem(r["add_date"] or ""))
             self.tbl_stock.setItem(row, 9, QTableWidgetItem(str(r["category_id"] or "")))
             self.tbl_stock.setRowHeight(row, 40)
+        self.lbl_stk_page.setText(f"الصفحة {self._stock_page + 1} من {pages} ({total} صنف)")
+        self.btn_stk_prev.setEnabled(self._stock_page > 0)
+        self.btn_stk_next.setEnabled(self._stock_page < pages - 1)
         self._update_table_responsiveness()
 
     # Bill Methods
@@ -465,10 +639,7 @@ class Controller(MainUI):
             self.msg("خطأ", "الرجاء إدخال اسم المنتج.")
             return
         
-        if not barcode:
-            # Generate a temporary barcode for custom items
-            from datetime import datetime
-            barcode = f"TEMP_{datetime.now().strftime('%H%M%S')}"
+        barcode = self.inventory.custom_barcode(barcode)
         
         # Ask if user wants to save to database
         reply = QMessageBox.question(
@@ -481,12 +652,7 @@ class Controller(MainUI):
         if reply == QMessageBox.Yes:
             # Save to database
             try:
-                # Get default category (uncategorized)
-                default_cat = models.get_category_by_name("غير مصنّف")
-                cat_id = default_cat["id"] if default_cat else None
-                
-                # Add to database
-                models.add_item(name, cat_id, barcode or None, price, 0, None)
+                self.inventory.save_custom_item(name, barcode, price)
                 self.msg("تم", "تم حفظ المنتج في قاعدة البيانات.")
                 self._load_stock_table()
             except Exception as e:
@@ -498,52 +664,12 @@ class Controller(MainUI):
 
     def _bill_add_custom_item(self, name, barcode, price):
         """Add custom item to bill (not in database)"""
-        qty = float(self.in_qty.value())
-        
-        if not name or qty <= 0:
-            self.msg("خطأ", "الرجاء إدخال اسم المنتج وكمية صحيحة.")
+        try:
+            row, line, merged = self.cart.add_custom(name, barcode, price, float(self.in_qty.value()))
+        except ServiceError as e:
+            self.msg("خطأ", str(e))
             return
-        
-        # Add to bill table
-        row = self.tbl_bill.rowCount()
-        self.tbl_bill.insertRow(row)
-        
-        # Calculate total
-        total = price * qty
-        
-        # Add items to table
-        self.tbl_bill.setItem(row, 0, QTableWidgetItem(barcode or ""))
-        name_item = QTableWidgetItem(name)
-        name_item.setFont(self._bill_name_font)
-        self.tbl_bill.setItem(row, 1, name_item)
-        self.tbl_bill.setItem(row, 2, QTableWidgetItem(fmt_money(price)))
-        self.tbl_bill.setItem(row, 3, QTableWidgetItem(fmt_qty(qty)))
-        self.tbl_bill.setItem(row, 4, QTableWidgetItem(fmt_money(total)))
-        self.tbl_bill.setItem(row, 5, QTableWidgetItem("CUSTOM"))  # Mark as custom item
-        
-        # Add to internal tracking
-        self.current_bill_items.append({
-            "id": -1,  # Custom items have negative ID
-            "name": name,
-            "barcode": barcode,
-            "price": price,
-            "qty": qty,
-            "total": total,
-            "is_custom": True
-        })
-        
-        # Recalculate total
-        self._bill_recalc_total()
-        
-        # Clear input fields for next item
-        self.in_barcode.clear()
-        self.in_name.clear()
-        self.in_qty.setValue(1.0)
-        self.in_price.setValue(0.0)
-        self.chk_manual.setChecked(False)
-        
-        # Set focus back to barcode field
-        self.in_barcode.setFocus()
+        self._bill_show_line(row, line, merged)
 
     def _bill_add(self):
         # Get item details
@@ -552,57 +678,23 @@ class Controller(MainUI):
         price = float(self.in_price.value())
         qty = float(self.in_qty.value())
         
-        if not name or qty <= 0:
-            self.msg("خطأ", "الرجاء إدخال اسم المنتج وكمية صحيحة.")
-            return
-        
-        # Check if item exists in database
-        item = None
-        if barcode:
-            item = models.get_item_by_barcode(barcode)
-        if not item and name:
-            items = models.search_items_by_name(name)
-            if items:
-                item = items[0]
-        
-        if not item:
-            # Item not in database, add as custom item
-            self._bill_add_custom_item(name, barcode, price)
-            return
-        
-        # Check stock availability
-        available_stock = max(0, item["stock_count"] or 0)  # Ensure stock is never negative
-        if qty > available_stock:
-            self.msg("خطأ", f"الكمية المطلوبة ({qty}) أكبر من المخزون المتاح ({available_stock}).")
+        # Items not in the database are added as custom items
+        try:
+            row, line, merged = self.cart.add(name, barcode, price, qty)
+        except ServiceError as e:
+            self.msg("خطأ", str(e))
             return
-        
-        # Add to bill table
-        row = self.tbl_bill.rowCount()
-        self.tbl_bill.insertRow(row)
-        
-        # Calculate total
-        total = price * qty
-        
-        # Add items to table
-        self.tbl_bill.setItem(row, 0, QTableWidgetItem(barcode or ""))
-        name_item = QTableWidgetItem(name)
-        name_item.setFont(self._bill_name_font)
-        self.tbl_bill.setItem(row, 1, name_item)
-        self.tbl_bill.setItem(row, 2, QTableWidgetItem(fmt_money(price)))
-        self.tbl_bill.setItem(row, 3, QTableWidgetItem(fmt_qty(qty)))
-        self.tbl_bill.setItem(row, 4, QTableWidgetItem(fmt_money(total)))
-        self.tbl_bill.setItem(row, 5, QTableWidgetItem(str(item["id"])))
-        
-        # Add to internal tracking
-        self.current_bill_items.append({
-            "id": item["id"],
-            "name": name,
-            "barcode": barcode,
-            "price": price,
-            "qty": qty,
-            "total": total,
-            "is_custom": False
-        })
+        self._bill_show_line(row, line, merged)
+
+    def _bill_show_line(self, row, line, merged):
+        """Insert a new bill row, or refresh qty/total of a merged one, and reset the inputs"""
+        if merged:
+            # Only the changed cells of the existing row are touched
+            self.tbl_bill.item(row, 3).setText(fmt_qty(line.qty))
+            self.tbl_bill.item(row, 4).setText(fmt_money(line.total))
+        else:
+            self._bill_insert_row(row, line)
+        self.tbl_bill.selectRow(row)
         
         # Recalculate total
         self._bill_recalc_total()
@@ -617,51 +709,108 @@ class Controller(MainUI):
         # Set focus back to barcode field
         self.in_barcode.setFocus()
 
+    def _bill_insert_row(self, row, line):
+        self.tbl_bill.insertRow(row)
+        self.tbl_bill.setItem(row, 0, QTableWidgetItem(line.barcode or ""))
+        name_item = QTableWidgetItem(line.name)
+        name_item.setFont(self._bill_name_font)
+        self.tbl_bill.setItem(row, 1, name_item)
+        self.tbl_bill.setItem(row, 2, QTableWidgetItem(fmt_money(line.price)))
+        self.tbl_bill.setItem(row, 3, QTableWidgetItem(fmt_qty(line.qty)))
+        self.tbl_bill.setItem(row, 4, QTableWidgetItem(fmt_money(line.total)))
+        # Custom items are marked instead of showing an ID
+        self.tbl_bill.setItem(row, 5, QTableWidgetItem("CUSTOM" if line.is_custom else str(line.item_id)))
+
+    def _bill_reload_table(self):
+        """Rebuild the whole bill table from the cart"""
+        self.tbl_bill.setRowCount(0)
+        for row, line in enumerate(self.cart.items):
+            self._bill_insert_row(row, line)
+        self._bill_recalc_total()
+
+    def _bill_offer_recovery(self):
+        """Bring back open bills: parked ones silently, the active one if the cashier wants it"""
+        try:
+            self.carts.recover()
+        except Exception as e:
+            print(f"Could not read the bill journal: {e}", file=sys.stderr)
+            return
+        self._bill_refresh_parked()
+        if self.cart.is_empty():
+            return
+        reply = QMessageBox.question(
+            self,
+            "فاتورة غير مكتملة",
+            f"تم العثور على فاتورة غير مكتملة ({len(self.cart)} صنف، "
+            f"الإجمالي {fmt_money(self.cart.total())} {self.currency}).\nهل تريد استئنافها؟",
+            QMessageBox.Yes | QMessageBox.No
+        )
+        if reply == QMessageBox.Yes:
+            self._bill_reload_table()
+        else:
+            self.cart.clear()  # Also discards the journal
+
+    def _bill_refresh_parked(self):
+        self.cmb_parked.clear()
+        for cart_id, label in self.carts.parked_bills():
+            self.cmb_parked.addItem(label, cart_id)
+        self.btn_bill_resume.setEnabled(self.cmb_parked.count() > 0)
+
+    def _bill_park(self):
+        try:
+            self.carts.park()
+        except ServiceError as e:
+            self.msg("تنبيه", str(e))
+            return
+        self._bill_reload_table()
+        self._bill_refresh_parked()
+        self.in_barcode.setFocus()
+
+    def _bill_resume(self):
+        cart_id = self.cmb_parked.currentData()
+        if not cart_id:
+            self.msg("تنبيه", "لا توجد فواتير معلقة.")
+            return
+        try:
+            self.carts.resume(cart_id)
+        except ServiceError as e:
+            self.msg("تنبيه", str(e))
+            return
+        self._bill_reload_table()
+        self._bill_refresh_parked()
+        self.in_barcode.setFocus()
+
     def _bill_remove_selected(self):
         row = self._selected_row(self.tbl_bill)
         if row is None:
             self.msg("تنبيه", "اختر صفًا للحذف.")
             return
         
-        # Get the item to be removed
-        item_to_remove = self.current_bill_items[row]
-        
-        # Remove from table and internal tracking
+        # Remove from table and cart
         self.tbl_bill.removeRow(row)
-        self.current_bill_items.pop(row)
+        item_to_remove = self.cart.remove(row)
         
         # Recalculate total
         self._bill_recalc_total()
         
         # Show confirmation message
-        self.msg("تم", f"تم حذف {item_to_remove['name']} من الفاتورة.")
+        self.msg("تم", f"تم حذف {item_to_remove.name} من الفاتورة.")
 
     def _bill_recalc_total(self):
-        total = sum(item["total"] for item in self.current_bill_items)
+        total = self.cart.total()
         self.lbl_total.setText(f"الإجمالي: {fmt_money(total)} {self.currency}")
 
     def _bill_save(self):
-        if not self.current_bill_items:
-            self.msg("تنبيه", "لا توجد عناصر في الفاتورة.")
+        try:
+            sale_id = self.checkout_service.checkout(self.cart)
+        except ServiceError as e:
+            self.msg("تنبيه", str(e))
             return
         
-        # Calculate total (include custom items)
-        total = sum(item["total"] for item in self.current_bill_items)
-        
-        # Create sale record
-        sale_id = models.add_sale(total)
-        
-        # Add sale details and update stock (only for database items)
-        for item in self.current_bill_items:
-            if not item.get("is_custom", False):  # Only database items
-                models.add_sale_detail(sale_id, item["id"], item["qty"], item["price"])
-                models.adjust_stock(item["id"], -item["qty"])  # Subtract from stock
-        
         self.msg("تم", f"تم حفظ الفاتورة رقم {sale_id}.")
         
         # Clear bill
         self.tbl_bill.setRowCount(0)
-        self.current_bill_items = []
         self._bill_recalc_total()
         
         # Refresh stock and sales tables
@@ -669,59 +818,46 @@ class Controller(MainUI):
         self._load_sales_tab()
 
     def _bill_print(self):
-        if not self.current_bill_items:
+        if self.cart.is_empty():
             self.msg("تنبيه", "لا توجد عناصر في الفاتورة للطباعة.")
             return
         
-        # Create HTML receipt
-        html = f"""
-        <html>
-        <body style='font-family: Arial; text-align: right; direction: rtl;'>
-            <h2>{self.lbl_title.text()}</h2>
-            <p>{self.sett_contact.text()}</p>
-            <p>{self.sett_location.text()}</p>
-            <hr>
-            <h3>فاتورة بيع</h3>
-            <p>التاريخ: {datetime.now().strftime('%Y-%m-%d %H:%M')}</p>
-            <table width='100%' border='1' cellpadding='5'>
-                <tr>
-                    <th>الاسم</th>
-                    <th>السعر</th>
-                    <th>الكمية</th>
-                    <th>الإجمالي</th>
-                </tr>
-        """
-        
-        for item in self.current_bill_items:
-            html += f"""
-                <tr>
-                    <td>{item['name']}</td>
-                    <td>{fmt_money(item['price'])} {self.currency}</td>
-                    <td>{fmt_qty(item['qty'])}</td>
-                    <td>{fmt_money(item['total'])} {self.currency}</td>
-                </tr>
-            """
-        
-        total = sum(item["total"] for item in self.current_bill_items)
-        html += f"""
-                <tr>
-                    <td colspan='3' style='text-align: left;'><b>الإجمالي</b></td>
-                    <td><b>{fmt_money(total)} {self.currency}</b></td>
-                </tr>
-            </table>
-            <hr>
-            <p>شكرًا لزيارتكم</p>
-        </body>
-        </html>
-        """
-        
-        # Print dialog
-        printer = QPrinter()
-        dialog = QPrintDialog(printer, self)
-        if dialog.exec_() == QPrintDialog.Accepted:
-            doc = QTextDocument()
-            doc.setHtml(html)
-            doc.print_(printer)
+        # Rendering and printing happen on the print queue thread
+        receipt = receipts.make_receipt(
+            self.lbl_title.text(), self.sett_contact.text(), self.sett_location.text(),
+            self.currency, self.cart.items, self.cart.total()
+        )
+        self.print_queue.submit(receipt)
+
+    def _sales_reprint_selected(self):
+        """Queue receipts of all selected sales as one batch"""
+        rows = sorted({i.row() for i in self.tbl_sales.selectionModel().selectedRows()})
+        if not rows:
+            self.msg("تنبيه", "اختر عملية أو أكثر لإعادة الطباعة.")
+            return
+        sale_ids = [int(self.tbl_sales.item(r, 0).text()) for r in rows]
+        self.print_queue.reprint_sales(
+            sale_ids, self.lbl_title.text(), self.sett_contact.text(), self.sett_location.text(), self.currency
+        )
+        self.msg("تم", f"تمت إضافة {len(sale_ids)} فاتورة إلى قائمة الطباعة.")
+
+    def _on_print_failed(self, failed, error):
+        """Non-blocking warning for receipts that did not print, with a reprint button"""
+        self._unprinted.extend(failed)
+        if self._print_warning is None:
+            box = QMessageBox(QMessageBox.Warning, "تعذرت الطباعة", "", parent=self)
+            box.setWindowModality(Qt.NonModal)
+            self._print_reprint_btn = box.addButton("إعادة الطباعة", QMessageBox.AcceptRole)
+            box.addButton("إغلاق", QMessageBox.RejectRole)
+            box.buttonClicked.connect(self._on_print_warning_clicked)
+            self._print_warning = box
+        self._print_warning.setText(f"لم تتم طباعة {len(self._unprinted)} فاتورة.\n{error}")
+        self._print_warning.show()
+
+    def _on_print_warning_clicked(self, button):
+        unprinted, self._unprinted = self._unprinted, []
+        if button is self._print_reprint_btn and unprinted:
+            self.print_queue.submit(unprinted)
 
     def _show_scanner_info(self):
         """Show information about barcode scanner"""
@@ -741,6 +877,7 @@ class Controller(MainUI):
 
     # Sales Methods
     def _load_sales_tab(self):
+        self._mark_view_loaded("sales")
         # Load sales summary
         total_sales = models.get_sales_total()
         today_sales = models.get_sales_summary_today()
@@ -748,14 +885,17 @@ class Controller(MainUI):
         
         self.lbl_total_sales.setText(f"إجمالي المبيعات: {fmt_money(total_sales)} {self.currency}")
         self.lbl_today_sales.setText(f"مبيعات اليوم: {fmt_money(today_sales)} {self.currency}")
+        self.lbl_today_profit.setText(f"ربح اليوم: {fmt_money(models.get_profit_today())} {self.currency}")
         
         if latest_sale:
             self.lbl_latest_sale.setText(f"آخر عملية: #{latest_sale['id']} - {fmt_money(latest_sale['total_price'])} {self.currency} - {latest_sale['datetime']}")
         else:
             self.lbl_latest_sale.setText("آخر عملية: -")
         
-        # Load sales table
-        sales = models.get_sales()
+        # Load sales table: one page of the search results
+        filters = self._sales_filters()
+        total = models.count_sales(**filters, limit=SALES_COUNT_LIMIT)
+        sales = models.search_sales(**filters, before_id=self._sales_pages[-1], limit=SALES_PAGE_SIZE)
         self.tbl_sales.setRowCount(0)
         for s in sales:
             row = self.tbl_sales.rowCount()
@@ -763,9 +903,54 @@ class Controller(MainUI):
             self.tbl_sales.setItem(row, 0, QTableWidgetItem(str(s["id"])))
             self.tbl_sales.setItem(row, 1, QTableWidgetItem(s["datetime"]))
             self.tbl_sales.setItem(row, 2, QTableWidgetItem(fmt_money(s["total_price"])))
-        
+
+        page = len(self._sales_pages)
+        self._sales_last_id = sales[-1]["id"] if len(sales) == SALES_PAGE_SIZE else None
+        if total >= SALES_COUNT_LIMIT:
+            self.lbl_sales_page.setText(f"الصفحة {page} (أكثر من {SALES_COUNT_LIMIT} عملية)")
+        else:
+            pages = max(1, -(-total // SALES_PAGE_SIZE))
+            self.lbl_sales_page.setText(f"الصفحة {page} من {pages} ({total} عملية)")
+        self.btn_sales_prev.setEnabled(page > 1)
+        self.btn_sales_next.setEnabled(
+            self._sales_last_id is not None
+            and (total >= SALES_COUNT_LIMIT or page * SALES_PAGE_SIZE < total))
+
         self._update_table_responsiveness()
 
+    def _sales_filters(self):
+        """Search criteria from the sales search bar; incomplete input is ignored"""
+        sale_id = self.sales_filter_id.text().strip()
+        dates = []
+        for edit in (self.sales_filter_from, self.sales_filter_to):
+            text = edit.text().strip()
+            try:
+                dates.append(date.fromisoformat(text).isoformat() if text else None)
+            except ValueError:
+                dates.append(None)
+        return {
+            "sale_id": int(sale_id) if sale_id.isdigit() else None,
+            "start": dates[0],
+            "end": dates[1],
+            "amount_min": self.sales_filter_min.value() or None,
+            "amount_max": self.sales_filter_max.value() or None,
+            "item": self.sales_filter_item.text().strip() or None,
+        }
+
+    def _sales_apply_search(self):
+        self._sales_pages = [None]
+        self._load_sales_tab()
+
+    def _sales_next_page(self):
+        if self._sales_last_id is not None:
+            self._sales_pages.append(self._sales_last_id)
+            self._load_sales_tab()
+
+    def _sales_prev_page(self):
+        if len(self._sales_pages) > 1:
+            self._sales_pages.pop()
+            self._load_sales_tab()
+
     def _sales_view_selected(self):
         row = self._selected_row(self.tbl_sales)
         if row is None:
@@ -798,12 +983,14 @@ class Controller(MainUI):
         
         if confirm == QMessageBox.Yes:
             try:
-                models.delete_sale(sale_id, restock=True)
+                self.sales_amendments.delete_sale(sale_id)
                 self.msg("تم", "تم حذف العملية وإرجاع المخزون.")
                 self._load_sales_tab()
                 self._load_stock_table()
                 # Clear sale details table
                 self.tbl_sale_details.setRowCount(0)
+            except ServiceError as e:
+                self.msg("تنبيه", str(e))
             except Exception as e:
                 QMessageBox.warning(self, "خطأ", f"تعذر حذف العملية:\n{e}")
 
@@ -820,7 +1007,6 @@ class Controller(MainUI):
             self.msg("تنبيه", "اختر صنف من تفاصيل العملية للحذف.")
             return
         
-        sale_id = int(self.tbl_sales.item(sale_row, 0).text())
         detail_id = int(self.tbl_sale_details.item(detail_row, 0).text())
         item_name = self.tbl_sale_details.item(detail_row, 1).text()
         quantity = float(self.tbl_sale_details.item(detail_row, 2).text())
@@ -833,12 +1019,14 @@ class Controller(MainUI):
         
         if confirm == QMessageBox.Yes:
             try:
-                models.delete_sale_detail(detail_id, restock=True)
+                self.sales_amendments.remove_line(detail_id)
                 self.msg("تم", f"تم حذف '{item_name}' من العملية وإرجاع المخزون.")
                 self._load_sales_tab()
                 self._load_stock_table()
                 # Refresh the details for the current sale
                 self._sales_view_selected()
+            except ServiceError as e:
+                self.msg("تنبيه", str(e))
             except Exception as e:
                 QMessageBox.warning(self, "خطأ", f"تعذر حذف الصنف:\n{e}")
 
@@ -855,11 +1043,17 @@ class Controller(MainUI):
             self.msg("تنبيه", "اختر صنف من تفاصيل العملية للتعديل.")
             return
         
-        sale_id = int(self.tbl_sales.item(sale_row, 0).text())
         detail_id = int(self.tbl_sale_details.item(detail_row, 0).text())
-        item_name = self.tbl_sale_details.item(detail_row, 1).text()
-        current_qty = float(self.tbl_sale_details.item(detail_row, 2).text())
-        price_each = float(self.tbl_sale_details.item(detail_row, 3).text())
+        # Quantities come from the database, not from the formatted table cells
+        detail = models.get_sale_detail_by_id(detail_id)
+        if not detail and models.is_archived("sale_details", detail_id):
+            self.msg("تنبيه", "هذه العملية مؤرشفة ولا يمكن تعديلها.")
+            return
+        if not detail:
+            self.msg("تنبيه", "الصنف غير موجود في العملية.")
+            return
+        item_name = detail["name"]
+        current_qty = detail["quantity"]
         
         # Get new quantity from user
         new_qty, ok = QInputDialog.getDouble(
@@ -871,25 +1065,247 @@ class Controller(MainUI):
         
         if ok and new_qty != current_qty:
             try:
-                # Calculate the difference
-                qty_diff = new_qty - current_qty
-                
-                # Update the sale detail
-                models.update_sale_detail(detail_id, new_qty, price_each)
-                
-                # Adjust stock (negative diff means we took more from stock)
-                detail = models.get_sale_detail_by_id(detail_id)
-                if detail:
-                    models.adjust_stock(detail["item_id"], -qty_diff)
+                # Updates the line, the sale total and stock together
+                self.sales_amendments.change_quantity(detail_id, new_qty)
                 
                 self.msg("تم", f"تم تعديل كمية '{item_name}' من {current_qty} إلى {new_qty}.")
                 self._load_sales_tab()
                 self._load_stock_table()
                 # Refresh the details for the current sale
                 self._sales_view_selected()
+            except ServiceError as e:
+                self.msg("تنبيه", str(e))
             except Exception as e:
                 QMessageBox.warning(self, "خطأ", f"تعذر تعديل الكمية:\n{e}")
 
+    # Stocktake
+    def _stocktake_set_enabled(self, active):
+        self.btn_st_start.setEnabled(not active)
+        for w in (self.st_barcode, self.st_qty, self.btn_st_commit, self.btn_st_cancel, self.chk_st_zero):
+            w.setEnabled(active)
+
+    def _stocktake_start(self):
+        try:
+            self.stocktake = StocktakeSession.open()
+        except Exception as e:
+            QMessageBox.warning(self, "خطأ", f"تعذر بدء الجرد:\n{e}")
+            return
+        self.tbl_stocktake.setRowCount(0)
+        self._stocktake_rows = {}
+        for line in self.stocktake.lines.values():
+            self._stocktake_show_line(line)
+        self._stocktake_update_summary()
+        self._stocktake_set_enabled(True)
+        self.st_barcode.setFocus()
+
+    def _stocktake_show_line(self, line):
+        """Insert the line's row on first scan, afterwards only refresh its counted/variance cells"""
+        row = self._stocktake_rows.get(line.item_id)
+        if row is None:
+            row = self._stocktake_rows[line.item_id] = self.tbl_stocktake.rowCount()
+            self.tbl_stocktake.insertRow(row)
+            self.tbl_stocktake.setItem(row, 0, QTableWidgetItem(line.name))
+            self.tbl_stocktake.setItem(row, 1, QTableWidgetItem(line.barcode))
+            self.tbl_stocktake.setItem(row, 2, QTableWidgetItem(fmt_qty(line.expected)))
+            self.tbl_stocktake.setItem(row, 3, QTableWidgetItem(fmt_qty(line.counted)))
+            self.tbl_stocktake.setItem(row, 4, QTableWidgetItem(fmt_qty(line.variance)))
+        else:
+            self.tbl_stocktake.item(row, 3).setText(fmt_qty(line.counted))
+            self.tbl_stocktake.item(row, 4).setText(fmt_qty(line.variance))
+        self.tbl_stocktake.selectRow(row)
+
+    def _stocktake_update_summary(self):
+        s = self.stocktake
+        text = f"جرد رقم {s.stocktake_id} - الأصناف المجرودة: {len(s.lines)} - إجمالي الفرق: {fmt_qty(s.total_variance)}"
+        unsaved = s.unsaved
+        if unsaved:
+            # Retried when the stocktake is committed
+            text += f" - عمليات لم تُحفظ بعد: {unsaved}"
+        self.lbl_st_summary.setText(text)
+
+    def _stocktake_scan(self):
+        barcode = self.st_barcode.text().strip()
+        if not self.stocktake or not barcode:
+            return
+        try:
+            line = self.stocktake.scan(barcode, float(self.st_qty.value()), self.st_counter.text().strip())
+        except ServiceError as e:
+            self.msg("تنبيه", str(e))
+            return
+        finally:
+            self.st_barcode.clear()
+        self._stocktake_show_line(line)
+        self._stocktake_update_summary()
+        self.st_qty.setValue(1.0)
+
+    def _stocktake_commit(self):
+        if not self.stocktake:
+            return
+        zero = self.chk_st_zero.isChecked()
+        text = f"سيتم تعديل المخزون حسب الجرد ({len(self.stocktake.lines)} صنف)."
+        if zero:
+            text += "\nسيتم تصفير مخزون كل الأصناف غير المجرودة."
+        if QMessageBox.question(self, "تأكيد", text + "\nهل أنت متأكد؟") != QMessageBox.Yes:
+            return
+        try:
+            changed = self.stocktake.commit(zero_uncounted=zero)
+        except ServiceError as e:
+            self.msg("تنبيه", str(e))
+            return
+        except Exception as e:
+            QMessageBox.warning(self, "خطأ", f"تعذر اعتماد الجرد:\n{e}")
+            return
+        self._stocktake_close()
+        self._load_stock_table()
+        self.msg("تم", f"تم اعتماد الجرد وتعديل مخزون {changed} صنف.")
+
+    def _stocktake_cancel(self):
+        if not self.stocktake:
+            return
+        if QMessageBox.question(self, "تأكيد", "سيتم إلغاء الجرد دون تعديل المخزون.\nهل أنت متأكد؟") != QMessageBox.Yes:
+            return
+        self.stocktake.cancel()
+        self._stocktake_close()
+
+    def _stocktake_close(self):
+        self.stocktake = None
+        self._stocktake_rows = {}
+        self.tbl_stocktake.setRowCount(0)
+        self.lbl_st_summary.setText("لا يوجد جرد مفتوح")
+        self._stocktake_set_enabled(False)
+
+    # Receiving
+    def _receiving_set_enabled(self, active):
+        for w in (self.btn_rcv_start, self.rcv_supplier, self.cmb_rcv_po):
+            w.setEnabled(not active)
+        for w in (self.rcv_barcode, self.rcv_qty, self.rcv_cost, self.btn_rcv_import,
+                  self.btn_rcv_post, self.btn_rcv_cancel):
+            w.setEnabled(active)
+        self.btn_rcv_as_ordered.setEnabled(active and bool(self.delivery and self.delivery.po_id))
+
+    def _receiving_refresh_orders(self):
+        self.cmb_rcv_po.clear()
+        self.cmb_rcv_po.addItem("بدون أمر شراء", None)
+        for po in models.get_purchase_orders("open"):
+            self.cmb_rcv_po.addItem(f"#{po['id']} - {po['supplier'] or ''} ({po['lines']} صنف)", po["id"])
+
+    def _receiving_start(self):
+        po_id = self.cmb_rcv_po.currentData()
+        try:
+            if po_id:
+                self.delivery = Delivery.from_purchase_order(po_id)
+            else:
+                self.delivery = Delivery.open(self.rcv_supplier.text().strip() or None)
+        except ServiceError as e:
+            self.msg("تنبيه", str(e))
+            return
+        except Exception as e:
+            QMessageBox.warning(self, "خطأ", f"تعذر بدء الاستلام:\n{e}")
+            return
+        if po_id and self.delivery.supplier:
+            self.rcv_supplier.setText(self.delivery.supplier)
+        self._receiving_reload_table()
+        self._receiving_set_enabled(True)
+        self.rcv_barcode.setFocus()
+
+    def _receiving_reload_table(self):
+        self.tbl_receiving.setRowCount(0)
+        self._receiving_rows = {}
+        for line in self.delivery.lines.values():
+            self._receiving_show_line(line)
+        self._receiving_update_summary()
+
+    def _receiving_show_line(self, line):
+        """Insert the line's row once, afterwards only refresh its received/cost cells"""
+        row = self._receiving_rows.get(line.item_id)
+        if row is None:
+            row = self._receiving_rows[line.item_id] = self.tbl_receiving.rowCount()
+            self.tbl_receiving.insertRow(row)
+            self.tbl_receiving.setItem(row, 0, QTableWidgetItem(line.name))
+            self.tbl_receiving.setItem(row, 1, QTableWidgetItem(line.barcode or ""))
+            self.tbl_receiving.setItem(row, 2, QTableWidgetItem(fmt_qty(line.ordered)))
+            for col in (3, 4, 5):
+                self.tbl_receiving.setItem(row, col, QTableWidgetItem())
+        self.tbl_receiving.item(row, 3).setText(fmt_qty(line.quantity))
+        self.tbl_receiving.item(row, 4).setText(fmt_money(line.cost_each))
+        self.tbl_receiving.item(row, 5).setText(fmt_money(line.total_cost))
+        self.tbl_receiving.selectRow(row)
+
+    def _receiving_update_summary(self):
+        d = self.delivery
+        po = f"أمر شراء #{d.po_id} - " if d.po_id else ""
+        self.lbl_rcv_summary.setText(
+            f"{po}الأصناف: {len(d.lines)} - إجمالي التكلفة: {fmt_money(d.total_cost)} {self.currency}"
+        )
+
+    def _receiving_scan(self):
+        barcode = self.rcv_barcode.text().strip()
+        if not self.delivery or not barcode:
+            return
+        cost = float(self.rcv_cost.value()) or None
+        try:
+            line = self.delivery.scan(barcode, float(self.rcv_qty.value()), cost)
+        except ServiceError as e:
+            self.msg("تنبيه", str(e))
+            return
+        finally:
+            self.rcv_barcode.clear()
+        self._receiving_show_line(line)
+        self._receiving_update_summary()
+        self.rcv_qty.setValue(1.0)
+        self.rcv_cost.setValue(0)
+
+    def _receiving_import(self):
+        if not self.delivery:
+            return
+        path, _ = QFileDialog.getOpenFileName(self, "استيراد الاستلام", "", "CSV (*.csv)")
+        if not path:
+            return
+        try:
+            with open(path, newline="", encoding="utf-8-sig") as f:
+                unmatched = self.delivery.import_rows(csv.DictReader(f))
+        except Exception as e:
+            QMessageBox.warning(self, "خطأ", f"تعذر قراءة الملف:\n{e}")
+            return
+        self._receiving_reload_table()
+        if unmatched:
+            shown = "، ".join(b or "-" for b in unmatched[:20])
+            self.msg("تنبيه", f"لم يتم العثور على {len(unmatched)} باركود:\n{shown}")
+
+    def _receiving_as_ordered(self):
+        if not self.delivery:
+            return
+        self.delivery.receive_as_ordered()
+        self._receiving_reload_table()
+
+    def _receiving_post(self):
+        if not self.delivery:
+            return
+        text = (f"سيتم إضافة {len(self.delivery.lines)} صنف إلى المخزون"
+                f" بتكلفة {fmt_money(self.delivery.total_cost)} {self.currency}.\nهل أنت متأكد؟")
+        if QMessageBox.question(self, "تأكيد", text) != QMessageBox.Yes:
+            return
+        self.delivery.supplier = self.rcv_supplier.text().strip() or self.delivery.supplier
+        try:
+            receipt_id = self.delivery.post()
+        except ServiceError as e:
+            self.msg("تنبيه", str(e))
+            return
+        except Exception as e:
+            QMessageBox.warning(self, "خطأ", f"تعذر ترحيل الاستلام:\n{e}")
+            return
+        self._receiving_close()
+        self._receiving_refresh_orders()
+        self._load_stock_table()
+        self.msg("تم", f"تم ترحيل الاستلام رقم {receipt_id}.")
+
+    def _receiving_close(self):
+        self.delivery = None
+        self._receiving_rows = {}
+        self.tbl_receiving.setRowCount(0)
+        self.lbl_rcv_summary.setText("لا يوجد استلام مفتوح")
+        self._receiving_set_enabled(False)
+
     # Utility
     def _selected_row(self, table):
         rows = table.selectionModel().selectedRows()
@@ -1,19 +1,31 @@
 # database.py (fixed typo)
 import sqlite3
+import sys
 import os
+import pathlib
+import queue
 import threading
-from datetime import datetime
+import time
+import uuid
+import atexit
+import functools
+import inspect
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import date, datetime
 
 DB_NAME = "store.db"
 _db_lock = threading.RLock()
 
-def get_connection():
+def get_connection(db_path=None):
     """
     Get database connection with proper configuration and timeout handling.
     - timeout=10 sec: Prevents 'database is locked' errors during fast UI operations.
     - WAL mode: Better concurrency for read/write.
+    - db_path: Optional path of another store database (replicas, archives); defaults to DB_NAME.
     """
-    conn = sqlite3.connect(DB_NAME, timeout=30)  # Increased timeout for large datasets
+    conn = sqlite3.connect(db_path or DB_NAME, timeout=30)  # Increased timeout for large datasets
     conn.row_factory = sqlite3.Row  # Fixed: Changed RRow to Row
     conn.execute("PRAGMA foreign_keys = ON;")
     conn.execute("PRAGMA journal_mode = WAL;")       # Allows concurrent reads during writes
@@ -22,6 +34,470 @@ def get_connection():
     conn.execute("PRAGMA temp_store = MEMORY;")      # Store temp tables in memory
     return conn
 
+# ---------- Single writer with group commit ----------
+COMMIT_WINDOW = 0.002    # Seconds to wait for more writes before committing a group
+MAX_GROUP_SIZE = 64      # Upper bound of writes per commit
+LOCK_WAIT_MIN = 0.001    # A BEGIN IMMEDIATE slower than this waited for another connection's write
+_STOP = object()
+_writers = {}
+
+class DatabaseWriter:
+    """
+    Dedicated thread that owns the only write connection of this process.
+    Write jobs are callables taking that connection; they must not commit.
+    Jobs queued close together share one transaction (group commit), each
+    inside its own savepoint so a failing job doesn't undo the others.
+    Results and exceptions are returned through concurrent.futures.Future.
+    Time spent before writes could start is kept in lock_wait_* (waiting
+    for another connection to release the write lock) and queue_wait_*
+    (queued behind other jobs of this process).
+    """
+
+    def __init__(self, db_path=None, commit_window=COMMIT_WINDOW, max_group=MAX_GROUP_SIZE):
+        self.db_path = db_path or DB_NAME
+        self.commit_window = commit_window
+        self.max_group = max_group
+        self.last_commit_at = None       # time.monotonic() of the last group commit
+        self.commits = 0
+        self.jobs_done = 0
+        self.lock_waits = 0
+        self.lock_wait_s = 0.0
+        self.lock_wait_max_s = 0.0
+        self.queue_wait_s = 0.0
+        self.queue_wait_max_s = 0.0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue a write job and return a Future for its result"""
+        future = Future()
+        self._queue.put((future, fn, args, kwargs, time.perf_counter()))
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        """Run a write job and wait for its result (re-entrant on the writer thread)"""
+        if threading.current_thread() is self._thread:
+            return fn(self._conn, *args, **kwargs)
+        return self.submit(fn, *args, **kwargs).result()
+
+    def stop(self, timeout=None):
+        """Finish queued jobs and close the write connection"""
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _next_group(self, first):
+        group = [first]
+        deadline = time.monotonic() + self.commit_window
+        while len(group) < self.max_group:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    job = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if job is _STOP:
+                self._queue.put(_STOP)
+                break
+            group.append(job)
+        return group
+
+    def _run(self):
+        self._conn = get_connection(self.db_path)
+        try:
+            while True:
+                job = self._queue.get()
+                if job is _STOP:
+                    break
+                self._commit_group(self._next_group(job))
+        finally:
+            self._conn.close()
+
+    def _count_lock_wait(self, waited):
+        if waited >= LOCK_WAIT_MIN:
+            self.lock_waits += 1
+            self.lock_wait_s += waited
+            self.lock_wait_max_s = max(self.lock_wait_max_s, waited)
+
+    def _commit_group(self, group):
+        conn = self._conn
+        outcomes = []
+        try:
+            begin_at = time.perf_counter()
+            for *_, submitted_at in group:
+                self.queue_wait_s += begin_at - submitted_at
+                self.queue_wait_max_s = max(self.queue_wait_max_s, begin_at - submitted_at)
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+            finally:
+                self._count_lock_wait(time.perf_counter() - begin_at)
+            for future, fn, args, kwargs, _ in group:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT write_job")
+                try:
+                    result = fn(conn, *args, **kwargs)
+                    conn.execute("RELEASE SAVEPOINT write_job")
+                    outcomes.append((future, result, None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO SAVEPOINT write_job")
+                    conn.execute("RELEASE SAVEPOINT write_job")
+                    outcomes.append((future, None, e))
+            conn.commit()
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            for future, *_ in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.last_commit_at = time.monotonic()
+        self.commits += 1
+        self.jobs_done += len(outcomes)
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+def get_writer(db_path=None):
+    """Get (and start on first use) the writer thread for a database"""
+    path = os.path.abspath(db_path or DB_NAME)
+    with _db_lock:
+        writer = _writers.get(path)
+        if writer is None:
+            writer = _writers[path] = DatabaseWriter(path)
+        return writer
+
+def run_write(fn, *args, **kwargs):
+    """Run fn(conn, *args, **kwargs) on the writer thread and return its result"""
+    return get_writer().run(fn, *args, **kwargs)
+
+def submit_write(fn, *args, **kwargs):
+    """Queue fn(conn, *args, **kwargs) on the writer thread without waiting; returns a Future"""
+    return get_writer().submit(fn, *args, **kwargs)
+
+def shutdown_writers():
+    """Drain and stop all writer threads"""
+    with _db_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.stop()
+
+atexit.register(shutdown_writers)
+
+# ---------- Reporting snapshot ----------
+REPORT_SNAPSHOT_MAX_AGE = 300   # Seconds a report may lag behind the live database
+_report_lock = threading.Lock()
+
+def get_report_path(db_path=None):
+    """Path of the reporting snapshot that belongs to a database"""
+    base, ext = os.path.splitext(db_path or DB_NAME)
+    return f"{base}_report{ext or '.db'}"
+
+REPORT_COPY_PAGES = 1024    # Pages copied per backup step (4 MB at the default page size)
+REPORT_COPY_SLEEP = 0.005   # Pause between steps, so checkout writes get their turn
+REPORT_COPY_RESTARTS = 3    # Copies restarted by writes before falling back to one step
+_report_versions = {}       # snapshot path -> data_version of the database it was copied from
+
+class _CopyRestarted(Exception):
+    pass
+
+def _copy_database(src, dst):
+    """
+    Backup src into dst REPORT_COPY_PAGES at a time; each step is its own
+    short read transaction. A write by another connection restarts the
+    copy, so a database that keeps being written is copied in one step
+    after REPORT_COPY_RESTARTS restarts.
+    """
+    restarts = 0
+    last_remaining = None
+
+    def _progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > REPORT_COPY_RESTARTS:
+                raise _CopyRestarted()
+        last_remaining = remaining
+
+    try:
+        src.backup(dst, pages=REPORT_COPY_PAGES, progress=_progress, sleep=REPORT_COPY_SLEEP)
+    except _CopyRestarted:
+        src.backup(dst)
+
+def refresh_report_snapshot(db_path=None):
+    """
+    Copy the live database into its reporting snapshot with the backup API,
+    in steps so no read transaction stays open for the whole copy; long
+    reports then read the snapshot and never pin the WAL. Nothing is copied
+    while data_version shows no commit since the last copy.
+    Returns False if the old snapshot could not be replaced (still open by a
+    running report on Windows); it is retried on the next refresh.
+    """
+    path = get_report_path(db_path)
+    version = data_version(db_path)  # Taken before copying: a write during the copy triggers the next one
+    if os.path.exists(path) and _report_versions.get(path) == version:
+        return True
+    tmp_path = path + ".tmp"
+    src = get_connection(db_path)
+    dst = sqlite3.connect(tmp_path)
+    try:
+        _copy_database(src, dst)
+        dst.execute("PRAGMA journal_mode = DELETE;")  # Self-contained file, no -wal/-shm
+        dst.commit()
+    finally:
+        dst.close()
+        src.close()
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        os.remove(tmp_path)
+        return False
+    _report_versions[path] = version
+    return True
+
+def get_report_connection(max_age=REPORT_SNAPSHOT_MAX_AGE, db_path=None):
+    """
+    Get a read-only connection to the reporting snapshot, refreshing the
+    snapshot first when it is missing or older than max_age seconds.
+    """
+    path = get_report_path(db_path)
+    with _report_lock:
+        if not os.path.exists(path) or time.time() - os.path.getmtime(path) > max_age:
+            refresh_report_snapshot(db_path)
+    conn = sqlite3.connect(pathlib.Path(path).resolve().as_uri() + "?mode=ro", uri=True, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA query_only = ON;")
+    conn.execute("PRAGMA cache_size = -10000;")
+    conn.execute("PRAGMA temp_store = MEMORY;")
+    return conn
+
+def start_report_refresher(interval=REPORT_SNAPSHOT_MAX_AGE, db_path=None):
+    """Refresh the reporting snapshot in the background every interval seconds (if anything was written)"""
+    def _loop():
+        while True:
+            try:
+                with _report_lock:
+                    refresh_report_snapshot(db_path)
+            except Exception as e:
+                print(f"Report snapshot refresh failed: {e}", file=sys.stderr)
+            time.sleep(interval)
+    thread = threading.Thread(target=_loop, name="report-snapshot", daemon=True)
+    thread.start()
+    return thread
+
+# ---------- Archives ----------
+# Sales of closed periods live in archive files next to the database (see
+# archive.py), registered in the archives table. Readers attach the ones a
+# date range (or a sale / line id) needs and read a UNION ALL of hot and
+# archived rows. SQLite attaches at most 10 databases to a connection, so
+# archives are attached ARCHIVE_ATTACH_BATCH at a time.
+ARCHIVED_TABLES = {
+    "sales": "id, datetime, total_price, created_at",
+    "sale_details": "id, sale_id, item_id, quantity, price_each, created_at, cost_each",
+}
+ARCHIVE_ATTACH_BATCH = 8    # Archives attached at once (below SQLITE_MAX_ATTACHED = 10)
+
+def get_archive_path(file_name, db_path=None):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path or DB_NAME)), file_name)
+
+def archive_batches(conn, start=None, end=None, db_path=None, sales=None, lines=None,
+                    batch_size=ARCHIVE_ATTACH_BATCH):
+    """
+    Attach the archives overlapping the day range start..end (YYYY-MM-DD,
+    inclusive; None = open end) batch_size at a time, and yield
+    (attached, hot) per batch: attached is [(schema, status)], hot is True
+    for the last batch only, so hot rows are read once when passed on to
+    archive_source. A batch is detached when the loop moves on, so fetch its
+    rows first. sales / lines = (first id, last id) only attach the archives
+    whose id range can hold them. Without archives it yields ([], True).
+    """
+    rows = conn.execute("""
+        SELECT period, file_name, status FROM archives
+        WHERE (? IS NULL OR end_date > ?) AND (? IS NULL OR start_date <= ?)
+          AND (? IS NULL OR first_sale_id IS NULL OR (first_sale_id <= ? AND last_sale_id >= ?))
+          AND (? IS NULL OR first_line_id IS NULL OR (first_line_id <= ? AND last_line_id >= ?))
+        ORDER BY start_date
+    """, (start, start, end, end,
+          *((None, None, None) if sales is None else (sales[0], sales[1], sales[0])),
+          *((None, None, None) if lines is None else (lines[0], lines[1], lines[0])))).fetchall()
+    rows = [(period, file_name, status) for period, file_name, status in rows
+            if os.path.exists(get_archive_path(file_name, db_path))]
+    batches = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)] or [[]]
+    for n, batch in enumerate(batches):
+        attached = []
+        try:
+            for period, file_name, status in batch:
+                schema = "arc_" + "".join(ch if ch.isalnum() else "_" for ch in period)
+                conn.execute(f"ATTACH DATABASE ? AS {schema}", (get_archive_path(file_name, db_path),))
+                attached.append((schema, status))
+            yield attached, n == len(batches) - 1
+        finally:
+            for schema, _ in attached:
+                conn.execute(f"DETACH DATABASE {schema}")
+
+def archive_source(table, attached, hot=True):
+    """
+    FROM-clause source for table over the hot database (unless hot=False)
+    and the attached archives. Rows of an archive still being filled are
+    skipped while their copy still exists in the hot database.
+    """
+    if not attached:
+        return table
+    columns = ARCHIVED_TABLES[table]
+    parts = [f"SELECT {columns} FROM main.{table}"] if hot else []
+    for schema, status in attached:
+        part = f"SELECT {columns} FROM {schema}.{table} a"
+        if status != "done":
+            part += f" WHERE NOT EXISTS (SELECT 1 FROM main.{table} h WHERE h.id = a.id)"
+        parts.append(part)
+    return "(" + " UNION ALL ".join(parts) + ")"
+
+def _setup_archive_ranges(conn, db_path=None):
+    """Id ranges of the sales and lines in each archive, read from archives made before they were kept"""
+    cur = conn.cursor()
+    for column in ("first_sale_id", "last_sale_id", "first_line_id", "last_line_id"):
+        if not _table_has_column(conn, "archives", column):
+            cur.execute(f"ALTER TABLE archives ADD COLUMN {column} INTEGER")
+    for period, file_name in cur.execute(
+        "SELECT period, file_name FROM archives WHERE first_sale_id IS NULL"
+    ).fetchall():
+        path = get_archive_path(file_name, db_path)
+        if not os.path.exists(path):
+            continue
+        arc = sqlite3.connect(path, timeout=30)
+        try:
+            ranges = arc.execute("""
+                SELECT (SELECT MIN(id) FROM sales), (SELECT MAX(id) FROM sales),
+                       (SELECT MIN(id) FROM sale_details), (SELECT MAX(id) FROM sale_details)
+            """).fetchone()
+        finally:
+            arc.close()
+        cur.execute("""
+            UPDATE archives SET first_sale_id=?, last_sale_id=?, first_line_id=?, last_line_id=?
+            WHERE period=?
+        """, (*ranges, period))
+    conn.commit()
+
+# ---------- Read cache ----------
+# PRAGMA data_version changes on a connection whenever another connection
+# (the writer thread, a CLI, another till, sync) commits to the database.
+# One long-lived connection per database answers it in microseconds, so it
+# keys cached reads: a result stays valid until something actually writes.
+READ_CACHE_SIZE = 64     # Default entries kept per cached function
+_version_conns = {}
+_version_lock = threading.Lock()
+
+def data_version(db_path=None):
+    """Counter that changes whenever any connection commits to the database"""
+    path = os.path.abspath(db_path or DB_NAME)
+    with _version_lock:
+        conn = _version_conns.get(path)
+        if conn is None:
+            conn = _version_conns[path] = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        return conn.execute("PRAGMA data_version").fetchone()[0]
+
+def _read_version(snapshot, db_path=None):
+    """(database, data_version, today[, snapshot mtime]) a cached result belongs to"""
+    path = os.path.abspath(db_path or DB_NAME)
+    version = (path, data_version(path), date.today())
+    if snapshot:
+        # Results read from the reporting snapshot also change when it is refreshed
+        report_path = get_report_path(path)
+        version += (os.path.getmtime(report_path) if os.path.exists(report_path) else None,)
+    return version
+
+def cached_read(maxsize=READ_CACHE_SIZE, snapshot=False):
+    """
+    Memoize a read-only query function on its arguments and the version of
+    the database it reads: its db_path argument when it has one, else the
+    default database (DB_NAME). LRU eviction beyond maxsize entries. List results are
+    returned as copies; rows themselves are immutable. Calls with
+    unhashable arguments are not cached. The wrapper has cache_clear() and
+    cache_info() like functools.lru_cache.
+    """
+    def decorator(fn):
+        entries = OrderedDict()
+        lock = threading.Lock()
+        stats = {"hits": 0, "misses": 0}
+        signature = inspect.signature(fn)
+        takes_path = "db_path" in signature.parameters
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                db_path = signature.bind_partial(*args, **kwargs).arguments.get("db_path") if takes_path else None
+                key = (_read_version(snapshot, db_path), args, tuple(sorted(kwargs.items())))
+                hash(key)
+            except TypeError:
+                return fn(*args, **kwargs)
+            with lock:
+                if key in entries:
+                    entries.move_to_end(key)
+                    stats["hits"] += 1
+                    result = entries[key]
+                    return list(result) if isinstance(result, list) else result
+                stats["misses"] += 1
+            result = fn(*args, **kwargs)
+            with lock:
+                entries[key] = result
+                entries.move_to_end(key)
+                while len(entries) > maxsize:
+                    entries.popitem(last=False)
+            return list(result) if isinstance(result, list) else result
+
+        def cache_clear():
+            with lock:
+                entries.clear()
+
+        def cache_info():
+            with lock:
+                return dict(stats, size=len(entries), maxsize=maxsize)
+
+        wrapper.cache_clear = cache_clear
+        wrapper.cache_info = cache_info
+        return wrapper
+    return decorator
+
+# ---------- Change detection ----------
+# Per-table change counters kept by triggers (see _setup_table_versions).
+# Polling is cheap: the counters are only read when data_version moved.
+WATCHED_TABLES = ("categories", "items", "item_forecasts", "sales", "sale_details")
+
+class ChangeDetector:
+    """
+    Reports the version of every watched table, as seen from its own
+    connection, so commits by this process and by other processes alike
+    show up. Use from one thread.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or DB_NAME
+        self._conn = None
+        self._data_version = None
+        self._versions = {}
+
+    def versions(self):
+        """{table: version}; a single PRAGMA when nothing was committed since the last call"""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, timeout=30)
+        current = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if current != self._data_version:
+            self._versions = dict(self._conn.execute("SELECT name, version FROM table_versions"))
+            self._data_version = current
+        return dict(self._versions)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
 def _table_has_item_fk_cascade_on_sale_details(conn):
     """Check if sale_details table has CASCADE foreign key for items"""
     cur = conn.cursor()
@@ -45,10 +521,363 @@ def _table_has_column(conn, table_name, column_name):
     except:
         return False
 
-def setup_database():
+# Tables whose row changes are recorded in change_log for replication
+CAPTURED_TABLES = ("items", "sales", "sale_details")
+
+def _setup_change_capture(conn):
+    """Create change_log, replica state and the capture triggers.
+
+    Triggers only record (table, row id, operation) plus the stock delta for
+    items; the row contents are read at sync time, so repeated edits of the
+    same row cost one log entry each and collapse into one change on export.
+    Setting trigger_control.suppress_capture = 1 inside a transaction stops
+    capture (used while applying remote changes).
+    """
+    cur = conn.cursor()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS trigger_control (
+        id INTEGER PRIMARY KEY CHECK (id=1),
+        suppress_capture INTEGER NOT NULL DEFAULT 0
+    );
+    """)
+    cur.execute("INSERT OR IGNORE INTO trigger_control (id, suppress_capture) VALUES (1, 0)")
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS sync_state (
+        id INTEGER PRIMARY KEY CHECK (id=1),
+        replica_id TEXT NOT NULL,
+        created_at TEXT
+    );
+    """)
+    cur.execute("INSERT OR IGNORE INTO sync_state (id, replica_id, created_at) VALUES (1, ?, ?)",
+                (uuid.uuid4().hex, datetime.now().isoformat()))
+
+    # origin is NULL for local changes, or the replica a relayed change started
+    # on; origin_seq is its seq in that replica's change_log
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_name TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        op TEXT NOT NULL CHECK (op IN ('I', 'U', 'D')),
+        stock_delta REAL,
+        origin TEXT,
+        created_at TEXT NOT NULL DEFAULT (datetime('now')),
+        origin_seq INTEGER
+    );
+    """)
+    if not _table_has_column(conn, "change_log", "origin_seq"):
+        cur.execute("ALTER TABLE change_log ADD COLUMN origin_seq INTEGER")
+
+    # Per-peer cursors into change_log (sent) and into the peer's log (received)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS sync_peers (
+        peer_id TEXT PRIMARY KEY,
+        last_sent_seq INTEGER NOT NULL DEFAULT 0,
+        last_received_seq INTEGER NOT NULL DEFAULT 0,
+        last_sync_at TEXT
+    );
+    """)
+
+    # Latest change applied per originating replica, whichever peer relayed it
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS sync_origins (
+        origin TEXT PRIMARY KEY,
+        last_seq INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    """)
+
+    # Maps rows created on another replica to their local ids
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS sync_rowmap (
+        origin TEXT NOT NULL,
+        table_name TEXT NOT NULL,
+        origin_id INTEGER NOT NULL,
+        local_id INTEGER NOT NULL,
+        PRIMARY KEY (origin, table_name, origin_id)
+    ) WITHOUT ROWID;
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_sync_rowmap_local ON sync_rowmap(table_name, local_id);")
+
+    capture_on = "COALESCE((SELECT suppress_capture FROM trigger_control WHERE id=1), 0) = 0"
+    for table in CAPTURED_TABLES:
+        insert_delta = "NEW.stock_count" if table == "items" else "NULL"
+        update_delta = "NEW.stock_count - OLD.stock_count" if table == "items" else "NULL"
+        delete_delta = "NULL"
+        for event, op, ref, delta in (("INSERT", "I", "NEW", insert_delta),
+                                      ("UPDATE", "U", "NEW", update_delta),
+                                      ("DELETE", "D", "OLD", delete_delta)):
+            cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_capture_{event.lower()}
+            AFTER {event} ON {table}
+            WHEN {capture_on}
+            BEGIN
+                INSERT INTO change_log (table_name, row_id, op, stock_delta)
+                VALUES ('{table}', {ref}.id, '{op}', {delta});
+            END;
+            """)
+    conn.commit()
+
+# Why stock moved; the ledger triggers read these from trigger_control
+STOCK_REASONS = ("opening", "new_item", "sale", "return", "edit", "adjust", "import", "sync", "delete", "reconcile", "stocktake", "receipt", "line_removed")
+
+def _setup_stock_ledger(conn):
+    """Create stock_movements / stock_snapshots and the triggers that fill the ledger.
+
+    Every change of items.stock_count (any code path, including sync) is
+    appended to stock_movements by a trigger, in the same transaction.
+    Writers describe the change with stock_context(); without it a change
+    is recorded as an 'edit'. On first creation each existing item gets an
+    'opening' movement, so the deltas of an item always sum to its stock.
+    """
+    cur = conn.cursor()
+    for column in ("stock_reason", "stock_ref_type", "stock_ref_id"):
+        if not _table_has_column(conn, "trigger_control", column):
+            cur.execute(f"ALTER TABLE trigger_control ADD COLUMN {column}")
+
+    is_new = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='stock_movements'"
+    ).fetchone() is None
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS stock_movements (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        item_id INTEGER NOT NULL,
+        delta REAL NOT NULL,
+        reason TEXT NOT NULL,
+        ref_type TEXT,
+        ref_id INTEGER,
+        created_at TEXT NOT NULL
+    );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_stock_movements_item ON stock_movements(item_id, id);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_stock_movements_created ON stock_movements(created_at);")
+
+    # Stock of an item as of movement_id (all movements up to that id included)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS stock_snapshots (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        item_id INTEGER NOT NULL,
+        stock REAL NOT NULL,
+        movement_id INTEGER NOT NULL,
+        taken_at TEXT NOT NULL
+    );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_stock_snapshots_item ON stock_snapshots(item_id, taken_at);")
+
+    now = "strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')"
+    context = "(SELECT {} FROM trigger_control WHERE id=1)"
+    reason = f"COALESCE({context.format('stock_reason')}, '{{}}')"
+    ref = f"{context.format('stock_ref_type')}, {context.format('stock_ref_id')}"
+    for event, when, item, delta, default in (
+        ("INSERT", "NEW.stock_count <> 0", "NEW.id", "NEW.stock_count", "new_item"),
+        ("UPDATE OF stock_count", "NEW.stock_count IS NOT OLD.stock_count", "NEW.id",
+         "COALESCE(NEW.stock_count, 0) - COALESCE(OLD.stock_count, 0)", "edit"),
+        ("DELETE", "OLD.stock_count <> 0", "OLD.id", "-OLD.stock_count", "delete"),
+    ):
+        name = event.split()[0].lower()
+        cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_items_stock_{name}
+        AFTER {event} ON items
+        WHEN {when}
+        BEGIN
+            INSERT INTO stock_movements (item_id, delta, reason, ref_type, ref_id, created_at)
+            VALUES ({item}, {delta}, {reason.format(default)}, {ref}, {now});
+        END;
+        """)
+
+    if is_new:
+        cur.execute(f"""
+            INSERT INTO stock_movements (item_id, delta, reason, created_at)
+            SELECT id, stock_count, 'opening', {now} FROM items WHERE stock_count <> 0
+        """)
+    conn.commit()
+
+    _setup_stock_reconcile(conn)
+
+def _setup_stock_reconcile(conn):
+    """Queue and results of the stock reconciliation job.
+
+    Triggers put every item whose movements or sale lines change into
+    stock_reconcile_queue, so a reconciliation run only looks at those.
+    stock_drift holds the items currently found out of line.
+    """
+    cur = conn.cursor()
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_stock_movements_ref ON stock_movements(ref_type, ref_id, reason);")
+
+    is_new = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='stock_reconcile_queue'"
+    ).fetchone() is None
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS stock_reconcile_queue (
+        item_id INTEGER PRIMARY KEY
+    );
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS stock_drift (
+        item_id INTEGER PRIMARY KEY,
+        stock_count REAL NOT NULL,
+        expected_stock REAL NOT NULL,
+        drift REAL NOT NULL,
+        detected_at TEXT NOT NULL,
+        repaired_at TEXT
+    );
+    """)
+
+    for name, table, event, refs in (
+        ("trg_stock_movements_reconcile", "stock_movements", "INSERT", ("NEW",)),
+        ("trg_sale_details_reconcile_insert", "sale_details", "INSERT", ("NEW",)),
+        ("trg_sale_details_reconcile_update", "sale_details", "UPDATE OF quantity, item_id", ("OLD", "NEW")),
+        ("trg_sale_details_reconcile_delete", "sale_details", "DELETE", ("OLD",)),
+    ):
+        body = "".join(
+            f"INSERT OR IGNORE INTO stock_reconcile_queue (item_id) VALUES ({ref}.item_id);" for ref in refs
+        )
+        cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {name}
+        AFTER {event} ON {table}
+        BEGIN
+            {body}
+        END;
+        """)
+
+    if is_new:
+        # First run checks everything
+        cur.execute("INSERT OR IGNORE INTO stock_reconcile_queue (item_id) SELECT id FROM items")
+    conn.commit()
+
+def _setup_margins(conn):
+    """Create sales_margin_daily and the triggers that keep it current.
+
+    One row per sale day and category (0 = none) with quantity, revenue and
+    cost, adjusted by triggers on every sale line insert, update and delete,
+    so margin reports read a few hundred rows instead of all sale history.
+    Sales and items delete their lines in a BEFORE DELETE trigger, because
+    rows removed by an ON DELETE CASCADE can no longer see their parent.
+    Lines deleted while trigger_control.archiving = 1 (moved to an archive
+    database) stay counted.
+    """
+    cur = conn.cursor()
+    if not _table_has_column(conn, "trigger_control", "archiving"):
+        cur.execute("ALTER TABLE trigger_control ADD COLUMN archiving INTEGER NOT NULL DEFAULT 0")
+    is_new = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='sales_margin_daily'"
+    ).fetchone() is None
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS sales_margin_daily (
+        day TEXT NOT NULL,
+        category_id INTEGER NOT NULL,
+        quantity REAL NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0,
+        cost REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, category_id)
+    ) WITHOUT ROWID;
+    """)
+
+    upsert = """
+        ON CONFLICT (day, category_id) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            revenue = revenue + excluded.revenue,
+            cost = cost + excluded.cost;"""
+
+    def line(ref, sign):
+        return f"""
+            INSERT INTO sales_margin_daily (day, category_id, quantity, revenue, cost)
+            SELECT substr(s.datetime, 1, 10), COALESCE(i.category_id, 0), {sign}{ref}.quantity,
+                   {sign}{ref}.quantity * {ref}.price_each, {sign}{ref}.quantity * {ref}.cost_each
+            FROM sales s LEFT JOIN items i ON i.id = {ref}.item_id
+            WHERE s.id = {ref}.sale_id{upsert}"""
+
+    def moved(where, day, category, sign):
+        return f"""
+            INSERT INTO sales_margin_daily (day, category_id, quantity, revenue, cost)
+            SELECT {day}, {category}, {sign}SUM(sd.quantity),
+                   {sign}SUM(sd.quantity * sd.price_each), {sign}SUM(sd.quantity * sd.cost_each)
+            FROM sale_details sd JOIN sales s ON s.id = sd.sale_id
+            WHERE {where}
+            GROUP BY 1, 2{upsert}"""
+
+    for name, event, when, body in (
+        ("insert", "AFTER INSERT ON sale_details", "1", line("NEW", "")),
+        ("delete", "AFTER DELETE ON sale_details",
+         "COALESCE((SELECT archiving FROM trigger_control WHERE id=1), 0) = 0", line("OLD", "-")),
+        ("update", "AFTER UPDATE OF sale_id, item_id, quantity, price_each, cost_each ON sale_details", "1",
+         line("OLD", "-") + line("NEW", "")),
+        # A sale moved to another day, an item moved to another category
+        ("sale_day", "AFTER UPDATE OF datetime ON sales",
+         "substr(NEW.datetime, 1, 10) IS NOT substr(OLD.datetime, 1, 10)",
+         moved("s.id = NEW.id", "substr(OLD.datetime, 1, 10)",
+               "COALESCE((SELECT category_id FROM items WHERE id = sd.item_id), 0)", "-")
+         + moved("s.id = NEW.id", "substr(NEW.datetime, 1, 10)",
+                 "COALESCE((SELECT category_id FROM items WHERE id = sd.item_id), 0)", "")),
+        ("item_category", "AFTER UPDATE OF category_id ON items",
+         "NEW.category_id IS NOT OLD.category_id",
+         moved("sd.item_id = NEW.id", "substr(s.datetime, 1, 10)", "COALESCE(OLD.category_id, 0)", "-")
+         + moved("sd.item_id = NEW.id", "substr(s.datetime, 1, 10)", "COALESCE(NEW.category_id, 0)", "")),
+        ("sale_delete", "BEFORE DELETE ON sales", "1", "DELETE FROM sale_details WHERE sale_id = OLD.id;"),
+        ("item_delete", "BEFORE DELETE ON items", "1", "DELETE FROM sale_details WHERE item_id = OLD.id;"),
+    ):
+        cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_margin_{name}
+        {event}
+        WHEN {when}
+        BEGIN
+            {body}
+        END;
+        """)
+
+    if is_new:
+        cur.execute("""
+            INSERT INTO sales_margin_daily (day, category_id, quantity, revenue, cost)
+            SELECT substr(s.datetime, 1, 10), COALESCE(i.category_id, 0), SUM(sd.quantity),
+                   SUM(sd.quantity * sd.price_each), SUM(sd.quantity * sd.cost_each)
+            FROM sale_details sd
+            JOIN sales s ON s.id = sd.sale_id
+            LEFT JOIN items i ON i.id = sd.item_id
+            GROUP BY 1, 2
+        """)
+    conn.commit()
+
+def _setup_table_versions(conn):
+    """Counters bumped by every insert, update and delete on the watched tables"""
+    cur = conn.cursor()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS table_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    """)
+    for table in WATCHED_TABLES:
+        cur.execute("INSERT OR IGNORE INTO table_versions (name) VALUES (?)", (table,))
+        for op in ("INSERT", "UPDATE", "DELETE"):
+            cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_version_{table}_{op.lower()}
+            AFTER {op} ON {table}
+            BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+            END;
+            """)
+    conn.commit()
+
+@contextmanager
+def stock_context(conn, reason, ref_type=None, ref_id=None):
+    """Label the stock changes made inside the block in the ledger (write jobs only)"""
+    conn.execute("UPDATE trigger_control SET stock_reason=?, stock_ref_type=?, stock_ref_id=? WHERE id=1",
+                 (reason, ref_type, ref_id))
+    try:
+        yield
+    finally:
+        conn.execute("UPDATE trigger_control SET stock_reason=NULL, stock_ref_type=NULL, stock_ref_id=NULL WHERE id=1")
+
+def setup_database(db_path=None):
     """Setup database with all required tables and indexes"""
-    must_seed = not os.path.exists(DB_NAME)
-    conn = get_connection()
+    must_seed = not os.path.exists(db_path or DB_NAME)
+    if must_seed:
+        # auto_vacuum must be chosen before the first table exists (and before WAL)
+        raw = sqlite3.connect(db_path or DB_NAME)
+        raw.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+        raw.execute("VACUUM;")
+        raw.close()
+    conn = get_connection(db_path)
     cur = conn.cursor()
 
     # Settings table
@@ -83,6 +912,7 @@ def setup_database():
         photo_path TEXT,
         add_date TEXT,
         updated_at TEXT,
+        cost REAL NOT NULL DEFAULT 0,
         FOREIGN KEY (category_id) REFERENCES categories(id) ON DELETE SET NULL
     );
     """)
@@ -106,6 +936,7 @@ def setup_database():
         quantity REAL NOT NULL,
         price_each REAL NOT NULL,
         created_at TEXT,
+        cost_each REAL NOT NULL DEFAULT 0,
         FOREIGN KEY (sale_id) REFERENCES sales(id) ON DELETE CASCADE,
         FOREIGN KEY (item_id) REFERENCES items(id) -- Will migrate to CASCADE
     );
@@ -153,6 +984,11 @@ def setup_database():
         cur.execute("UPDATE items SET updated_at = ? WHERE updated_at IS NULL", (current_time,))
         conn.commit()
 
+    # Purchase cost per item (moving average over goods receipts)
+    if not _table_has_column(conn, 'items', 'cost'):
+        cur.execute("ALTER TABLE items ADD COLUMN cost REAL NOT NULL DEFAULT 0")
+        conn.commit()
+
     # Ensure CASCADE for item_id in sale_details
     if not _table_has_item_fk_cascade_on_sale_details(conn):
         print("Migrating sale_details table to add CASCADE foreign key...")
@@ -187,6 +1023,11 @@ def setup_database():
         conn.commit()
         print("Migration completed successfully.")
 
+    # Item cost at the time of sale, for margins
+    if not _table_has_column(conn, 'sale_details', 'cost_each'):
+        cur.execute("ALTER TABLE sale_details ADD COLUMN cost_each REAL NOT NULL DEFAULT 0")
+        conn.commit()
+
     # Create indexes for performance
     indexes = [
         "CREATE INDEX IF NOT EXISTS idx_items_barcode ON items(barcode);",
@@ -197,6 +1038,15 @@ def setup_database():
         "CREATE INDEX IF NOT EXISTS idx_sale_details_item_id ON sale_details(item_id);",
         "CREATE INDEX IF NOT EXISTS idx_items_name ON items(name);",  # Added for faster search
         "CREATE INDEX IF NOT EXISTS idx_sales_created_at ON sales(created_at);",  # Added for faster date queries
+        # Stock tab: category filter combined with each sortable column, plus price range/sort
+        "CREATE INDEX IF NOT EXISTS idx_items_category_name ON items(category_id, name);",
+        "CREATE INDEX IF NOT EXISTS idx_items_category_price ON items(category_id, price);",
+        "CREATE INDEX IF NOT EXISTS idx_items_category_stock ON items(category_id, stock_count);",
+        "CREATE INDEX IF NOT EXISTS idx_items_price ON items(price);",
+        "CREATE INDEX IF NOT EXISTS idx_items_add_date ON items(add_date);",
+        # Sales search: amount range, and "sales containing item X" without touching the lines
+        "CREATE INDEX IF NOT EXISTS idx_sales_total_price ON sales(total_price);",
+        "CREATE INDEX IF NOT EXISTS idx_sale_details_item_sale ON sale_details(item_id, sale_id);",
     ]
     for sql in indexes:
         try:
@@ -206,6 +1056,154 @@ def setup_database():
 
     conn.commit()
 
+    # Change capture for replication between registers
+    _setup_change_capture(conn)
+
+    # Stock movement ledger (needs trigger_control from change capture)
+    _setup_stock_ledger(conn)
+
+    # Margin aggregates per day and category (needs cost_each)
+    _setup_margins(conn)
+
+    # Timings of maintenance tasks (see maintenance.py)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS maintenance_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        task TEXT NOT NULL,
+        started_at TEXT NOT NULL,
+        duration_ms REAL NOT NULL,
+        detail TEXT
+    );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_maintenance_log_task ON maintenance_log(task, started_at);")
+    conn.commit()
+
+    # Stocktakes: counted quantities per item and counter, applied in one go
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS stocktakes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        status TEXT NOT NULL DEFAULT 'open' CHECK (status IN ('open', 'committed', 'cancelled')),
+        note TEXT,
+        started_at TEXT NOT NULL,
+        closed_at TEXT
+    );
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS stocktake_counts (
+        stocktake_id INTEGER NOT NULL,
+        item_id INTEGER NOT NULL,
+        counter TEXT NOT NULL DEFAULT '',
+        counted REAL NOT NULL DEFAULT 0,
+        expected REAL NOT NULL,
+        PRIMARY KEY (stocktake_id, item_id, counter),
+        FOREIGN KEY (stocktake_id) REFERENCES stocktakes(id) ON DELETE CASCADE
+    ) WITHOUT ROWID;
+    """)
+    conn.commit()
+
+    # Purchase orders and goods receipts (see models.post_goods_receipt and services.Delivery)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS purchase_orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        supplier TEXT,
+        status TEXT NOT NULL DEFAULT 'open' CHECK (status IN ('open', 'received', 'cancelled')),
+        note TEXT,
+        created_at TEXT NOT NULL,
+        received_at TEXT
+    );
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS purchase_order_lines (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        po_id INTEGER NOT NULL,
+        item_id INTEGER NOT NULL,
+        quantity REAL NOT NULL,
+        cost_each REAL NOT NULL DEFAULT 0,
+        FOREIGN KEY (po_id) REFERENCES purchase_orders(id) ON DELETE CASCADE,
+        FOREIGN KEY (item_id) REFERENCES items(id) ON DELETE CASCADE
+    );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_purchase_order_lines_po ON purchase_order_lines(po_id);")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS goods_receipts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        po_id INTEGER,
+        supplier TEXT,
+        note TEXT,
+        total_cost REAL NOT NULL DEFAULT 0,
+        received_at TEXT NOT NULL,
+        FOREIGN KEY (po_id) REFERENCES purchase_orders(id) ON DELETE SET NULL
+    );
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS goods_receipt_lines (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        receipt_id INTEGER NOT NULL,
+        item_id INTEGER NOT NULL,
+        quantity REAL NOT NULL,
+        cost_each REAL NOT NULL DEFAULT 0,
+        FOREIGN KEY (receipt_id) REFERENCES goods_receipts(id) ON DELETE CASCADE,
+        FOREIGN KEY (item_id) REFERENCES items(id) ON DELETE CASCADE
+    );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_goods_receipt_lines_receipt ON goods_receipt_lines(receipt_id);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_goods_receipt_lines_item ON goods_receipt_lines(item_id);")
+    conn.commit()
+
+    # Append-only journal of the bill being built, so it survives a crash
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS cart_journal (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        cart_id TEXT NOT NULL,
+        op TEXT NOT NULL,
+        payload TEXT,
+        created_at TEXT NOT NULL
+    );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_cart_journal_cart ON cart_journal(cart_id, id);")
+    # Tills sharing one database each recover only their own bills ('' = journaled before this column)
+    if not _table_has_column(conn, "cart_journal", "register_id"):
+        cur.execute("ALTER TABLE cart_journal ADD COLUMN register_id TEXT NOT NULL DEFAULT ''")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_cart_journal_register ON cart_journal(register_id, id);")
+    conn.commit()
+
+    # Closed periods of sales moved into archive databases (see archive.py)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS archives (
+        period TEXT PRIMARY KEY,
+        file_name TEXT NOT NULL,
+        start_date TEXT NOT NULL,
+        end_date TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'archiving' CHECK (status IN ('archiving', 'done')),
+        sales INTEGER NOT NULL DEFAULT 0,
+        lines INTEGER NOT NULL DEFAULT 0,
+        total_price REAL NOT NULL DEFAULT 0,
+        archived_at TEXT,
+        first_sale_id INTEGER,
+        last_sale_id INTEGER,
+        first_line_id INTEGER,
+        last_line_id INTEGER
+    );
+    """)
+    conn.commit()
+    _setup_archive_ranges(conn, db_path)
+
+    # Demand forecast per item, refreshed by a batch job (see analytics.update_forecasts)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS item_forecasts (
+        item_id INTEGER PRIMARY KEY,
+        demand_per_day REAL NOT NULL,
+        demand_std REAL NOT NULL,
+        reorder_point REAL NOT NULL,
+        history_days INTEGER NOT NULL,
+        computed_at TEXT NOT NULL
+    );
+    """)
+    conn.commit()
+
+    # Change counters for views that refresh on their own (see ChangeDetector)
+    _setup_table_versions(conn)
+
     # Seed data if new DB
     if must_seed:
         print("Seeding initial data...")
@@ -221,23 +1219,38 @@ def setup_database():
     print("Database setup completed successfully.")
 
 def backup_database(backup_path=None):
-    """Create a backup of the database"""
+    """Create a consistent backup of the database (includes pages still in the WAL)"""
     if not backup_path:
-        from datetime import datetime
         backup_path = f"store_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
-    import shutil
-    shutil.copy2(DB_NAME, backup_path)
+    src = get_connection()
+    dst = sqlite3.connect(backup_path)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
     return backup_path
 
-def get_database_stats():
+def get_database_stats(db_path=None):
     """Return stats: table counts & DB size"""
-    conn = get_connection()
+    path = db_path or DB_NAME
+    conn = get_connection(path)
     cur = conn.cursor()
     stats = {}
     for table in ['categories', 'items', 'sales', 'sale_details']:
         cur.execute(f"SELECT COUNT(*) FROM {table}")
         stats[f"{table}_count"] = cur.fetchone()[0]
-    stats['db_size_bytes'] = os.path.getsize(DB_NAME) if os.path.exists(DB_NAME) else 0
+    stats['db_size_bytes'] = os.path.getsize(path) if os.path.exists(path) else 0
     stats['db_size_mb'] = round(stats['db_size_bytes'] / (1024*1024), 2)
+
+    # Fragmentation: share of pages on the freelist (reclaimed by incremental_vacuum)
+    stats['page_size'] = cur.execute("PRAGMA page_size").fetchone()[0]
+    stats['page_count'] = cur.execute("PRAGMA page_count").fetchone()[0]
+    stats['freelist_count'] = cur.execute("PRAGMA freelist_count").fetchone()[0]
+    stats['fragmentation_pct'] = round(100.0 * stats['freelist_count'] / stats['page_count'], 2) if stats['page_count'] else 0.0
+    stats['auto_vacuum'] = {0: "none", 1: "full", 2: "incremental"}.get(cur.execute("PRAGMA auto_vacuum").fetchone()[0])
+    wal_path = path + "-wal"
+    stats['wal_size_bytes'] = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+    stats['wal_size_mb'] = round(stats['wal_size_bytes'] / (1024*1024), 2)
     conn.close()
     return stats
\ No newline at end of file
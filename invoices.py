@@ -0,0 +1,159 @@
+# invoices.py
+"""
+Bulk PDF invoices for saved sales (audits).
+
+Sales in a date range are read in id order, one page of ids at a time, and
+handed in batches to a process pool. Each worker renders the receipt HTML
+with Qt's offscreen platform (QTextDocument -> QPdfWriter). At most
+MAX_PENDING batches are in flight, so memory stays flat however many sales
+the range holds.
+
+mode "per-sale" writes invoice_<id>.pdf; "merged" writes one document per
+batch (invoices_<first id>-<last id>.pdf) with one sale per page. Finished
+sale ids are appended to manifest.jsonl in the output directory and a
+re-run with the same directory skips them, so an interrupted export
+resumes where it stopped.
+
+    python cli.py invoices --start 2024-01-01 --end 2024-12-31 --out invoices/ --workers 4
+"""
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+
+import models
+import receipts
+
+BATCH_SIZE = 50         # Sales per worker task
+PAGE_SIZE = 1000        # Sale ids read per query
+MANIFEST_NAME = "manifest.jsonl"
+
+# ---------- Worker side ----------
+_app = None
+
+def _init_worker():
+    """Each worker process gets its own headless Qt application"""
+    global _app
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtGui import QGuiApplication
+
+    _app = QGuiApplication.instance() or QGuiApplication(["invoices"])
+
+def _write_pdf(path, html):
+    from PyQt5.QtGui import QPdfWriter, QTextDocument, QPageSize
+
+    # Render to a temporary name so an interrupted run never leaves a truncated PDF
+    tmp_path = path + ".tmp"
+    writer = QPdfWriter(tmp_path)
+    writer.setPageSize(QPageSize(QPageSize.A5))
+    writer.setTitle(os.path.basename(path))
+    doc = QTextDocument()
+    doc.setHtml(html)
+    doc.print_(writer)
+    pages = doc.pageCount()
+    del writer
+    os.replace(tmp_path, path)
+    return pages
+
+def _render_batch(batch, out_dir, mode):
+    """Render one batch of receipts; returns (sale_ids, files, pages)"""
+    files, pages = [], 0
+    if mode == "merged":
+        path = os.path.join(out_dir, f"invoices_{batch[0].sale_id}-{batch[-1].sale_id}.pdf")
+        pages += _write_pdf(path, receipts.render_html_pages(batch))
+        files.append(os.path.basename(path))
+    else:
+        for r in batch:
+            path = os.path.join(out_dir, f"invoice_{r.sale_id}.pdf")
+            pages += _write_pdf(path, receipts.render_html(r))
+            files.append(os.path.basename(path))
+    return [r.sale_id for r in batch], files, pages
+
+# ---------- Export ----------
+def load_manifest(out_dir):
+    """Sale ids already exported into out_dir"""
+    done = set()
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    done.update(json.loads(line)["sale_ids"])
+                except (ValueError, KeyError):
+                    pass  # Line cut short by an interruption
+    return done
+
+def _iter_batches(start, end, batch_size, done, shop):
+    """Yield lists of Receipts for sales not exported yet, streaming ids page by page"""
+    after_id = 0
+    pending_ids = []
+    while True:
+        ids = models.get_sale_ids_between(start, end, after_id, PAGE_SIZE)
+        if not ids:
+            break
+        after_id = ids[-1]
+        pending_ids.extend(i for i in ids if i not in done)
+        while len(pending_ids) >= batch_size:
+            chunk, pending_ids = pending_ids[:batch_size], pending_ids[batch_size:]
+            yield receipts.receipts_for_sales(chunk, *shop)
+    if pending_ids:
+        yield receipts.receipts_for_sales(pending_ids, *shop)
+
+def export_invoices(out_dir, start=None, end=None, mode="per-sale", workers=None,
+                    batch_size=BATCH_SIZE, progress=None):
+    """
+    Export PDFs for the sales between start and end (YYYY-MM-DD, inclusive).
+    progress(summary) is called after every finished batch.
+    Returns a summary with counts and throughput.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    done = load_manifest(out_dir)
+    row = models.get_settings()
+    settings = dict(row) if row else {}
+    shop = (settings.get("shop_name") or "", settings.get("contact") or "",
+            settings.get("location") or "", settings.get("currency") or "")
+
+    workers = workers or os.cpu_count() or 1
+    max_pending = workers * 2
+    summary = {"mode": mode, "out_dir": out_dir, "workers": workers, "skipped": len(done),
+               "sales": 0, "files": 0, "pages": 0, "errors": 0}
+    started = time.monotonic()
+
+    with open(os.path.join(out_dir, MANIFEST_NAME), "a", encoding="utf-8") as manifest, \
+            ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                initializer=_init_worker) as pool:
+
+        def collect(finished):
+            for future in finished:
+                try:
+                    sale_ids, files, pages = future.result()
+                except Exception as e:
+                    summary["errors"] += 1
+                    print(f"Invoice batch failed: {e}", file=sys.stderr)  # stdout is the CLI's JSON
+                    continue
+                manifest.write(json.dumps({
+                    "sale_ids": sale_ids, "files": files,
+                    "at": datetime.now().isoformat(timespec="seconds"),
+                }) + "\n")
+                manifest.flush()
+                summary["sales"] += len(sale_ids)
+                summary["files"] += len(files)
+                summary["pages"] += pages
+                if progress:
+                    progress(summary)
+
+        pending = set()
+        for batch in _iter_batches(start, end, batch_size, done, shop):
+            if len(pending) >= max_pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+            pending.add(pool.submit(_render_batch, batch, out_dir, mode))
+        collect(wait(pending).done)
+
+    elapsed = time.monotonic() - started
+    summary["elapsed_s"] = round(elapsed, 2)
+    summary["sales_per_sec"] = round(summary["sales"] / elapsed, 2) if elapsed else 0
+    return summary
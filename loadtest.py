@@ -0,0 +1,264 @@
+# loadtest.py
+"""
+Concurrent-register load test for a store database (no GUI).
+
+Spawns N simulated registers as threads or processes. Each one scans items
+through models.get_item_by_barcode at a fixed rate, saves bills, and now and
+then edits stock or runs a report. At the end it prints throughput,
+p50/p95/p99 latencies per operation, lock waits and WAL growth.
+
+Lock waits are measured where writes start: the writer thread times its
+BEGIN IMMEDIATE, which blocks while another connection (another register
+process) holds the write lock, and how long jobs sat in its queue behind
+other writes of the same process.
+
+    python loadtest.py --db loadtest.db --registers 8 --mode process --duration 60
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import database
+import models
+
+LOCK_ERRORS = ("database is locked", "database is busy")
+MAX_LOCK_RETRIES = 3    # Attempts after a lock error before the operation counts as failed
+
+def seed_items(db_path, count):
+    """Create the schema and make sure the database has at least count items"""
+    database.setup_database(db_path)
+    conn = database.get_connection(db_path)
+    try:
+        existing = conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+        now = datetime.now().isoformat(timespec="seconds")
+        rows = [
+            (f"Load item {n}", None, f"{2000000000000 + n}", round(random.uniform(1, 500), 2), 10**6, None, now, now)
+            for n in range(existing, count)
+        ]
+        conn.executemany("""
+            INSERT OR IGNORE INTO items (name, category_id, barcode, price, stock_count, photo_path, add_date, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        conn.commit()
+        return [r["barcode"] for r in conn.execute("SELECT barcode FROM items WHERE barcode IS NOT NULL")]
+    finally:
+        conn.close()
+
+def _wal_size(db_path):
+    wal = db_path + "-wal"
+    return os.path.getsize(wal) if os.path.exists(wal) else 0
+
+class Register:
+    """One simulated till; collects latencies per operation"""
+
+    def __init__(self, register_id, barcodes, args):
+        self.register_id = register_id
+        self.barcodes = barcodes
+        self.args = args
+        self.rng = random.Random(args.seed + register_id)
+        self.latencies = {"scan": [], "save_bill": [], "stock_edit": [], "report": []}
+        self.lock_retries = 0
+        self.errors = 0
+
+    def _timed(self, op, fn, *fn_args):
+        # A lock error comes after the whole busy timeout; retried a few times
+        for attempt in range(MAX_LOCK_RETRIES + 1):
+            start = time.perf_counter()
+            try:
+                result = fn(*fn_args)
+                self.latencies[op].append(time.perf_counter() - start)
+                return result
+            except sqlite3.OperationalError as e:
+                if not any(msg in str(e) for msg in LOCK_ERRORS) or attempt == MAX_LOCK_RETRIES:
+                    self.errors += 1
+                    return None
+                self.lock_retries += 1
+
+    def _save_bill(self, bill):
+        # Same call as the checkout service: sale, lines and stock in one transaction
+        total = sum(item["price"] for item in bill)
+        return models.save_sale(total, [(item["id"], 1, item["price"]) for item in bill])
+
+    def run(self, deadline):
+        interval = 1.0 / self.args.scan_rate if self.args.scan_rate > 0 else 0
+        bill = []
+        bill_size = self.rng.randint(1, self.args.max_bill_size)
+        ops = 0
+        next_scan = time.monotonic()
+        while time.monotonic() < deadline:
+            item = self._timed("scan", models.get_item_by_barcode, self.rng.choice(self.barcodes))
+            if item:
+                bill.append({"id": item["id"], "price": item["price"]})
+            if len(bill) >= bill_size:
+                self._timed("save_bill", self._save_bill, bill)
+                bill = []
+                bill_size = self.rng.randint(1, self.args.max_bill_size)
+            ops += 1
+            if self.args.stock_edit_every and ops % self.args.stock_edit_every == 0:
+                item = models.get_item_by_barcode(self.rng.choice(self.barcodes))
+                if item:
+                    self._timed("stock_edit", models.adjust_stock, item["id"], self.rng.randint(1, 50))
+            if self.args.report_every and ops % self.args.report_every == 0:
+                report = self.rng.choice((models.get_top_selling_items, models.get_sales_summary_by_category))
+                self._timed("report", report)
+            if interval:
+                next_scan += interval
+                delay = next_scan - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_scan = time.monotonic()
+        return {"latencies": self.latencies, "lock_retries": self.lock_retries, "errors": self.errors}
+
+def _writer_waits():
+    """Waits before writes started, as timed by this process's writer thread"""
+    writer = database.get_writer()
+    return {
+        "writes": writer.jobs_done,
+        "lock_waits": writer.lock_waits,
+        "lock_wait_s": writer.lock_wait_s,
+        "lock_wait_max_s": writer.lock_wait_max_s,
+        "queue_wait_s": writer.queue_wait_s,
+        "queue_wait_max_s": writer.queue_wait_max_s,
+    }
+
+def _run_register(register_id, barcodes, args, deadline):
+    database.DB_NAME = args.db
+    result = Register(register_id, barcodes, args).run(deadline)
+    result["wal_bytes"] = _wal_size(args.db)  # Before shutdown checkpoints and removes the WAL
+    result["writer"] = _writer_waits()
+    database.shutdown_writers()
+    return result
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+def summarize(results, elapsed, wal_samples, stall_ms, writers):
+    """writers: _writer_waits() of every writer thread (one per process)"""
+    summary = {"elapsed_s": round(elapsed, 2), "operations": {}, "lock_retries": 0, "errors": 0}
+    for r in results:
+        summary["lock_retries"] += r["lock_retries"]
+        summary["errors"] += r["errors"]
+    writes = sum(w["writes"] for w in writers)
+    lock_waits = sum(w["lock_waits"] for w in writers)
+    lock_wait_s = sum(w["lock_wait_s"] for w in writers)
+    queue_wait_s = sum(w["queue_wait_s"] for w in writers)
+    summary["writes"] = writes
+    summary["lock_waits"] = {
+        "count": lock_waits,
+        "total_ms": round(lock_wait_s * 1000, 2),
+        "avg_ms": round(lock_wait_s * 1000 / lock_waits, 2) if lock_waits else 0.0,
+        "max_ms": round(max((w["lock_wait_max_s"] for w in writers), default=0) * 1000, 2),
+    }
+    summary["queue_waits"] = {
+        "total_ms": round(queue_wait_s * 1000, 2),
+        "avg_ms": round(queue_wait_s * 1000 / writes, 2) if writes else 0.0,
+        "max_ms": round(max((w["queue_wait_max_s"] for w in writers), default=0) * 1000, 2),
+    }
+    for op in ("scan", "save_bill", "stock_edit", "report"):
+        values = sorted(v for r in results for v in r["latencies"][op])
+        summary["operations"][op] = {
+            "count": len(values),
+            "per_sec": round(len(values) / elapsed, 2) if elapsed else 0,
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2) if values else 0,
+            "stalls": sum(1 for v in values if v * 1000 > stall_ms),
+        }
+    summary["wal_bytes"] = {
+        "start": wal_samples[0],
+        "end": wal_samples[-1],
+        "max": max(wal_samples),
+        "growth": max(wal_samples) - wal_samples[0],
+    }
+    return summary
+
+def run_load_test(args):
+    barcodes = seed_items(args.db, args.items)
+    wal_samples = [_wal_size(args.db)]
+    start = time.monotonic()
+    deadline = start + args.duration
+
+    if args.mode == "process":
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(args.registers) as pool:
+            pending = pool.starmap_async(
+                _run_register, [(n, barcodes, args, deadline) for n in range(args.registers)]
+            )
+            while not pending.ready():
+                pending.wait(0.5)
+                wal_samples.append(_wal_size(args.db))
+            results = pending.get()
+        # The last register to stop removes the WAL, so use what they saw before stopping
+        wal_samples.append(max(r["wal_bytes"] for r in results))
+        writers = [r["writer"] for r in results]
+    else:
+        database.DB_NAME = args.db
+        results = [None] * args.registers
+
+        def _worker(n):
+            results[n] = Register(n, barcodes, args).run(deadline)
+
+        threads = [threading.Thread(target=_worker, args=(n,)) for n in range(args.registers)]
+        for t in threads:
+            t.start()
+        while any(t.is_alive() for t in threads):
+            time.sleep(0.5)
+            wal_samples.append(_wal_size(args.db))
+        wal_samples.append(_wal_size(args.db))  # Before shutdown checkpoints and removes the WAL
+        writers = [_writer_waits()]
+        database.shutdown_writers()
+
+    elapsed = time.monotonic() - start
+    return summarize(results, elapsed, wal_samples, args.stall_ms, writers)
+
+def _print_summary(summary, args):
+    print(f"Registers: {args.registers} ({args.mode}), duration {summary['elapsed_s']}s, db {args.db}")
+    print(f"{'operation':<12}{'count':>8}{'per sec':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'stalls':>8}")
+    for op, s in summary["operations"].items():
+        print(f"{op:<12}{s['count']:>8}{s['per_sec']:>10}{s['p50_ms']:>10}{s['p95_ms']:>10}"
+              f"{s['p99_ms']:>10}{s['max_ms']:>10}{s['stalls']:>8}")
+    wal = summary["wal_bytes"]
+    locks, queued = summary["lock_waits"], summary["queue_waits"]
+    print(f"Writes: {summary['writes']}  Lock waits: {locks['count']} (total {locks['total_ms']} ms, "
+          f"avg {locks['avg_ms']} ms, max {locks['max_ms']} ms)")
+    print(f"Writer queue wait: total {queued['total_ms']} ms, avg {queued['avg_ms']} ms, max {queued['max_ms']} ms")
+    print(f"Lock retries: {summary['lock_retries']}  Errors: {summary['errors']}")
+    print(f"WAL bytes: start {wal['start']}, max {wal['max']}, end {wal['end']} (growth {wal['growth']})")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate concurrent registers against a store database")
+    parser.add_argument("--db", default="loadtest.db", help="database file to load (created and seeded if needed)")
+    parser.add_argument("--registers", type=int, default=4, help="number of simulated registers")
+    parser.add_argument("--mode", choices=("thread", "process"), default="thread")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run")
+    parser.add_argument("--scan-rate", type=float, default=5, help="scans per second per register (0 = unthrottled)")
+    parser.add_argument("--items", type=int, default=5000, help="catalog size to seed")
+    parser.add_argument("--max-bill-size", type=int, default=15, help="largest bill in scanned lines")
+    parser.add_argument("--stock-edit-every", type=int, default=50, help="stock edit every N scans (0 = never)")
+    parser.add_argument("--report-every", type=int, default=500, help="report every N scans (0 = never)")
+    parser.add_argument("--stall-ms", type=float, default=250, help="latency counted as a stall")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args(argv)
+
+    summary = run_load_test(args)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        _print_summary(summary, args)
+    return summary
+
+if __name__ == "__main__":
+    main()
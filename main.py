@@ -3,8 +3,9 @@ import os
 from PyQt5.QtWidgets import QApplication
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QFont
-from database import setup_database
+from database import setup_database, start_report_refresher
 from controllers import Controller
+from maintenance import MaintenanceScheduler
 from qss import APP_QSS
 
 def setup_application():
@@ -69,16 +70,27 @@ def main():
     """Main application entry point"""
     # Setup database
     setup_database()
+
+    # Keep the reporting snapshot warm so reports never read the live database
+    start_report_refresher()
     
     # Create required directories
     create_required_directories()
     
     # Setup and configure application
     app = setup_application()
+
+    # Checkpoint / optimize / vacuum while idle, and once more at exit
+    scheduler = MaintenanceScheduler()
+    scheduler.start()
+    app.aboutToQuit.connect(scheduler.stop)
     
     # Create and show main window
     window = Controller()
     window.show()
+
+    # Let queued receipts finish printing before exit
+    app.aboutToQuit.connect(window.print_queue.stop)
     
     # Center window on screen
     screen = app.primaryScreen().geometry()
@@ -0,0 +1,249 @@
+# maintenance.py
+"""
+Database maintenance: WAL checkpoints, ANALYZE / PRAGMA optimize,
+incremental vacuum, a rolling per-table quick_check, daily stock
+snapshots for the movement ledger, hourly stock reconciliation and daily
+demand forecasts (when NumPy is installed).
+
+MaintenanceScheduler runs the idle tasks from a background thread once the
+writer has been quiet for IDLE_SECONDS, and the shutdown tasks when stopped.
+Every task run is timed and recorded in maintenance_log.
+
+Incremental vacuum needs auto_vacuum=INCREMENTAL, which new databases get
+from setup_database. Older ones (the shipped store.db, existing tills) are
+converted by the first shutdown run, with one full VACUUM; until then the
+idle runs leave vacuuming out.
+"""
+import json
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import database
+from database import get_connection, run_write
+
+IDLE_SECONDS = 60          # No commits for this long means the register is idle
+POLL_SECONDS = 15
+VACUUM_PAGES = 2000        # Pages released per idle incremental_vacuum run
+VACUUM_MIN_FREE_PCT = 1.0  # Only vacuum when at least this share of pages is free
+LOG_RETENTION_DAYS = 90
+
+# Minimum seconds between two runs of each idle task
+TASK_INTERVALS = {
+    "checkpoint": 300,
+    "optimize": 3600,
+    "incremental_vacuum": 3600,
+    "quick_check": 3600,
+    "analyze": 86400,
+    "prune_logs": 86400,
+    "stock_snapshot": 86400,
+    "reconcile_stock": 3600,
+    "forecast_items": 86400,
+}
+
+# quick_check visits one table per run so an idle slot never takes long
+QUICK_CHECK_TABLES = ("settings", "categories", "items", "sales", "sale_details")
+
+# ---------- Tasks ----------
+def checkpoint(conn, mode="PASSIVE"):
+    """Copy WAL frames into the database (PASSIVE never waits for readers)"""
+    busy, log_frames, checkpointed = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    return {"mode": mode, "busy": busy, "log_frames": log_frames, "checkpointed": checkpointed}
+
+def optimize(conn):
+    """Let SQLite refresh statistics it considers stale"""
+    conn.execute("PRAGMA optimize").fetchall()
+    return {}
+
+def analyze(conn):
+    """Full statistics refresh for the query planner"""
+    conn.execute("ANALYZE")
+    conn.commit()
+    return {}
+
+def incremental_vacuum(conn, max_pages=VACUUM_PAGES):
+    """Return free pages to the filesystem (max_pages=0 releases all of them)"""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return {"skipped": "auto_vacuum is not INCREMENTAL"}
+    before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    # executescript steps the pragma to completion; execute() frees a single page
+    conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages)});")
+    after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return {"pages_released": before - after, "freelist_count": after}
+
+def enable_incremental_vacuum(conn):
+    """Switch an existing database to auto_vacuum=INCREMENTAL (rewrites the file once)"""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return {"changed": False}
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    return {"changed": True}
+
+def quick_check(conn, table=None):
+    """Run PRAGMA quick_check on one table (or the whole database)"""
+    sql = f"PRAGMA quick_check({table})" if table else "PRAGMA quick_check"
+    rows = [r[0] for r in conn.execute(sql).fetchall()]
+    return {"table": table, "ok": rows == ["ok"], "errors": [] if rows == ["ok"] else rows[:20]}
+
+def stock_snapshot(conn):
+    """Snapshot stock of items that moved, bounding stock-at-time queries"""
+    import models
+
+    return {"snapshots": models.take_stock_snapshots()}
+
+def reconcile_stock(conn):
+    """Check items whose stock history changed since the last run (no repair)"""
+    import models
+
+    return models.reconcile_stock()
+
+def forecast_items(conn):
+    """Recompute demand rates and reorder points of all items"""
+    import analytics
+
+    if analytics.np is None:
+        return {"skipped": "NumPy is not installed"}
+    return analytics.update_forecasts()
+
+def prune_logs(conn, days=LOG_RETENTION_DAYS):
+    """Drop old maintenance records and change_log entries all peers have"""
+    import sync
+
+    cutoff = (datetime.now() - timedelta(days=days)).isoformat(timespec="seconds")
+    def _write(wconn):
+        return wconn.execute("DELETE FROM maintenance_log WHERE started_at < ?", (cutoff,)).rowcount
+    removed = run_write(_write)
+    return {"maintenance_log": removed, "change_log": sync.prune_change_log()}
+
+# ---------- Runs ----------
+def _is_incremental(conn):
+    return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+def _record(task, started_at, duration_ms, detail):
+    def _write(conn):
+        conn.execute("""
+            INSERT INTO maintenance_log (task, started_at, duration_ms, detail)
+            VALUES (?, ?, ?, ?)
+        """, (task, started_at, duration_ms, json.dumps(detail, ensure_ascii=False)))
+    run_write(_write)
+
+def run_task(conn, task, fn, *args):
+    """Run one task, record its timing and return a result dict"""
+    started_at = datetime.now().isoformat(timespec="seconds")
+    start = time.perf_counter()
+    detail = fn(conn, *args)
+    duration_ms = round((time.perf_counter() - start) * 1000, 2)
+    _record(task, started_at, duration_ms, detail)
+    return {"task": task, "started_at": started_at, "duration_ms": duration_ms, "detail": detail}
+
+def _last_runs(conn):
+    rows = conn.execute("SELECT task, MAX(started_at) AS last FROM maintenance_log GROUP BY task").fetchall()
+    return {r["task"]: datetime.fromisoformat(r["last"]) for r in rows}
+
+def _next_quick_check_table(conn):
+    row = conn.execute("""
+        SELECT detail FROM maintenance_log WHERE task='quick_check' ORDER BY id DESC LIMIT 1
+    """).fetchone()
+    if row:
+        last = json.loads(row["detail"]).get("table")
+        if last in QUICK_CHECK_TABLES:
+            return QUICK_CHECK_TABLES[(QUICK_CHECK_TABLES.index(last) + 1) % len(QUICK_CHECK_TABLES)]
+    return QUICK_CHECK_TABLES[0]
+
+def run_idle_maintenance(force=False):
+    """Run every idle task that is due (all of them with force=True)"""
+    conn = get_connection()
+    results = []
+    try:
+        now = datetime.now()
+        last_runs = _last_runs(conn)
+
+        def due(task):
+            last = last_runs.get(task)
+            return force or last is None or (now - last).total_seconds() >= TASK_INTERVALS[task]
+
+        if due("checkpoint"):
+            results.append(run_task(conn, "checkpoint", checkpoint, "PASSIVE"))
+        if due("optimize"):
+            results.append(run_task(conn, "optimize", optimize))
+        if due("analyze"):
+            results.append(run_task(conn, "analyze", analyze))
+        if due("incremental_vacuum") and _is_incremental(conn):
+            page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if force or (page_count and 100.0 * free / page_count >= VACUUM_MIN_FREE_PCT):
+                results.append(run_task(conn, "incremental_vacuum", incremental_vacuum))
+        if due("quick_check"):
+            results.append(run_task(conn, "quick_check", quick_check, _next_quick_check_table(conn)))
+        if due("prune_logs"):
+            results.append(run_task(conn, "prune_logs", prune_logs))
+        if due("stock_snapshot"):
+            results.append(run_task(conn, "stock_snapshot", stock_snapshot))
+        if due("reconcile_stock"):
+            results.append(run_task(conn, "reconcile_stock", reconcile_stock))
+        if due("forecast_items"):
+            results.append(run_task(conn, "forecast_items", forecast_items))
+    finally:
+        conn.close()
+    return results
+
+def run_shutdown_maintenance():
+    """
+    Optimize, release all free pages and truncate the WAL before exit. A
+    database without incremental auto_vacuum is converted instead, which
+    releases the free pages as well.
+    """
+    conn = get_connection()
+    try:
+        results = [run_task(conn, "optimize", optimize)]
+        if _is_incremental(conn):
+            results.append(run_task(conn, "incremental_vacuum", incremental_vacuum, 0))
+        else:
+            try:
+                results.append(run_task(conn, "enable_incremental_vacuum", enable_incremental_vacuum))
+            except sqlite3.OperationalError as e:
+                # Another register is using the database; tried again at the next shutdown
+                print(f"Switching to incremental auto_vacuum failed: {e}", file=sys.stderr)
+        results.append(run_task(conn, "checkpoint", checkpoint, "TRUNCATE"))
+        return results
+    finally:
+        conn.close()
+
+class MaintenanceScheduler:
+    """Background thread that runs idle maintenance while the register is quiet"""
+
+    def __init__(self, idle_seconds=IDLE_SECONDS, poll_seconds=POLL_SECONDS):
+        self.idle_seconds = idle_seconds
+        self.poll_seconds = poll_seconds
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def is_idle(self):
+        last_commit = database.get_writer().last_commit_at
+        return last_commit is None or time.monotonic() - last_commit >= self.idle_seconds
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="db-maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self, run_shutdown=True):
+        """Stop the thread and optionally run the shutdown tasks"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+        if run_shutdown:
+            try:
+                run_shutdown_maintenance()
+            except Exception as e:
+                print(f"Shutdown maintenance failed: {e}", file=sys.stderr)
+
+    def _loop(self):
+        while not self._stop_event.wait(self.poll_seconds):
+            if not self.is_idle():
+                continue
+            try:
+                run_idle_maintenance()
+            except Exception as e:
+                print(f"Idle maintenance failed: {e}", file=sys.stderr)
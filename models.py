@@ -1,7 +1,17 @@
+import json
+import math
+import os
+import socket
 from datetime import datetime, date
-from database import get_connection
+from database import (
+    get_connection, get_report_connection, run_write, submit_write, stock_context,
+    archive_batches, archive_source, cached_read,
+)
+
+LOW_STOCK_THRESHOLD = 5  # Low-stock level of items without a demand forecast
 
 # ---------- Settings ----------
+@cached_read()
 def get_settings():
     """Get application settings"""
     conn = get_connection()
@@ -15,8 +25,7 @@ def get_settings():
 
 def save_settings(shop_name: str, contact: str, location: str, currency: str):
     """Save application settings"""
-    conn = get_connection()
-    try:
+    def _write(conn):
         cur = conn.cursor()
         cur.execute("""
             INSERT INTO settings (id, shop_name, contact, location, currency)
@@ -27,21 +36,17 @@ def save_settings(shop_name: str, contact: str, location: str, currency: str):
               location=excluded.location,
               currency=excluded.currency
         """, (shop_name, contact, location, currency))
-        conn.commit()
-    finally:
-        conn.close()
+    run_write(_write)
 
 # ---------- Categories ----------
 def add_category(name: str):
     """Add new product category"""
-    conn = get_connection()
-    try:
+    def _write(conn):
         cur = conn.cursor()
         cur.execute("INSERT INTO categories (name) VALUES (?)", (name,))
-        conn.commit()
-    finally:
-        conn.close()
+    run_write(_write)
 
+@cached_read()
 def get_categories():
     """Get all product categories"""
     conn = get_connection()
@@ -69,40 +74,35 @@ def add_item(name, category_id, barcode, price, stock_count, photo_path, add_dat
     """Add new product item"""
     if not add_date:
         add_date = datetime.now().isoformat(timespec="seconds")
-    conn = get_connection()
-    try:
+    def _write(conn):
         cur = conn.cursor()
         cur.execute("""
-            INSERT INTO items (name, category_id, barcode, price, stock_count, photo_path, add_date)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (name, category_id, barcode, price, stock_count, photo_path, add_date))
-        conn.commit()
-    finally:
-        conn.close()
+            INSERT INTO items (name, category_id, barcode, price, stock_count, photo_path, add_date, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (name, category_id, barcode, price, stock_count, photo_path, add_date, add_date))
+        return cur.lastrowid
+    return run_write(_write)
 
 def update_item(item_id, name, category_id, barcode, price, stock_count, photo_path):
     """Update existing product item"""
-    conn = get_connection()
-    try:
+    updated_at = datetime.now().isoformat(timespec="seconds")
+    def _write(conn):
         cur = conn.cursor()
-        cur.execute("""
-            UPDATE items SET name=?, category_id=?, barcode=?, price=?, stock_count=?, photo_path=?
-            WHERE id=?
-        """, (name, category_id, barcode, price, stock_count, photo_path, item_id))
-        conn.commit()
-    finally:
-        conn.close()
+        with stock_context(conn, "edit", "item", item_id):
+            cur.execute("""
+                UPDATE items SET name=?, category_id=?, barcode=?, price=?, stock_count=?, photo_path=?, updated_at=?
+                WHERE id=?
+            """, (name, category_id, barcode, price, stock_count, photo_path, updated_at, item_id))
+    run_write(_write)
 
 def delete_item(item_id):
     """Delete product item (CASCADE will remove related sale_details)"""
-    conn = get_connection()
-    try:
+    def _write(conn):
         cur = conn.cursor()
         cur.execute("DELETE FROM items WHERE id=?", (item_id,))
-        conn.commit()
-    finally:
-        conn.close()
+    run_write(_write)
 
+@cached_read(maxsize=8)
 def get_items(limit=None, offset=0):
     """Get product items with category information, with pagination support"""
     conn = get_connection()
@@ -110,9 +110,10 @@ def get_items(limit=None, offset=0):
         cur = conn.cursor()
         sql = """
             SELECT i.id, i.name, i.barcode, i.price, i.stock_count, i.photo_path, i.add_date,
-                   c.name AS category_name, i.category_id
+                   c.name AS category_name, i.category_id, f.reorder_point, f.demand_per_day
             FROM items i
             LEFT JOIN categories c ON c.id = i.category_id
+            LEFT JOIN item_forecasts f ON f.item_id = i.id
             ORDER BY i.id DESC
         """
         
@@ -127,6 +128,7 @@ def get_items(limit=None, offset=0):
     finally:
         conn.close()
 
+@cached_read()
 def get_items_count():
     """Get total count of items"""
     conn = get_connection()
@@ -138,6 +140,87 @@ def get_items_count():
     finally:
         conn.close()
 
+# Stock tab filter/sort: every criterion is a plain indexed condition, so a
+# window of a large catalog costs an index range scan, not a full load.
+ITEM_SORT_COLUMNS = {
+    "id": "i.id", "name": "i.name", "category": "c.name", "barcode": "i.barcode",
+    "price": "i.price", "stock": "i.stock_count", "add_date": "i.add_date",
+}
+STOCK_STATUSES = ("out", "low", "ok")  # Same classes as services.stock_status
+
+def _glob_escape(text):
+    """text as a literal GLOB pattern"""
+    return "".join(f"[{c}]" if c in "*?[" else c for c in text)
+
+def _item_filters(text=None, category_id=None, status=None, price_min=None, price_max=None,
+                  threshold=LOW_STOCK_THRESHOLD):
+    """WHERE clause and parameters for the stock filters; None means no filter"""
+    where, params = [], []
+    if text:
+        # Name part or barcode prefix; digits can be either ("7up", "500g")
+        where.append("(i.name LIKE ? OR i.barcode GLOB ?)")
+        params += [f"%{text}%", _glob_escape(text) + "*"]
+    if category_id is not None:
+        where.append("i.category_id = ?")
+        params.append(category_id)
+    if status == "out":
+        where.append("i.stock_count <= 0")
+    elif status == "low":
+        # The constant upper bound turns this into a range on idx_items_stock
+        where.append("""i.stock_count > 0 AND i.stock_count <= COALESCE(f.reorder_point, ?)
+            AND i.stock_count <= (SELECT MAX(COALESCE(MAX(reorder_point), 0), ?) FROM item_forecasts)""")
+        params += [threshold, threshold]
+    elif status == "ok":
+        where.append("i.stock_count > COALESCE(f.reorder_point, ?)")
+        params.append(threshold)
+    elif status is not None:
+        raise ValueError(f"Unknown stock status {status!r}")
+    if price_min is not None:
+        where.append("i.price >= ?")
+        params.append(price_min)
+    if price_max is not None:
+        where.append("i.price <= ?")
+        params.append(price_max)
+    return ("WHERE " + " AND ".join(where)) if where else "", params
+
+@cached_read(maxsize=16)
+def query_items(text=None, category_id=None, status=None, price_min=None, price_max=None,
+                sort="id", descending=True, limit=100, offset=0):
+    """
+    One window of items matching the filters (text matches a part of the
+    name or a barcode prefix), ordered by a column of
+    ITEM_SORT_COLUMNS. Rows have the columns of get_items.
+    """
+    if sort not in ITEM_SORT_COLUMNS:
+        raise ValueError(f"Unknown sort column {sort!r}")
+    where, params = _item_filters(text, category_id, status, price_min, price_max)
+    direction = "DESC" if descending else "ASC"
+    conn = get_connection()
+    try:
+        return conn.execute(f"""
+            SELECT i.id, i.name, i.barcode, i.price, i.stock_count, i.photo_path, i.add_date,
+                   c.name AS category_name, i.category_id, f.reorder_point, f.demand_per_day
+            FROM items i
+            LEFT JOIN categories c ON c.id = i.category_id
+            LEFT JOIN item_forecasts f ON f.item_id = i.id
+            {where}
+            ORDER BY {ITEM_SORT_COLUMNS[sort]} {direction}, i.id {direction}
+            LIMIT ? OFFSET ?
+        """, params + [limit, offset]).fetchall()
+    finally:
+        conn.close()
+
+@cached_read()
+def count_items(text=None, category_id=None, status=None, price_min=None, price_max=None):
+    """Number of items matching the query_items filters"""
+    where, params = _item_filters(text, category_id, status, price_min, price_max)
+    forecasts = "LEFT JOIN item_forecasts f ON f.item_id = i.id" if status in ("low", "ok") else ""
+    conn = get_connection()
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM items i {forecasts} {where}", params).fetchone()[0]
+    finally:
+        conn.close()
+
 def get_item_by_barcode(barcode):
     """Get product item by barcode"""
     conn = get_connection()
@@ -180,31 +263,81 @@ def get_item_by_id(item_id):
     finally:
         conn.close()
 
-def adjust_stock(item_id, delta_quantity):
+def _adjust_stock(conn, item_id, delta_quantity):
+    """Adjust stock inside a write job"""
+    cur = conn.cursor()
+    # Ensure stock never goes below 0
+    if delta_quantity < 0:
+        cur.execute("UPDATE items SET stock_count = MAX(0, stock_count + ?) WHERE id=?", (delta_quantity, item_id))
+    else:
+        cur.execute("UPDATE items SET stock_count = stock_count + ? WHERE id=?", (delta_quantity, item_id))
+
+def adjust_stock(item_id, delta_quantity, reason="adjust"):
     """Adjust stock quantity for an item (positive to add, negative to subtract)"""
-    conn = get_connection()
-    try:
+    def _write(conn):
+        with stock_context(conn, reason, "item", item_id):
+            _adjust_stock(conn, item_id, delta_quantity)
+    run_write(_write)
+
+def import_items(rows):
+    """
+    Insert or update many items in one transaction.
+    rows: dicts with name, barcode, price, stock_count and optional category (name).
+    Items with a known barcode are updated, the rest are inserted.
+    Returns counts of inserted and updated items.
+    """
+    now = datetime.now().isoformat(timespec="seconds")
+    def _import(conn):
         cur = conn.cursor()
-        # Ensure stock never goes below 0
-        if delta_quantity < 0:
-            cur.execute("UPDATE items SET stock_count = MAX(0, stock_count + ?) WHERE id=?", (delta_quantity, item_id))
-        else:
-            cur.execute("UPDATE items SET stock_count = stock_count + ? WHERE id=?", (delta_quantity, item_id))
-        conn.commit()
-    finally:
-        conn.close()
+        categories = {r["name"]: r["id"] for r in cur.execute("SELECT id, name FROM categories")}
+        counts = {"inserted": 0, "updated": 0}
+        for row in rows:
+            cat_name = (row.get("category") or "").strip()
+            if cat_name and cat_name not in categories:
+                cur.execute("INSERT INTO categories (name, created_at) VALUES (?, ?)", (cat_name, now))
+                categories[cat_name] = cur.lastrowid
+            barcode = (row.get("barcode") or "").strip() or None
+            values = (row["name"], categories.get(cat_name), float(row.get("price") or 0),
+                      float(row.get("stock_count") or 0))
+            existing = None
+            if barcode:
+                existing = cur.execute("SELECT id FROM items WHERE barcode=?", (barcode,)).fetchone()
+            if existing:
+                cur.execute("""
+                    UPDATE items SET name=?, category_id=?, price=?, stock_count=?, updated_at=?
+                    WHERE id=?
+                """, values + (now, existing["id"]))
+                counts["updated"] += 1
+            else:
+                cur.execute("""
+                    INSERT INTO items (name, category_id, price, stock_count, barcode, add_date, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, values + (barcode, now, now))
+                counts["inserted"] += 1
+        return counts
+    def _write(conn):
+        with stock_context(conn, "import"):
+            return _import(conn)
+    return run_write(_write)
 
-def get_low_stock_items(threshold=5):
-    """Get items with stock below threshold"""
+@cached_read()
+def get_low_stock_items(threshold=LOW_STOCK_THRESHOLD):
+    """
+    Items at or below their reorder point, soonest stock-out first. Items
+    without a forecast (never sold) use the fixed threshold.
+    """
     conn = get_connection()
     try:
         cur = conn.cursor()
         cur.execute("""
-            SELECT i.id, i.name, i.stock_count, c.name AS category_name
+            SELECT i.id, i.name, i.stock_count, c.name AS category_name,
+                   f.reorder_point, f.demand_per_day,
+                   MAX(i.stock_count, 0) / NULLIF(f.demand_per_day, 0) AS days_to_stockout
             FROM items i
             LEFT JOIN categories c ON c.id = i.category_id
-            WHERE i.stock_count <= ?
-            ORDER BY i.stock_count ASC
+            LEFT JOIN item_forecasts f ON f.item_id = i.id
+            WHERE i.stock_count <= COALESCE(f.reorder_point, ?)
+            ORDER BY days_to_stockout IS NULL, days_to_stockout, i.stock_count
         """, (threshold,))
         rows = cur.fetchall()
         return rows
@@ -216,29 +349,52 @@ def add_sale(total_price, dt=None):
     """Add new sale record"""
     if not dt:
         dt = datetime.now().isoformat(timespec="seconds")
-    conn = get_connection()
-    try:
+    def _write(conn):
         cur = conn.cursor()
         cur.execute("INSERT INTO sales (datetime, total_price) VALUES (?,?)", (dt, total_price))
-        sale_id = cur.lastrowid
-        conn.commit()
-        return sale_id
-    finally:
-        conn.close()
+        return cur.lastrowid
+    return run_write(_write)
+
+# Current (average) cost of an item, captured into sale_details.cost_each at sale time
+_COST_NOW = "COALESCE((SELECT cost FROM items WHERE id = ?), 0)"
 
 def add_sale_detail(sale_id, item_id, quantity, price_each):
     """Add sale detail record"""
-    conn = get_connection()
-    try:
+    def _write(conn):
         cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO sale_details (sale_id, item_id, quantity, price_each)
-            VALUES (?, ?, ?, ?)
-        """, (sale_id, item_id, quantity, price_each))
-        conn.commit()
-    finally:
-        conn.close()
+        cur.execute(f"""
+            INSERT INTO sale_details (sale_id, item_id, quantity, price_each, cost_each)
+            VALUES (?, ?, ?, ?, {_COST_NOW})
+        """, (sale_id, item_id, quantity, price_each, item_id))
+    run_write(_write)
 
+def save_sale(total_price, lines, dt=None, cart_id=None):
+    """
+    Save a whole bill in one transaction: the sale, its details (with the
+    items' current cost) and the stock decrements.
+    lines: (item_id, quantity, price_each) tuples for database items.
+    cart_id: journal of the bill, closed in the same transaction.
+    Returns the new sale id.
+    """
+    if not dt:
+        dt = datetime.now().isoformat(timespec="seconds")
+    def _write(conn):
+        cur = conn.cursor()
+        cur.execute("INSERT INTO sales (datetime, total_price) VALUES (?,?)", (dt, total_price))
+        sale_id = cur.lastrowid
+        cur.executemany(f"""
+            INSERT INTO sale_details (sale_id, item_id, quantity, price_each, cost_each)
+            VALUES (?, ?, ?, ?, {_COST_NOW})
+        """, [(sale_id, item_id, qty, price, item_id) for item_id, qty, price in lines])
+        with stock_context(conn, "sale", "sale", sale_id):
+            for item_id, qty, _ in lines:
+                _adjust_stock(conn, item_id, -qty)
+        if cart_id:
+            conn.execute("DELETE FROM cart_journal WHERE cart_id=?", (cart_id,))
+        return sale_id
+    return run_write(_write)
+
+@cached_read()
 def get_sales(limit=200, offset=0):
     """Get sales records with limit and offset for pagination"""
     conn = get_connection()
@@ -250,6 +406,7 @@ def get_sales(limit=200, offset=0):
     finally:
         conn.close()
 
+@cached_read()
 def get_sales_count():
     """Get total count of sales"""
     conn = get_connection()
@@ -261,24 +418,160 @@ def get_sales_count():
     finally:
         conn.close()
 
+# Sales tab search: pages are keyset windows on the sale id (newest first),
+# so page 1000 costs the same as page 1. Archived periods are searched too,
+# one batch of attached archives at a time.
+def _sales_sources(attached, hot):
+    return {"sales": archive_source("sales", attached, hot),
+            "sale_details": archive_source("sale_details", attached, hot)}
+
+def _contains_item(conn, sources, item, rows_needed=None):
+    """
+    Condition on s and its parameters for sales containing an item (name
+    part or barcode prefix, as in the stock search). Two plans:
+    - collect the sale ids from the (item_id, sale_id) index: cost ~ matching lines
+    - walk sales newest first and check each one's lines: cost ~ rows_needed * sales / lines
+    They cost the same at lines = sqrt(rows_needed * sales), so the matching
+    lines are counted up to that bound to pick one. Without rows_needed
+    (a full count) every sale would be walked, so the index plan is used.
+    """
+    items = "SELECT id FROM items WHERE (name LIKE ? OR barcode GLOB ?)"
+    patterns = [f"%{item}%", _glob_escape(item) + "*"]
+    sale_details = sources["sale_details"]
+    use_index = True
+    if rows_needed:
+        sales = conn.execute("SELECT MAX(id) FROM sales").fetchone()[0] or 0
+        bound = max(1, math.isqrt(rows_needed * sales))
+        lines = conn.execute(f"""
+            SELECT COUNT(*) FROM (SELECT 1 FROM {sale_details} sd WHERE sd.item_id IN ({items}) LIMIT ?)
+        """, (*patterns, bound)).fetchone()[0]
+        use_index = lines < bound
+    if use_index:
+        return f"s.id IN (SELECT sd.sale_id FROM {sale_details} sd WHERE sd.item_id IN ({items}))", patterns
+    # +item_id: look lines up by sale id, not by (item, sale) once per matching item
+    return f"""EXISTS (SELECT 1 FROM {sale_details} sd
+        WHERE sd.sale_id = s.id AND +sd.item_id IN ({items}))""", patterns
+
+def _sale_filters(conn, sources, sale_id=None, start=None, end=None, amount_min=None, amount_max=None, item=None,
+                  rows_needed=None):
+    """WHERE clause and parameters for the sales search; None means no filter"""
+    where, params = [], []
+    if sale_id is not None:
+        where.append("s.id = ?")
+        params.append(sale_id)
+    if start:
+        where.append("s.datetime >= ?")
+        params.append(start)
+    if end:
+        where.append("s.datetime < ?")
+        params.append(f"{end}T99")  # end day inclusive
+    if amount_min is not None:
+        where.append("s.total_price >= ?")
+        params.append(amount_min)
+    if amount_max is not None:
+        where.append("s.total_price <= ?")
+        params.append(amount_max)
+    if item:
+        condition, patterns = _contains_item(conn, sources, item, rows_needed)
+        where.append(condition)
+        params += patterns
+    return where, params
+
+@cached_read(maxsize=16)
+def search_sales(sale_id=None, start=None, end=None, amount_min=None, amount_max=None, item=None,
+                 before_id=None, limit=200):
+    """
+    Newest-first page of sales matching the filters: a sale id, a day range
+    (YYYY-MM-DD, inclusive), a total range, and an item the sale contains.
+    The next page starts before_id = the last id of this one.
+    """
+    conn = get_connection()
+    try:
+        rows = []
+        sales = None if sale_id is None else (sale_id, sale_id)
+        for attached, hot in archive_batches(conn, start, end, sales=sales):
+            sources = _sales_sources(attached, hot)
+            where, params = _sale_filters(conn, sources, sale_id, start, end, amount_min, amount_max, item, limit)
+            if before_id is not None:
+                where.append("s.id < ?")
+                params.append(before_id)
+            rows += conn.execute(f"""
+                SELECT s.id, s.datetime, s.total_price FROM {sources["sales"]} AS s
+                {"WHERE " + " AND ".join(where) if where else ""}
+                ORDER BY s.id DESC LIMIT ?
+            """, params + [limit]).fetchall()
+        rows.sort(key=lambda r: r["id"], reverse=True)
+        return rows[:limit]
+    finally:
+        conn.close()
+
+@cached_read()
+def count_sales(sale_id=None, start=None, end=None, amount_min=None, amount_max=None, item=None, limit=None):
+    """Number of sales matching the search_sales filters, counting no further than limit"""
+    conn = get_connection()
+    try:
+        count = 0
+        sales = None if sale_id is None else (sale_id, sale_id)
+        for attached, hot in archive_batches(conn, start, end, sales=sales):
+            if limit is not None and count >= limit:
+                continue  # Enough counted; the remaining batches are only attached and detached
+            sources = _sales_sources(attached, hot)
+            where, params = _sale_filters(conn, sources, sale_id, start, end, amount_min, amount_max, item,
+                                          None if limit is None else limit - count)
+            count += conn.execute(f"""
+                SELECT COUNT(*) FROM (
+                    SELECT 1 FROM {sources["sales"]} AS s
+                    {"WHERE " + " AND ".join(where) if where else ""}
+                    LIMIT ?
+                )
+            """, params + [-1 if limit is None else limit - count]).fetchone()[0]
+        return count
+    finally:
+        conn.close()
+
+@cached_read()
 def get_sale_details(sale_id):
-    """Get details for a specific sale"""
+    """Get details for a specific sale (archived sales included)"""
     conn = get_connection()
     try:
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT sd.id, sd.item_id, i.name, i.barcode, sd.quantity, sd.price_each,
-                   (sd.quantity*sd.price_each) AS subtotal
-            FROM sale_details sd
-            JOIN items i ON i.id = sd.item_id
-            WHERE sd.sale_id=?
-            ORDER BY sd.id
-        """, (sale_id,))
-        rows = cur.fetchall()
+        rows = []
+        # Only the archives whose sale id range holds the sale are attached
+        for attached, hot in archive_batches(conn, sales=(sale_id, sale_id)):
+            sale_details = archive_source("sale_details", attached, hot)
+            cur = conn.cursor()
+            cur.execute(f"""
+                SELECT sd.id, sd.item_id, i.name, i.barcode, sd.quantity, sd.price_each,
+                       (sd.quantity*sd.price_each) AS subtotal
+                FROM {sale_details} sd
+                JOIN items i ON i.id = sd.item_id
+                WHERE sd.sale_id=?
+                ORDER BY sd.id
+            """, (sale_id,))
+            rows += cur.fetchall()
+        rows.sort(key=lambda r: r["id"])
         return rows
     finally:
         conn.close()
 
+def is_archived(table, row_id):
+    """True when a sale or sale line lives in an archive database, not in the hot one"""
+    if table not in ("sales", "sale_details"):
+        raise ValueError(f"{table} is not archived")
+    conn = get_connection()
+    try:
+        if conn.execute(f"SELECT 1 FROM {table} WHERE id=?", (row_id,)).fetchone():
+            return False
+        found = False
+        ids = {"sales" if table == "sales" else "lines": (row_id, row_id)}
+        for attached, hot in archive_batches(conn, **ids):
+            if attached and not found:
+                found = conn.execute(f"SELECT 1 FROM {archive_source(table, attached, hot=False)} AS t WHERE id=?",
+                                     (row_id,)).fetchone() is not None
+        return found
+    finally:
+        conn.close()
+
+@cached_read()
 def get_sales_summary_today():
     """Get total sales for today"""
     today = date.today().isoformat()
@@ -295,17 +588,22 @@ def get_sales_summary_today():
     finally:
         conn.close()
 
+@cached_read()
 def get_sales_total():
-    """Get total sales amount"""
+    """Get total sales amount (archived periods included)"""
     conn = get_connection()
     try:
         cur = conn.cursor()
-        cur.execute("SELECT COALESCE(SUM(total_price), 0) FROM sales")
+        cur.execute("""
+            SELECT COALESCE((SELECT SUM(total_price) FROM sales), 0)
+                 + COALESCE((SELECT SUM(total_price) FROM archives), 0)
+        """)
         total = cur.fetchone()[0]
         return total
     finally:
         conn.close()
 
+@cached_read()
 def get_latest_sale():
     """Get the most recent sale"""
     conn = get_connection()
@@ -319,27 +617,23 @@ def get_latest_sale():
 
 def delete_sale(sale_id, restock=True):
     """Delete sale and optionally restore stock"""
-    if restock:
-        # Get sale details before deletion to restore stock
-        details = get_sale_details(sale_id)
-        for d in details:
-            adjust_stock(d["item_id"], d["quantity"])
-    
-    conn = get_connection()
-    try:
+    def _write(conn):
         cur = conn.cursor()
+        if restock:
+            # Get sale details before deletion to restore stock
+            cur.execute("SELECT item_id, quantity FROM sale_details WHERE sale_id=?", (sale_id,))
+            with stock_context(conn, "return", "sale", sale_id):
+                for d in cur.fetchall():
+                    _adjust_stock(conn, d["item_id"], d["quantity"])
         # Delete sale details first (foreign key constraint)
         cur.execute("DELETE FROM sale_details WHERE sale_id=?", (sale_id,))
         # Delete sale record
         cur.execute("DELETE FROM sales WHERE id=?", (sale_id,))
-        conn.commit()
-    finally:
-        conn.close()
+    run_write(_write)
 
 def delete_sale_detail(detail_id, restock=True):
     """Delete a specific sale detail and optionally restore stock"""
-    conn = get_connection()
-    try:
+    def _write(conn):
         cur = conn.cursor()
         
         if restock:
@@ -353,7 +647,8 @@ def delete_sale_detail(detail_id, restock=True):
             
             if detail:
                 # Restore stock
-                adjust_stock(detail["item_id"], detail["quantity"])
+                with stock_context(conn, "return", "sale", detail["sale_id"]):
+                    _adjust_stock(conn, detail["item_id"], detail["quantity"])
                 
                 # Update sale total
                 cur.execute("""
@@ -368,17 +663,28 @@ def delete_sale_detail(detail_id, restock=True):
                         SET total_price = total_price - ? 
                         WHERE id=?
                     """, (amount_to_subtract, detail["sale_id"]))
-        
+        else:
+            # The goods stay sold but the line goes, so reconcile can no longer
+            # match the sale movement with it: move the line's share of the sale
+            # movement to a 'line_removed' one (net zero in the ledger)
+            for delta, reason in (("sd.quantity", "sale"), ("-sd.quantity", "line_removed")):
+                cur.execute(f"""
+                    INSERT INTO stock_movements (item_id, delta, reason, ref_type, ref_id, created_at)
+                    SELECT sd.item_id, {delta}, '{reason}', 'sale', sd.sale_id,
+                           strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')
+                    FROM sale_details sd
+                    WHERE sd.id = ? AND sd.quantity <> 0 AND EXISTS (
+                        SELECT 1 FROM stock_movements c
+                        WHERE c.ref_type = 'sale' AND c.ref_id = sd.sale_id AND c.reason = 'sale')
+                """, (detail_id,))
+
         # Delete the sale detail
         cur.execute("DELETE FROM sale_details WHERE id=?", (detail_id,))
-        conn.commit()
-    finally:
-        conn.close()
+    run_write(_write)
 
 def update_sale_detail(detail_id, new_quantity, price_each):
     """Update quantity and total for a sale detail"""
-    conn = get_connection()
-    try:
+    def _write(conn):
         cur = conn.cursor()
         
         # Get current detail info
@@ -411,10 +717,30 @@ def update_sale_detail(detail_id, new_quantity, price_each):
                 SET total_price = total_price + ? 
                 WHERE id=?
             """, (total_diff, sale_id))
-            
-            conn.commit()
-    finally:
-        conn.close()
+    run_write(_write)
+
+def set_sale_detail_quantity(detail_id, new_quantity):
+    """
+    Change the quantity of a sold line, adjusting the sale total and stock in
+    the same transaction. Works from the stored quantity and price, so callers
+    don't need to pass values back from the UI. Returns the old quantity, or
+    None if the detail doesn't exist.
+    """
+    def _write(conn):
+        cur = conn.cursor()
+        cur.execute("SELECT sale_id, item_id, quantity, price_each FROM sale_details WHERE id=?", (detail_id,))
+        detail = cur.fetchone()
+        if not detail:
+            return None
+        qty_diff = new_quantity - detail["quantity"]
+        cur.execute("UPDATE sale_details SET quantity=? WHERE id=?", (new_quantity, detail_id))
+        cur.execute("UPDATE sales SET total_price = total_price + ? WHERE id=?",
+                    (qty_diff * detail["price_each"], detail["sale_id"]))
+        # Selling more takes more from stock; selling less returns it
+        with stock_context(conn, "sale" if qty_diff > 0 else "return", "sale", detail["sale_id"]):
+            _adjust_stock(conn, detail["item_id"], -qty_diff)
+        return detail["quantity"]
+    return run_write(_write)
 
 def get_sale_detail_by_id(detail_id):
     """Get a specific sale detail by ID"""
@@ -433,58 +759,617 @@ def get_sale_detail_by_id(detail_id):
         conn.close()
 
 # ---------- Analytics and Reports ----------
+# Heavy reports read the reporting snapshot (see database.get_report_connection),
+# so they never hold a read transaction on the live database during checkout.
+def _merge_totals(totals, rows, key):
+    """Add per-batch report rows into totals {key: dict}, summing the total_* and num_* columns"""
+    for r in rows:
+        entry = totals.get(r[key])
+        if entry is None:
+            totals[r[key]] = dict(r)
+            continue
+        for column in r.keys():
+            if column.startswith(("total_", "num_")):
+                entry[column] = (entry[column] or 0) + (r[column] or 0)
+
+@cached_read(maxsize=8, snapshot=True)
 def get_sales_by_date_range(start_date, end_date):
-    """Get sales within date range"""
-    conn = get_connection()
+    """Get sales within date range (from archives too when the range reaches them)"""
+    conn = get_report_connection()
     try:
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT id, datetime, total_price 
-            FROM sales 
-            WHERE substr(datetime,1,10) BETWEEN ? AND ?
-            ORDER BY datetime DESC
-        """, (start_date, end_date))
-        rows = cur.fetchall()
+        rows = []
+        for attached, hot in archive_batches(conn, start_date, end_date):
+            sales = archive_source("sales", attached, hot)
+            cur = conn.cursor()
+            cur.execute(f"""
+                SELECT id, datetime, total_price 
+                FROM {sales} AS sales
+                WHERE datetime >= ? AND datetime < ?
+                ORDER BY datetime DESC
+            """, (start_date, f"{end_date}T99"))
+            rows += cur.fetchall()
+        rows.sort(key=lambda r: r["datetime"], reverse=True)
         return rows
     finally:
         conn.close()
 
+@cached_read(snapshot=True)
 def get_top_selling_items(limit=10):
     """Get top selling items by quantity"""
-    conn = get_connection()
+    conn = get_report_connection()
     try:
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT i.name, i.barcode, SUM(sd.quantity) as total_sold,
-                   SUM(sd.quantity * sd.price_each) as total_revenue
-            FROM sale_details sd
-            JOIN items i ON i.id = sd.item_id
-            GROUP BY sd.item_id
-            ORDER BY total_sold DESC
-            LIMIT ?
-        """, (limit,))
-        rows = cur.fetchall()
-        return rows
+        totals = {}
+        for attached, hot in archive_batches(conn):
+            sale_details = archive_source("sale_details", attached, hot)
+            cur = conn.cursor()
+            cur.execute(f"""
+                SELECT sd.item_id, i.name, i.barcode, SUM(sd.quantity) as total_sold,
+                       SUM(sd.quantity * sd.price_each) as total_revenue,
+                       SUM(sd.quantity * sd.cost_each) as total_cost,
+                       SUM(sd.quantity * (sd.price_each - sd.cost_each)) as total_profit
+                FROM {sale_details} sd
+                JOIN items i ON i.id = sd.item_id
+                GROUP BY sd.item_id
+            """)
+            _merge_totals(totals, cur.fetchall(), "item_id")
+        rows = sorted(totals.values(), key=lambda r: r["total_sold"], reverse=True)
+        return rows[:limit]
     finally:
         conn.close()
 
+@cached_read(snapshot=True)
 def get_sales_summary_by_category():
     """Get sales summary grouped by category"""
+    conn = get_report_connection()
+    try:
+        totals = {}
+        for attached, hot in archive_batches(conn):
+            sale_details = archive_source("sale_details", attached, hot)
+            cur = conn.cursor()
+            # A sale's lines are all in one place, so distinct sales add up across batches
+            cur.execute(f"""
+                SELECT i.category_id, c.name as category_name, 
+                       COUNT(DISTINCT sd.sale_id) as num_sales,
+                       SUM(sd.quantity) as total_quantity,
+                       SUM(sd.quantity * sd.price_each) as total_revenue,
+                       SUM(sd.quantity * sd.cost_each) as total_cost,
+                       SUM(sd.quantity * (sd.price_each - sd.cost_each)) as total_profit
+                FROM {sale_details} sd
+                JOIN items i ON i.id = sd.item_id
+                LEFT JOIN categories c ON c.id = i.category_id
+                GROUP BY i.category_id
+            """)
+            _merge_totals(totals, cur.fetchall(), "category_id")
+        return sorted(totals.values(), key=lambda r: r["total_revenue"], reverse=True)
+    finally:
+        conn.close()
+
+# Margins read the per-day/category aggregates kept by triggers (see
+# database._setup_margins): a few rows per day, never the sale lines.
+@cached_read()
+def get_margin_by_day(start_date=None, end_date=None):
+    """Quantity, revenue, cost and profit per day (YYYY-MM-DD range, inclusive)"""
+    conn = get_connection()
+    try:
+        return conn.execute("""
+            SELECT day, SUM(quantity) AS total_quantity, SUM(revenue) AS total_revenue,
+                   SUM(cost) AS total_cost, SUM(revenue - cost) AS total_profit
+            FROM sales_margin_daily
+            WHERE (? IS NULL OR day >= ?) AND (? IS NULL OR day <= ?)
+            GROUP BY day
+            HAVING SUM(quantity) <> 0 OR SUM(revenue) <> 0
+            ORDER BY day DESC
+        """, (start_date, start_date, end_date, end_date)).fetchall()
+    finally:
+        conn.close()
+
+@cached_read()
+def get_margin_by_category(start_date=None, end_date=None):
+    """Quantity, revenue, cost, profit and margin % per category over a day range"""
     conn = get_connection()
     try:
+        return conn.execute("""
+            SELECT c.name AS category_name, SUM(m.quantity) AS total_quantity,
+                   SUM(m.revenue) AS total_revenue, SUM(m.cost) AS total_cost,
+                   SUM(m.revenue - m.cost) AS total_profit,
+                   ROUND(100.0 * SUM(m.revenue - m.cost) / NULLIF(SUM(m.revenue), 0), 2) AS margin_pct
+            FROM sales_margin_daily m
+            LEFT JOIN categories c ON c.id = m.category_id
+            WHERE (? IS NULL OR m.day >= ?) AND (? IS NULL OR m.day <= ?)
+            GROUP BY m.category_id
+            HAVING SUM(m.quantity) <> 0 OR SUM(m.revenue) <> 0
+            ORDER BY total_profit DESC
+        """, (start_date, start_date, end_date, end_date)).fetchall()
+    finally:
+        conn.close()
+
+@cached_read()
+def get_profit_today():
+    """Gross profit (revenue - cost at sale time) of today's sales"""
+    today = date.today().isoformat()
+    conn = get_connection()
+    try:
+        return conn.execute(
+            "SELECT COALESCE(SUM(revenue - cost), 0) FROM sales_margin_daily WHERE day=?", (today,)
+        ).fetchone()[0]
+    finally:
+        conn.close()
+
+def get_sale_ids_between(start=None, end=None, after_id=0, limit=500):
+    """
+    Next page of sale ids (ascending) in a date range, after after_id.
+    end is inclusive of the whole day; None leaves that side open.
+    """
+    conn = get_connection()
+    try:
+        ids = []
+        end_before = f"{end}T99" if end else None
+        for attached, hot in archive_batches(conn, start, end):
+            sales = archive_source("sales", attached, hot)
+            ids += [r["id"] for r in conn.execute(f"""
+                SELECT id FROM {sales} AS sales
+                WHERE id > ? AND (? IS NULL OR datetime >= ?) AND (? IS NULL OR datetime < ?)
+                ORDER BY id LIMIT ?
+            """, (after_id, start, start, end_before, end_before, limit)).fetchall()]
+        return sorted(ids)[:limit]
+    finally:
+        conn.close()
+
+def get_sales_with_details(sale_ids):
+    """
+    Sales and their lines for a batch of ids in two queries, archived
+    sales included: ({sale_id: sale_row}, {sale_id: [detail_rows]})
+    """
+    sale_ids = [int(i) for i in sale_ids]
+    ids = json.dumps(sale_ids)
+    conn = get_connection()
+    try:
+        sales, details = {}, {}
+        id_range = (min(sale_ids), max(sale_ids)) if sale_ids else None
+        for attached, hot in archive_batches(conn, sales=id_range):
+            sales.update((r["id"], r) for r in conn.execute(f"""
+                SELECT id, datetime, total_price FROM {archive_source("sales", attached, hot)} AS sales
+                WHERE id IN (SELECT value FROM json_each(?))
+            """, (ids,)))
+            # A sale's lines are all in one place, so each list comes from a single batch
+            for r in conn.execute(f"""
+                SELECT sd.sale_id, sd.item_id, i.name, sd.quantity, sd.price_each
+                FROM {archive_source("sale_details", attached, hot)} sd
+                LEFT JOIN items i ON i.id = sd.item_id
+                WHERE sd.sale_id IN (SELECT value FROM json_each(?))
+                ORDER BY sd.sale_id, sd.id
+            """, (ids,)):
+                details.setdefault(r["sale_id"], []).append(r)
+        return sales, details
+    finally:
+        conn.close()
+
+# ---------- Stock ledger ----------
+def get_stock_movements(item_id, limit=100, offset=0):
+    """Latest stock movements of an item, newest first"""
+    conn = get_connection()
+    try:
+        return conn.execute("""
+            SELECT id, delta, reason, ref_type, ref_id, created_at FROM stock_movements
+            WHERE item_id=? ORDER BY id DESC LIMIT ? OFFSET ?
+        """, (item_id, limit, offset)).fetchall()
+    finally:
+        conn.close()
+
+def get_stock_at(item_id, at):
+    """
+    Stock of an item at a moment (ISO datetime string): the latest snapshot
+    taken by then plus the movements recorded after it, up to that moment
+    """
+    conn = get_connection()
+    try:
+        snap = conn.execute("""
+            SELECT stock, movement_id FROM stock_snapshots
+            WHERE item_id=? AND taken_at <= ? ORDER BY taken_at DESC, id DESC LIMIT 1
+        """, (item_id, at)).fetchone()
+        base, after_id = (snap["stock"], snap["movement_id"]) if snap else (0, 0)
+        moved = conn.execute("""
+            SELECT COALESCE(SUM(delta), 0) FROM stock_movements
+            WHERE item_id=? AND id > ? AND created_at <= ?
+        """, (item_id, after_id, at)).fetchone()[0]
+        return base + moved
+    finally:
+        conn.close()
+
+def take_stock_snapshots():
+    """
+    Snapshot the stock of every item that moved since its last snapshot.
+    Runs as one write job, so stock and the movement high-water mark agree.
+    Returns the number of snapshots taken.
+    """
+    taken_at = datetime.now().isoformat(timespec="milliseconds")
+    def _write(conn):
+        return conn.execute("""
+            INSERT INTO stock_snapshots (item_id, stock, movement_id, taken_at)
+            SELECT i.id, i.stock_count, m.last_id, ?
+            FROM items i
+            JOIN (SELECT item_id, MAX(id) AS last_id FROM stock_movements GROUP BY item_id) m
+                ON m.item_id = i.id
+            WHERE m.last_id > COALESCE((SELECT MAX(movement_id) FROM stock_snapshots s WHERE s.item_id = i.id), 0)
+        """, (taken_at,)).rowcount
+    return run_write(_write)
+
+_LEDGER_STOCK_SQL = """
+    WITH last_snap AS (
+        SELECT s.item_id, s.stock, s.movement_id
+        FROM stock_snapshots s
+        JOIN (SELECT item_id, MAX(movement_id) AS movement_id FROM stock_snapshots GROUP BY item_id) l
+            ON l.item_id = s.item_id AND l.movement_id = s.movement_id
+    ),
+    since AS (
+        SELECT m.item_id, SUM(m.delta) AS moved
+        FROM stock_movements m
+        LEFT JOIN last_snap ls ON ls.item_id = m.item_id
+        WHERE m.id > COALESCE(ls.movement_id, 0)
+        GROUP BY m.item_id
+    )
+    SELECT i.id, i.name, i.stock_count,
+           COALESCE(ls.stock, 0) + COALESCE(since.moved, 0) AS ledger_stock
+    FROM items i
+    LEFT JOIN last_snap ls ON ls.item_id = i.id
+    LEFT JOIN since ON since.item_id = i.id
+"""
+
+def get_stock_discrepancies(tolerance=1e-6):
+    """Items whose stock_count disagrees with snapshot + movements since it"""
+    conn = get_connection()
+    try:
+        return conn.execute(f"""
+            SELECT * FROM ({_LEDGER_STOCK_SQL}) WHERE ABS(stock_count - ledger_stock) > ?
+        """, (tolerance,)).fetchall()
+    finally:
+        conn.close()
+
+# ---------- Stock reconciliation ----------
+# Expected stock of the items in {source}: every non-sale movement, minus
+# what sale_details says was sold in sales the ledger has seen ('sale'
+# movement with that sale id). Returns of those sales are already reflected
+# by their smaller sale_details, so only returns of older sales count.
+# Lines deleted without restock leave a 'line_removed' movement in their
+# place (see delete_sale_detail), which counts like any non-sale movement.
+# Sales no longer in the sales table (deleted or archived) have no lines to
+# compare with, so their sale and return movements count as they are.
+# Reconcile movements are left out so a repair doesn't move the target.
+_EXPECTED_STOCK_SQL = """
+    WITH q AS (SELECT item_id FROM {source}),
+    adjusted AS (
+        SELECT m.item_id, SUM(m.delta) AS qty
+        FROM stock_movements m JOIN q ON q.item_id = m.item_id
+        WHERE m.reason NOT IN ('sale', 'return', 'reconcile')
+           OR (m.ref_type = 'sale' AND m.reason IN ('sale', 'return')
+               AND NOT EXISTS (SELECT 1 FROM sales s WHERE s.id = m.ref_id))
+           OR (m.reason = 'return' AND NOT EXISTS (
+                SELECT 1 FROM stock_movements c
+                WHERE c.ref_type = 'sale' AND c.ref_id = m.ref_id AND c.reason = 'sale'))
+        GROUP BY m.item_id
+    ),
+    sold AS (
+        SELECT sd.item_id, SUM(sd.quantity) AS qty
+        FROM sale_details sd JOIN q ON q.item_id = sd.item_id
+        WHERE EXISTS (
+            SELECT 1 FROM stock_movements c
+            WHERE c.ref_type = 'sale' AND c.ref_id = sd.sale_id AND c.reason = 'sale')
+        GROUP BY sd.item_id
+    )
+    SELECT i.id AS item_id, i.stock_count, COALESCE(a.qty, 0) - COALESCE(s.qty, 0) AS expected_stock
+    FROM items i
+    JOIN q ON q.item_id = i.id
+    LEFT JOIN adjusted a ON a.item_id = i.id
+    LEFT JOIN sold s ON s.item_id = i.id
+"""
+
+def reconcile_stock(full=False, repair=False, tolerance=1e-6):
+    """
+    Compare stock_count with the stock expected from sales and movements.
+    Only items queued since the last run and items already flagged are
+    checked, unless full=True.
+    Drifted items are kept in stock_drift; repair=True sets their stock to
+    the expected value (never below zero) as a 'reconcile' movement.
+    Returns counts of checked, drifted and repaired items.
+    """
+    now = datetime.now().isoformat(timespec="seconds")
+    # Flagged items are re-checked every run, so they clear (or get repaired) promptly
+    source = ("(SELECT id AS item_id FROM items)" if full else
+              "(SELECT item_id FROM stock_reconcile_queue UNION SELECT item_id FROM stock_drift)")
+    def _write(conn):
         cur = conn.cursor()
-        cur.execute("""
-            SELECT c.name as category_name, 
-                   COUNT(DISTINCT sd.sale_id) as num_sales,
-                   SUM(sd.quantity) as total_quantity,
-                   SUM(sd.quantity * sd.price_each) as total_revenue
-            FROM sale_details sd
-            JOIN items i ON i.id = sd.item_id
-            LEFT JOIN categories c ON c.id = i.category_id
-            GROUP BY i.category_id
-            ORDER BY total_revenue DESC
-        """)
-        rows = cur.fetchall()
-        return rows
+        queued = [r[0] for r in cur.execute("SELECT item_id FROM stock_reconcile_queue")]
+        rows = cur.execute(_EXPECTED_STOCK_SQL.format(source=source)).fetchall()
+        drifted = [r for r in rows if abs(r["stock_count"] - r["expected_stock"]) > tolerance]
+        drifted_ids = {r["item_id"] for r in drifted}
+        cur.executemany("DELETE FROM stock_drift WHERE item_id=?",
+                        [(r["item_id"],) for r in rows if r["item_id"] not in drifted_ids])
+        cur.executemany("""
+            INSERT INTO stock_drift (item_id, stock_count, expected_stock, drift, detected_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(item_id) DO UPDATE SET
+                stock_count=excluded.stock_count, expected_stock=excluded.expected_stock,
+                drift=excluded.drift, detected_at=excluded.detected_at, repaired_at=NULL
+        """, [(r["item_id"], r["stock_count"], r["expected_stock"],
+               r["stock_count"] - r["expected_stock"], now) for r in drifted])
+        cur.executemany("DELETE FROM stock_reconcile_queue WHERE item_id=?", [(i,) for i in queued])
+
+        repaired = 0
+        if repair and drifted:
+            with stock_context(conn, "reconcile", "reconcile"):
+                cur.executemany("UPDATE items SET stock_count = MAX(0, ?) WHERE id=?",
+                                [(r["expected_stock"], r["item_id"]) for r in drifted])
+            repaired = len(drifted)
+            # Items that could be set exactly are back in line; negative targets stay flagged
+            cur.executemany("UPDATE stock_drift SET stock_count=0, drift=-expected_stock, repaired_at=? WHERE item_id=?",
+                            [(now, r["item_id"]) for r in drifted if r["expected_stock"] < 0])
+            cur.executemany("DELETE FROM stock_drift WHERE item_id=?",
+                            [(r["item_id"],) for r in drifted if r["expected_stock"] >= 0])
+        return {"checked": len(rows), "drifted": len(drifted), "repaired": repaired}
+    return run_write(_write)
+
+def get_stock_drift():
+    """Items flagged by the last reconciliation runs, largest drift first"""
+    conn = get_connection()
+    try:
+        return conn.execute("""
+            SELECT d.item_id, i.name, i.barcode, d.stock_count, d.expected_stock, d.drift,
+                   d.detected_at, d.repaired_at
+            FROM stock_drift d
+            LEFT JOIN items i ON i.id = d.item_id
+            ORDER BY ABS(d.drift) DESC
+        """).fetchall()
+    finally:
+        conn.close()
+
+# ---------- Stocktake ----------
+def get_stock_index():
+    """{barcode: (item_id, name, stock_count)} for every item with a barcode"""
+    conn = get_connection()
+    try:
+        return {r["barcode"]: (r["id"], r["name"], r["stock_count"]) for r in conn.execute(
+            "SELECT id, name, barcode, stock_count FROM items WHERE barcode IS NOT NULL AND barcode <> ''"
+        )}
+    finally:
+        conn.close()
+
+def start_stocktake(note=None):
+    """Open a stocktake; returns its id"""
+    started_at = datetime.now().isoformat(timespec="seconds")
+    def _write(conn):
+        return conn.execute("INSERT INTO stocktakes (note, started_at) VALUES (?, ?)",
+                            (note, started_at)).lastrowid
+    return run_write(_write)
+
+def get_open_stocktake():
+    """The most recent open stocktake and its counts: (row, [count rows]) or (None, [])"""
+    conn = get_connection()
+    try:
+        row = conn.execute("SELECT * FROM stocktakes WHERE status='open' ORDER BY id DESC LIMIT 1").fetchone()
+        if not row:
+            return None, []
+        counts = conn.execute("""
+            SELECT item_id, counter, counted, expected FROM stocktake_counts WHERE stocktake_id=?
+        """, (row["id"],)).fetchall()
+        return row, counts
     finally:
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+def record_stocktake_count(stocktake_id, item_id, counter, qty, expected, wait=False):
+    """Add qty to a counter's count of an item; returns a Future unless wait=True"""
+    def _write(conn):
+        conn.execute("""
+            INSERT INTO stocktake_counts (stocktake_id, item_id, counter, counted, expected)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(stocktake_id, item_id, counter) DO UPDATE SET counted = counted + excluded.counted
+        """, (stocktake_id, item_id, counter, qty, expected))
+    return run_write(_write) if wait else submit_write(_write)
+
+def commit_stocktake(stocktake_id, zero_uncounted=False):
+    """
+    Apply a stocktake in one transaction. Each counted item moves by
+    (counted by all counters - stock when first scanned), so sales made
+    during the count are kept. zero_uncounted=True also sets every item
+    that wasn't scanned to zero (full count). Returns the number of items changed.
+    """
+    now = datetime.now().isoformat(timespec="seconds")
+    def _write(conn):
+        cur = conn.cursor()
+        with stock_context(conn, "stocktake", "stocktake", stocktake_id):
+            changed = cur.execute("""
+                UPDATE items SET stock_count = MAX(0, items.stock_count + c.delta), updated_at = ?
+                FROM (
+                    SELECT item_id, SUM(counted) - MAX(expected) AS delta
+                    FROM stocktake_counts WHERE stocktake_id = ?
+                    GROUP BY item_id
+                ) AS c
+                WHERE items.id = c.item_id AND c.delta <> 0
+            """, (now, stocktake_id)).rowcount
+            if zero_uncounted:
+                changed += cur.execute("""
+                    UPDATE items SET stock_count = 0, updated_at = ?
+                    WHERE stock_count <> 0 AND id NOT IN (
+                        SELECT item_id FROM stocktake_counts WHERE stocktake_id = ?)
+                """, (now, stocktake_id)).rowcount
+        cur.execute("UPDATE stocktakes SET status='committed', closed_at=? WHERE id=?", (now, stocktake_id))
+        return changed
+    return run_write(_write)
+
+def cancel_stocktake(stocktake_id):
+    now = datetime.now().isoformat(timespec="seconds")
+    def _write(conn):
+        conn.execute("UPDATE stocktakes SET status='cancelled', closed_at=? WHERE id=?", (now, stocktake_id))
+    run_write(_write)
+
+# ---------- Forecasts ----------
+def save_item_forecasts(rows, computed_at):
+    """Replace all forecasts; rows: (item_id, demand_per_day, demand_std, reorder_point, history_days)"""
+    def _write(conn):
+        conn.execute("DELETE FROM item_forecasts")
+        conn.executemany("""
+            INSERT INTO item_forecasts (item_id, demand_per_day, demand_std, reorder_point, history_days, computed_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [(*r, computed_at) for r in rows])
+    run_write(_write)
+
+def get_item_forecast(item_id):
+    """Forecast of one item with its expected days to stock-out, or None"""
+    conn = get_connection()
+    try:
+        return conn.execute("""
+            SELECT f.*, i.stock_count,
+                   MAX(i.stock_count, 0) / NULLIF(f.demand_per_day, 0) AS days_to_stockout
+            FROM item_forecasts f JOIN items i ON i.id = f.item_id
+            WHERE f.item_id = ?
+        """, (item_id,)).fetchone()
+    finally:
+        conn.close()
+
+# ---------- Purchasing / receiving ----------
+def create_purchase_order(supplier, lines, note=None):
+    """Create an open purchase order; lines: (item_id, quantity, cost_each). Returns its id"""
+    created_at = datetime.now().isoformat(timespec="seconds")
+    def _write(conn):
+        po_id = conn.execute("INSERT INTO purchase_orders (supplier, note, created_at) VALUES (?, ?, ?)",
+                             (supplier, note, created_at)).lastrowid
+        conn.executemany("""
+            INSERT INTO purchase_order_lines (po_id, item_id, quantity, cost_each) VALUES (?, ?, ?, ?)
+        """, [(po_id, item_id, qty, cost) for item_id, qty, cost in lines])
+        return po_id
+    return run_write(_write)
+
+def get_purchase_orders(status="open"):
+    conn = get_connection()
+    try:
+        return conn.execute("""
+            SELECT po.id, po.supplier, po.status, po.created_at, po.received_at,
+                   COUNT(l.id) AS lines, COALESCE(SUM(l.quantity * l.cost_each), 0) AS total_cost
+            FROM purchase_orders po
+            LEFT JOIN purchase_order_lines l ON l.po_id = po.id
+            WHERE (? IS NULL OR po.status = ?)
+            GROUP BY po.id ORDER BY po.id DESC
+        """, (status, status)).fetchall()
+    finally:
+        conn.close()
+
+def get_purchase_order_lines(po_id):
+    conn = get_connection()
+    try:
+        return conn.execute("""
+            SELECT l.item_id, i.name, i.barcode, l.quantity, l.cost_each
+            FROM purchase_order_lines l JOIN items i ON i.id = l.item_id
+            WHERE l.po_id = ? ORDER BY l.id
+        """, (po_id,)).fetchall()
+    finally:
+        conn.close()
+
+def post_goods_receipt(lines, supplier=None, po_id=None, note=None):
+    """
+    Record a delivery and apply it in one transaction: receipt lines are
+    inserted with executemany, then one UPDATE ... FROM adds the received
+    quantities to stock and folds their cost into each item's moving
+    average cost (stock on hand at the old cost + received at the new one).
+    lines: (item_id, quantity, cost_each). Closes po_id if given.
+    Returns the receipt id.
+    """
+    received_at = datetime.now().isoformat(timespec="seconds")
+    total_cost = sum(qty * cost for _, qty, cost in lines)
+    def _write(conn):
+        cur = conn.cursor()
+        receipt_id = cur.execute("""
+            INSERT INTO goods_receipts (po_id, supplier, note, total_cost, received_at) VALUES (?, ?, ?, ?, ?)
+        """, (po_id, supplier, note, total_cost, received_at)).lastrowid
+        cur.executemany("""
+            INSERT INTO goods_receipt_lines (receipt_id, item_id, quantity, cost_each) VALUES (?, ?, ?, ?)
+        """, [(receipt_id, item_id, qty, cost) for item_id, qty, cost in lines])
+        with stock_context(conn, "receipt", "receipt", receipt_id):
+            cur.execute("""
+                UPDATE items SET
+                    stock_count = items.stock_count + r.quantity,
+                    cost = CASE
+                        WHEN r.cost_each IS NULL OR r.cost_each <= 0 THEN items.cost
+                        WHEN items.cost <= 0 OR items.stock_count <= 0 THEN r.cost_each
+                        ELSE (items.stock_count * items.cost + r.quantity * r.cost_each)
+                             / (items.stock_count + r.quantity)
+                    END,
+                    updated_at = ?
+                FROM (
+                    SELECT item_id, SUM(quantity) AS quantity,
+                           SUM(quantity * cost_each) / NULLIF(SUM(quantity), 0) AS cost_each
+                    FROM goods_receipt_lines WHERE receipt_id = ?
+                    GROUP BY item_id
+                ) AS r
+                WHERE items.id = r.item_id
+            """, (received_at, receipt_id))
+        if po_id:
+            cur.execute("UPDATE purchase_orders SET status='received', received_at=? WHERE id=?",
+                        (received_at, po_id))
+        return receipt_id
+    return run_write(_write)
+
+def get_goods_receipts(limit=100):
+    conn = get_connection()
+    try:
+        return conn.execute("""
+            SELECT r.id, r.po_id, r.supplier, r.total_cost, r.received_at, COUNT(l.id) AS lines
+            FROM goods_receipts r LEFT JOIN goods_receipt_lines l ON l.receipt_id = r.id
+            GROUP BY r.id ORDER BY r.id DESC LIMIT ?
+        """, (limit,)).fetchall()
+    finally:
+        conn.close()
+
+# ---------- Cart journal ----------
+# Which till a journaled bill belongs to, when several share one database
+REGISTER_ID = os.environ.get("STORE_REGISTER_ID") or socket.gethostname()
+
+def journal_cart_op(cart_id, op, payload=None, register_id=REGISTER_ID):
+    """Append a bill change to the journal without waiting for the commit"""
+    created_at = datetime.now().isoformat(timespec="milliseconds")
+    data = json.dumps(payload, ensure_ascii=False) if payload is not None else None
+    def _write(conn):
+        conn.execute("""
+            INSERT INTO cart_journal (cart_id, op, payload, created_at, register_id) VALUES (?, ?, ?, ?, ?)
+        """, (cart_id, op, data, created_at, register_id))
+    return submit_write(_write)
+
+def discard_cart_journal(cart_id):
+    """Forget a bill's journal (bill cleared or abandoned) without waiting"""
+    def _write(conn):
+        conn.execute("DELETE FROM cart_journal WHERE cart_id=?", (cart_id,))
+    return submit_write(_write)
+
+def park_cart_journal(cart_id, payload, register_id=REGISTER_ID):
+    """Replace a bill's journal with a single 'park' snapshot, without waiting"""
+    created_at = datetime.now().isoformat(timespec="milliseconds")
+    data = json.dumps(payload, ensure_ascii=False)
+    def _write(conn):
+        conn.execute("DELETE FROM cart_journal WHERE cart_id=?", (cart_id,))
+        conn.execute("""
+            INSERT INTO cart_journal (cart_id, op, payload, created_at, register_id) VALUES (?, 'park', ?, ?, ?)
+        """, (cart_id, data, created_at, register_id))
+    return submit_write(_write)
+
+def claim_cart_journals(register_id=REGISTER_ID):
+    """Give bills journaled before registers were recorded to this register; returns their row count"""
+    def _write(conn):
+        return conn.execute("UPDATE cart_journal SET register_id=? WHERE register_id=''", (register_id,)).rowcount
+    return run_write(_write)
+
+def get_open_cart_journals(register_id=REGISTER_ID):
+    """
+    Journals of a register's unfinished bills as [(cart_id, [(op, payload), ...]), ...],
+    the most recently changed bill last
+    """
+    conn = get_connection()
+    try:
+        rows = conn.execute("""
+            SELECT cart_id, op, payload FROM cart_journal WHERE register_id=? ORDER BY id
+        """, (register_id,)).fetchall()
+    finally:
+        conn.close()
+    carts = {}
+    for r in rows:
+        entries = carts.pop(r["cart_id"], [])  # Re-insert so the dict ends in last-change order
+        entries.append((r["op"], json.loads(r["payload"]) if r["payload"] else None))
+        carts[r["cart_id"]] = entries
+    return list(carts.items())
@@ -0,0 +1,271 @@
+# receipts.py
+"""
+Receipt rendering and a background print queue.
+
+A Receipt is an immutable snapshot of a bill, so the cart can be cleared
+or changed while the receipt waits to be printed. It renders either as
+HTML (Qt printers) or as a raw ESC/POS byte stream for thermal printers.
+
+PrintQueue renders and prints on its own thread; submitting a receipt
+never blocks the next sale. Sinks decide where the output goes:
+
+    EscPosSink("/dev/usb/lp0")        thermal printer device (or a pty / file for testing)
+    HtmlFileSink("receipts.html")     HTML appended to a file
+    QtPrinterSink()                   default system printer through Qt, no dialog
+
+Nothing here imports Qt at module level; QtPrinterSink imports it lazily.
+"""
+import html
+import os
+import queue
+import sys
+import threading
+from collections import namedtuple
+from concurrent.futures import Future
+from datetime import datetime
+from string import Template
+
+import models
+from services import fmt_qty, fmt_money
+
+# Thermal printer output; STORE_RECEIPT_PRINTER names the device, e.g. /dev/usb/lp0
+RECEIPT_PRINTER = os.environ.get("STORE_RECEIPT_PRINTER")
+ESCPOS_WIDTH = 48          # Characters per line: 48 for 80 mm paper, 32 for 58 mm
+ESCPOS_ENCODING = "cp720"  # Arabic DOS code page understood by most thermal printers
+ESCPOS_CODEPAGE = 32       # ESC t value selecting PC720 (check the printer's code page table)
+
+ReceiptLine = namedtuple("ReceiptLine", "name price qty total")
+Receipt = namedtuple("Receipt", "shop_name contact location currency lines total when sale_id")
+
+def make_receipt(shop_name, contact, location, currency, lines, total, when=None, sale_id=None):
+    """Snapshot bill lines (anything with name, price, qty, total) into a Receipt"""
+    return Receipt(
+        shop_name, contact, location, currency,
+        tuple(ReceiptLine(l.name, l.price, l.qty, l.total) for l in lines),
+        total, when or datetime.now(), sale_id,
+    )
+
+def receipts_for_sales(sale_ids, shop_name, contact, location, currency):
+    """Receipts of saved sales, in the order of sale_ids (unknown ids are skipped)"""
+    sales, details = models.get_sales_with_details(sale_ids)
+    receipts = []
+    for sale_id in sale_ids:
+        sale = sales.get(sale_id)
+        if not sale:
+            continue
+        lines = tuple(
+            ReceiptLine(d["name"] or "", d["price_each"], d["quantity"], d["price_each"] * d["quantity"])
+            for d in details.get(sale_id, ())
+        )
+        when = datetime.fromisoformat(sale["datetime"])
+        receipts.append(Receipt(shop_name, contact, location, currency, lines,
+                                sale["total_price"], when, sale_id))
+    return receipts
+
+# ---------- HTML ----------
+_HTML_ROW = Template("""
+                <tr>
+                    <td>$name</td>
+                    <td>$price $currency</td>
+                    <td>$qty</td>
+                    <td>$total $currency</td>
+                </tr>""")
+
+_HTML_DOCUMENT = Template("""
+        <html>
+        <body style='font-family: Arial; text-align: right; direction: rtl;'>$body
+        </body>
+        </html>
+        """)
+
+_HTML_PAGE_BREAK = "<div style='page-break-after: always;'></div>"
+
+_HTML_RECEIPT = Template("""
+            <h2>$shop_name</h2>
+            <p>$contact</p>
+            <p>$location</p>
+            <hr>
+            <h3>فاتورة بيع$sale_no</h3>
+            <p>التاريخ: $when</p>
+            <table width='100%' border='1' cellpadding='5'>
+                <tr>
+                    <th>الاسم</th>
+                    <th>السعر</th>
+                    <th>الكمية</th>
+                    <th>الإجمالي</th>
+                </tr>$rows
+                <tr>
+                    <td colspan='3' style='text-align: left;'><b>الإجمالي</b></td>
+                    <td><b>$total $currency</b></td>
+                </tr>
+            </table>
+            <hr>
+            <p>شكرًا لزيارتكم</p>""")
+
+def _html_receipt(receipt):
+    esc = html.escape
+    currency = esc(receipt.currency)
+    rows = "".join(
+        _HTML_ROW.substitute(name=esc(l.name), price=fmt_money(l.price), qty=fmt_qty(l.qty),
+                             total=fmt_money(l.total), currency=currency)
+        for l in receipt.lines
+    )
+    return _HTML_RECEIPT.substitute(
+        shop_name=esc(receipt.shop_name), contact=esc(receipt.contact), location=esc(receipt.location),
+        sale_no=f" رقم {receipt.sale_id}" if receipt.sale_id else "",
+        when=receipt.when.strftime('%Y-%m-%d %H:%M'), rows=rows,
+        total=fmt_money(receipt.total), currency=currency,
+    )
+
+def render_html(receipt):
+    return _HTML_DOCUMENT.substitute(body=_html_receipt(receipt))
+
+def render_html_pages(receipts):
+    """One HTML document with each receipt on its own page"""
+    return _HTML_DOCUMENT.substitute(body=_HTML_PAGE_BREAK.join(_html_receipt(r) for r in receipts))
+
+# ---------- ESC/POS ----------
+ESC_INIT = b"\x1b@"
+ESC_ALIGN_LEFT = b"\x1ba\x00"
+ESC_ALIGN_CENTER = b"\x1ba\x01"
+ESC_BOLD_ON = b"\x1bE\x01"
+ESC_BOLD_OFF = b"\x1bE\x00"
+GS_SIZE_DOUBLE = b"\x1d!\x11"
+GS_SIZE_NORMAL = b"\x1d!\x00"
+GS_CUT_FEED = b"\x1dVB\x03"  # Feed 3 lines then partial cut
+
+def _columns(left, right, width):
+    """left and right text on one line of width characters"""
+    left = left[:max(0, width - len(right) - 1)]
+    return left + " " * (width - len(left) - len(right)) + right
+
+def render_escpos(receipt, width=ESCPOS_WIDTH, encoding=ESCPOS_ENCODING, codepage=ESCPOS_CODEPAGE):
+    """Raw ESC/POS bytes for a thermal printer"""
+    def text(s):
+        return s.encode(encoding, errors="replace") + b"\n"
+
+    currency = receipt.currency
+    out = [ESC_INIT, b"\x1bt" + bytes([codepage]), ESC_ALIGN_CENTER,
+           GS_SIZE_DOUBLE, text(receipt.shop_name), GS_SIZE_NORMAL]
+    for s in (receipt.contact, receipt.location):
+        if s:
+            out.append(text(s))
+    if receipt.sale_id:
+        out.append(text(f"فاتورة رقم {receipt.sale_id}"))
+    out.append(text(receipt.when.strftime('%Y-%m-%d %H:%M')))
+    out += [ESC_ALIGN_LEFT, text("-" * width)]
+    for l in receipt.lines:
+        out.append(text(l.name[:width]))
+        out.append(text(_columns(f"  {fmt_qty(l.qty)} x {fmt_money(l.price)}",
+                                 f"{fmt_money(l.total)} {currency}", width)))
+    out += [
+        text("-" * width),
+        ESC_BOLD_ON, text(_columns("الإجمالي", f"{fmt_money(receipt.total)} {currency}", width)), ESC_BOLD_OFF,
+        ESC_ALIGN_CENTER, text("شكرًا لزيارتكم"), GS_CUT_FEED,
+    ]
+    return b"".join(out)
+
+# ---------- Sinks ----------
+class EscPosSink:
+    """Writes ESC/POS bytes to a printer device, a pty or a plain file"""
+
+    def __init__(self, path, width=ESCPOS_WIDTH, encoding=ESCPOS_ENCODING, codepage=ESCPOS_CODEPAGE):
+        self.path = path
+        self.width = width
+        self.encoding = encoding
+        self.codepage = codepage
+
+    def write(self, receipts):
+        data = b"".join(render_escpos(r, self.width, self.encoding, self.codepage) for r in receipts)
+        with open(self.path, "ab", buffering=0) as f:
+            f.write(data)
+
+class HtmlFileSink:
+    """Appends receipt HTML to a file (testing and archiving)"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, receipts):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for r in receipts:
+                f.write(render_html(r))
+
+class QtPrinterSink:
+    """Prints receipt HTML on the default (or named) system printer without a dialog"""
+
+    def __init__(self, printer_name=None):
+        self.printer_name = printer_name
+
+    def write(self, receipts):
+        from PyQt5.QtGui import QTextDocument
+        from PyQt5.QtPrintSupport import QPrinter
+
+        printer = QPrinter()
+        if self.printer_name:
+            printer.setPrinterName(self.printer_name)
+        if not printer.isValid():
+            raise RuntimeError(f"Printer not available: {self.printer_name or 'default'}")
+        doc = QTextDocument()
+        for r in receipts:
+            doc.setHtml(render_html(r))
+            doc.print_(printer)
+
+def default_sink():
+    """Thermal printer when STORE_RECEIPT_PRINTER is set, else the system printer"""
+    if RECEIPT_PRINTER:
+        return EscPosSink(RECEIPT_PRINTER)
+    return QtPrinterSink()
+
+# ---------- Print queue ----------
+_STOP = object()
+
+class PrintQueue:
+    """
+    Renders and prints receipts on a background thread, one job at a time.
+    submit() returns a Future that is done when the job reached the sink.
+    on_error(receipts, error) is called on the printer thread when a job fails.
+    """
+
+    def __init__(self, sink, on_error=None):
+        self.sink = sink
+        self.on_error = on_error
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="receipt-printer", daemon=True)
+        self._thread.start()
+
+    def submit(self, receipts):
+        """Queue one receipt or a list of them (a batch goes to the sink in one write)"""
+        if isinstance(receipts, Receipt):
+            receipts = [receipts]
+        future = Future()
+        self._queue.put((future, list(receipts)))
+        return future
+
+    def reprint_sales(self, sale_ids, shop_name, contact, location, currency):
+        """Queue receipts of saved sales as one batch"""
+        return self.submit(receipts_for_sales(sale_ids, shop_name, contact, location, currency))
+
+    def stop(self, timeout=None):
+        """Print what is queued and stop the thread"""
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is _STOP:
+                return
+            future, receipts = job
+            try:
+                self.sink.write(receipts)
+                future.set_result(len(receipts))
+            except Exception as e:
+                # The future carries the error; stderr keeps it visible without touching CLI output
+                print(f"Receipt printing failed: {e}", file=sys.stderr)
+                future.set_exception(e)
+                if self.on_error:
+                    try:
+                        self.on_error(receipts, e)
+                    except Exception as cb_error:
+                        print(f"Receipt failure callback failed: {cb_error}", file=sys.stderr)
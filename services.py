@@ -0,0 +1,576 @@
+# services.py
+"""
+Qt-free business logic behind the Controller: the bill being built (cart),
+checkout, inventory edits, stocktakes, goods receiving and amendments of
+saved sales.
+
+Nothing here touches widgets or dialogs. Rule violations raise ServiceError
+with the message to show the cashier; the Controller decides how to show it.
+Everything can be driven headless (benchmarks, load tests, scripts).
+"""
+import sys
+import uuid
+from datetime import datetime
+
+import models
+
+ALLOWED_BARCODE_LENGTHS = {8, 12, 13}
+DEFAULT_CATEGORY_NAME = "غير مصنّف"
+
+class ServiceError(Exception):
+    """A business rule was violated; str(e) is a user-facing message"""
+
+def is_valid_barcode(code: str) -> bool:
+    return code.isdigit() and (len(code) in ALLOWED_BARCODE_LENGTHS)
+
+def fmt_qty(val):
+    return f"{val:.0f}" if val == int(val) else f"{val:.1f}"
+
+def fmt_money(val):
+    return f"{val:.0f}" if val == int(val) else f"{val:.2f}"
+
+def stock_status(stock_count, reorder_point=None, demand_per_day=None, threshold=models.LOW_STOCK_THRESHOLD):
+    """('out' | 'low' | 'ok', days to stock-out or None) for a stock level and its forecast"""
+    days = stock_count / demand_per_day if demand_per_day else None
+    if stock_count <= 0:
+        return "out", days
+    if stock_count <= (reorder_point if reorder_point is not None else threshold):
+        return "low", days
+    return "ok", days
+
+def find_item(barcode=None, name=None):
+    """Look an item up by barcode first, then by (partial) name"""
+    item = None
+    if barcode:
+        item = models.get_item_by_barcode(barcode)
+    if not item and name:
+        items = models.search_items_by_name(name)
+        if items:
+            item = items[0]
+    return item
+
+# ---------- Cart ----------
+class CartLine:
+    """One bill line; repeated scans of the same item add to qty"""
+    __slots__ = ("item_id", "name", "barcode", "price", "qty", "total")
+
+    def __init__(self, item_id, name, barcode, price, qty):
+        self.item_id = item_id  # None for custom items
+        self.name = name
+        self.barcode = barcode
+        self.price = price
+        self.qty = qty
+        self.total = price * qty
+
+    @property
+    def is_custom(self):
+        return self.item_id is None
+
+class CartJournal:
+    """
+    Append-only record of one bill's changes in the cart_journal table,
+    tagged with the register it belongs to.
+    Appends are queued on the writer thread and never wait for the commit.
+    """
+
+    def __init__(self, cart_id=None, register_id=models.REGISTER_ID):
+        self.cart_id = cart_id or uuid.uuid4().hex
+        self.register_id = register_id
+
+    def record(self, op, payload=None):
+        models.journal_cart_op(self.cart_id, op, payload, self.register_id)
+
+    def park(self, label, lines):
+        """Compact the journal into one snapshot of the parked bill"""
+        models.park_cart_journal(self.cart_id, {"label": label, "lines": lines}, self.register_id)
+
+    def discard(self):
+        """Drop this bill's journal and start a fresh one for the next bill"""
+        models.discard_cart_journal(self.cart_id)
+        self.cart_id = uuid.uuid4().hex
+
+class CartService:
+    """
+    The bill being built at the till.
+
+    Lines are kept in scan order in a dict keyed by (item id, price), so
+    scanning the same item again increments its line instead of adding a
+    row. The bill total and the quantity per item are kept up to date on
+    every change rather than summed over all lines.
+
+    With a journal every add/remove is also appended to cart_journal, and
+    restore() rebuilds an unfinished bill from it after a crash.
+    """
+
+    def __init__(self, journal=None):
+        self.journal = journal
+        self._reset()
+
+    @property
+    def items(self):
+        """Lines in the order they appear in the bill table"""
+        return list(self._lines.values())
+
+    def _key(self, item_id, name, barcode, price):
+        if item_id is None:
+            return ("custom", barcode or name, price)
+        return (item_id, price)
+
+    def _put(self, key, item_id, name, barcode, price, qty):
+        """Add qty to the line for key; returns (row, line, merged)"""
+        line = self._lines.get(key)
+        if line is None:
+            line = self._lines[key] = CartLine(item_id, name, barcode, price, qty)
+            row, merged = len(self._lines) - 1, False
+        else:
+            line.qty += qty
+            line.total = line.price * line.qty
+            row, merged = self._row_of(key), True
+        self._total += price * qty
+        if item_id is not None:
+            self._item_qty[item_id] = self._item_qty.get(item_id, 0) + qty
+        if self.journal:
+            self.journal.record("add", {
+                "item_id": item_id, "name": name, "barcode": barcode, "price": price, "qty": qty
+            })
+        return row, line, merged
+
+    def _row_of(self, key):
+        for row, k in enumerate(self._lines):
+            if k == key:
+                return row
+        return None
+
+    def add(self, name, barcode, price, qty):
+        """
+        Add qty of an item. Unknown items are added as custom lines.
+        Returns (row, line, merged): merged is True when an existing row grew.
+        """
+        if not name or qty <= 0:
+            raise ServiceError("الرجاء إدخال اسم المنتج وكمية صحيحة.")
+        item = find_item(barcode, name)
+        if not item:
+            return self.add_custom(name, barcode, price, qty)
+
+        # Check stock availability, counting what is already in the bill
+        available_stock = max(0, item["stock_count"] or 0)  # Ensure stock is never negative
+        in_cart = self._item_qty.get(item["id"], 0)
+        if in_cart + qty > available_stock:
+            raise ServiceError(
+                f"الكمية المطلوبة ({fmt_qty(in_cart + qty)}) أكبر من المخزون المتاح ({fmt_qty(available_stock)})."
+            )
+        return self._put(self._key(item["id"], name, barcode, price), item["id"], name, barcode, price, qty)
+
+    def add_custom(self, name, barcode, price, qty):
+        """Add a line for an item that isn't in the database"""
+        if not name or qty <= 0:
+            raise ServiceError("الرجاء إدخال اسم المنتج وكمية صحيحة.")
+        return self._put(self._key(None, name, barcode, price), None, name, barcode, price, qty)
+
+    def remove(self, index):
+        """Remove and return the line at index"""
+        key = list(self._lines)[index]
+        line = self._lines.pop(key)
+        if self.journal:
+            self.journal.record("remove", {"index": index})
+        self._total -= line.total
+        if line.item_id is not None:
+            left = self._item_qty[line.item_id] - line.qty
+            if left > 0:
+                self._item_qty[line.item_id] = left
+            else:
+                del self._item_qty[line.item_id]
+        if not self._lines:
+            self._total = 0.0  # Drop float drift once the bill is empty
+        return line
+
+    def total(self):
+        return self._total
+
+    def clear(self):
+        self._reset()
+        if self.journal:
+            self.journal.discard()
+
+    def _reset(self):
+        self._lines = {}
+        self._item_qty = {}
+        self._total = 0.0
+
+    def restore(self, cart_id, entries):
+        """
+        Replay journal entries [(op, payload), ...] of an unfinished bill.
+        Stock isn't rechecked here; checkout clamps stock at zero as always.
+        """
+        journal, self.journal = self.journal, None  # Don't journal the replay
+        try:
+            self._reset()
+            for op, payload in entries:
+                if op == "add":
+                    p = payload
+                    self._put(self._key(p["item_id"], p["name"], p["barcode"], p["price"]),
+                              p["item_id"], p["name"], p["barcode"], p["price"], p["qty"])
+                elif op == "remove":
+                    self.remove(payload["index"])
+                elif op == "park":
+                    self._reset()
+                    for item_id, name, barcode, price, qty in payload["lines"]:
+                        self._put(self._key(item_id, name, barcode, price), item_id, name, barcode, price, qty)
+        finally:
+            self.journal = journal
+        if self.journal:
+            self.journal.cart_id = cart_id  # Keep appending to the recovered bill
+
+    def is_empty(self):
+        return not self._lines
+
+    def __len__(self):
+        return len(self._lines)
+
+class CartRegister:
+    """
+    The open bills of one register: the active cart plus parked ones.
+
+    Parked carts stay in memory, so switching bills never re-reads items;
+    on disk each parked bill is compacted to a single journal snapshot.
+    Bills are journaled under register_id, so tills sharing a database
+    never recover (or discard) each other's bills.
+    """
+
+    def __init__(self, register_id=models.REGISTER_ID):
+        self.register_id = register_id
+        self.active = self._new_cart()
+        self.parked = {}  # cart_id -> (label, CartService), in parking order
+
+    def _new_cart(self):
+        return CartService(CartJournal(register_id=self.register_id))
+
+    def park(self, label=None):
+        """Set the active bill aside and start an empty one; returns the parked cart_id"""
+        cart = self.active
+        if cart.is_empty():
+            raise ServiceError("لا توجد عناصر في الفاتورة لتعليقها.")
+        label = label or f"{datetime.now():%H:%M} - {len(cart)} صنف - {fmt_money(cart.total())}"
+        cart.journal.park(label, [[l.item_id, l.name, l.barcode, l.price, l.qty] for l in cart.items])
+        cart_id = cart.journal.cart_id
+        self.parked[cart_id] = (label, cart)
+        self.active = self._new_cart()
+        return cart_id
+
+    def resume(self, cart_id):
+        """Make a parked bill active; a non-empty active bill is parked in its place"""
+        if cart_id not in self.parked:
+            raise ServiceError("الفاتورة المعلقة غير موجودة.")
+        if not self.active.is_empty():
+            self.park()
+        _, cart = self.parked.pop(cart_id)
+        cart.journal.record("resume")
+        self.active = cart
+        return cart
+
+    def parked_bills(self):
+        """[(cart_id, label), ...] in parking order"""
+        return [(cart_id, label) for cart_id, (label, _) in self.parked.items()]
+
+    def recover(self):
+        """
+        Rebuild this register's open bills from the journal after a restart.
+        Bills whose last entry is a park snapshot come back parked; the most
+        recently changed other bill becomes active (any older ones are parked).
+        """
+        models.claim_cart_journals(self.register_id)
+        active = None
+        for cart_id, entries in models.get_open_cart_journals(self.register_id):
+            cart = self._new_cart()
+            cart.restore(cart_id, entries)
+            if cart.is_empty():
+                cart.clear()
+            elif entries[-1][0] == "park":
+                self.parked[cart_id] = (entries[-1][1]["label"], cart)
+            else:
+                if active is not None:
+                    self.active = active
+                    self.park()
+                active = cart
+        if active is not None:
+            self.active = active
+        return self.active
+
+# ---------- Checkout ----------
+class CheckoutService:
+    """Turns a cart into a saved sale"""
+
+    def checkout(self, cart):
+        """Save the cart as one sale (custom lines count in the total only) and clear it"""
+        if cart.is_empty():
+            raise ServiceError("لا توجد عناصر في الفاتورة.")
+        lines = [(line.item_id, line.qty, line.price) for line in cart.items if not line.is_custom]
+        # The bill's journal is closed in the same transaction as the sale
+        cart_id = cart.journal.cart_id if cart.journal else None
+        sale_id = models.save_sale(cart.total(), lines, cart_id=cart_id)
+        cart.clear()
+        return sale_id
+
+# ---------- Inventory ----------
+class InventoryService:
+    """Validation and persistence of items edited in the stock form"""
+
+    def validate(self, name, barcode, qty):
+        if not name:
+            raise ServiceError("الرجاء إدخال الاسم.")
+        if barcode and not is_valid_barcode(barcode):
+            raise ServiceError("الباركود غير صالح")
+        # Prevent negative stock
+        if qty < 0:
+            raise ServiceError("لا يمكن إضافة كمية مخزون سالبة.")
+
+    def add_item(self, name, category_id, barcode, price, qty, photo_path):
+        self.validate(name, barcode, qty)
+        return models.add_item(name, category_id, barcode or None, price, qty, photo_path)
+
+    def update_item(self, item_id, name, category_id, barcode, price, qty, photo_path):
+        self.validate(name, barcode, qty)
+        models.update_item(item_id, name, category_id, barcode or None, price, qty, photo_path)
+
+    def custom_barcode(self, barcode):
+        """Barcode to use for a custom item (temporary one if none was typed)"""
+        return barcode or f"TEMP_{datetime.now().strftime('%H%M%S')}"
+
+    def save_custom_item(self, name, barcode, price):
+        """Store a custom bill item in the catalog with zero stock"""
+        default_cat = models.get_category_by_name(DEFAULT_CATEGORY_NAME)
+        cat_id = default_cat["id"] if default_cat else None
+        return models.add_item(name, cat_id, barcode or None, price, 0, None)
+
+# ---------- Stocktake ----------
+class StocktakeLine:
+    """Count of one item in a stocktake, total and per counter"""
+    __slots__ = ("item_id", "name", "barcode", "expected", "counted", "by_counter")
+
+    def __init__(self, item_id, name, barcode, expected):
+        self.item_id = item_id
+        self.name = name
+        self.barcode = barcode
+        self.expected = expected  # Stock when the item was first scanned
+        self.counted = 0.0
+        self.by_counter = {}
+
+    @property
+    def variance(self):
+        return self.counted - self.expected
+
+class StocktakeSession:
+    """
+    A physical count. The barcode index is loaded once, so a scan is a dict
+    lookup plus an in-memory increment; counts are also queued to
+    stocktake_counts (without waiting) so an interrupted count can resume.
+    Several counters can scan into one session; their counts add up.
+    commit() applies all variances in one set-based transaction, after
+    checking that every queued count was saved.
+    """
+
+    def __init__(self, stocktake_id, index, counts=()):
+        self.stocktake_id = stocktake_id
+        self.index = index
+        self.lines = {}  # item_id -> StocktakeLine, in first-scan order
+        self.total_variance = 0.0
+        self._pending = {}  # Future -> (item_id, counter, qty, expected) of counts not yet saved
+        by_id = {item_id: (barcode, name) for barcode, (item_id, name, _) in index.items()}
+        for c in counts:
+            barcode, name = by_id.get(c["item_id"], ("", ""))
+            line = self.lines.get(c["item_id"])
+            if line is None:
+                line = self.lines[c["item_id"]] = StocktakeLine(c["item_id"], name, barcode, c["expected"])
+                self.total_variance -= line.expected
+            line.counted += c["counted"]
+            line.by_counter[c["counter"]] = line.by_counter.get(c["counter"], 0) + c["counted"]
+            self.total_variance += c["counted"]
+
+    @classmethod
+    def open(cls, note=None):
+        """Resume the open stocktake, or start a new one"""
+        row, counts = models.get_open_stocktake()
+        stocktake_id = row["id"] if row else models.start_stocktake(note)
+        return cls(stocktake_id, models.get_stock_index(), counts)
+
+    def scan(self, barcode, qty=1, counter=""):
+        """Count qty of the item with barcode (negative qty corrects a miscount); returns its line"""
+        entry = self.index.get(barcode)
+        if entry is None:
+            raise ServiceError("الباركود غير موجود في المخزون.")
+        if not qty:
+            raise ServiceError("الرجاء إدخال كمية صحيحة.")
+        item_id, name, stock = entry
+        line = self.lines.get(item_id)
+        if line is None:
+            line = self.lines[item_id] = StocktakeLine(item_id, name, barcode, max(0, stock or 0))
+            self.total_variance -= line.expected
+        line.counted += qty
+        line.by_counter[counter] = line.by_counter.get(counter, 0) + qty
+        self.total_variance += qty
+        future = models.record_stocktake_count(self.stocktake_id, item_id, counter, qty, line.expected)
+        self._pending[future] = (item_id, counter, qty, line.expected)
+        future.add_done_callback(self._count_saved)
+        return line
+
+    def _count_saved(self, future):
+        # Runs on the writer thread; failed counts stay pending for flush()
+        if future.exception() is None:
+            self._pending.pop(future, None)
+        else:
+            print(f"Stocktake count not saved: {future.exception()}", file=sys.stderr)
+
+    @property
+    def unsaved(self):
+        """Number of counts whose write failed and that flush() will retry"""
+        return sum(1 for f in list(self._pending) if f.done() and f.exception() is not None)
+
+    def flush(self):
+        """Wait for queued counts and write failed ones again; raises ServiceError if any is still lost"""
+        lost = 0
+        for future, (item_id, counter, qty, expected) in list(self._pending.items()):
+            if future.exception() is not None:
+                try:
+                    models.record_stocktake_count(self.stocktake_id, item_id, counter, qty, expected, wait=True)
+                except Exception as e:
+                    print(f"Stocktake count not saved: {e}", file=sys.stderr)
+                    lost += 1
+                    continue
+            self._pending.pop(future, None)
+        if lost:
+            raise ServiceError(f"تعذر حفظ {lost} من عمليات الجرد. حاول الاعتماد مرة أخرى.")
+
+    def commit(self, zero_uncounted=False):
+        """Apply the counts to stock; returns the number of items changed"""
+        if not self.lines and not zero_uncounted:
+            raise ServiceError("لم يتم جرد أي صنف.")
+        self.flush()
+        return models.commit_stocktake(self.stocktake_id, zero_uncounted)
+
+    def cancel(self):
+        models.cancel_stocktake(self.stocktake_id)
+
+# ---------- Receiving ----------
+class DeliveryLine:
+    """Received quantity and unit cost of one item in a delivery"""
+    __slots__ = ("item_id", "name", "barcode", "ordered", "quantity", "cost_each")
+
+    def __init__(self, item_id, name, barcode, ordered=0.0, cost_each=0.0):
+        self.item_id = item_id
+        self.name = name
+        self.barcode = barcode
+        self.ordered = ordered
+        self.quantity = 0.0
+        self.cost_each = cost_each
+
+    @property
+    def total_cost(self):
+        return self.quantity * self.cost_each
+
+class Delivery:
+    """
+    A supplier delivery being checked in. Lines are matched through the
+    barcode index loaded once (scans and imported rows are dict lookups);
+    nothing is written until post(), which records the receipt and applies
+    every stock increment and cost in one transaction.
+    """
+
+    def __init__(self, index, supplier=None, po_id=None):
+        self.index = index
+        self.supplier = supplier
+        self.po_id = po_id
+        self.lines = {}  # item_id -> DeliveryLine, in first-scan order
+
+    @classmethod
+    def open(cls, supplier=None):
+        return cls(models.get_stock_index(), supplier)
+
+    @classmethod
+    def from_purchase_order(cls, po_id):
+        """A delivery pre-filled with the ordered lines (quantities still to be received)"""
+        po = {r["id"]: r for r in models.get_purchase_orders(None)}.get(po_id)
+        if po is None or po["status"] != "open":
+            raise ServiceError("أمر الشراء غير موجود أو تم استلامه.")
+        delivery = cls(models.get_stock_index(), po["supplier"], po_id)
+        for r in models.get_purchase_order_lines(po_id):
+            delivery.lines[r["item_id"]] = DeliveryLine(r["item_id"], r["name"], r["barcode"],
+                                                        r["quantity"], r["cost_each"])
+        return delivery
+
+    def scan(self, barcode, qty=1, cost_each=None):
+        """Receive qty of the item with barcode; cost_each replaces the line's cost when given"""
+        entry = self.index.get(barcode)
+        if entry is None:
+            raise ServiceError("الباركود غير موجود في المخزون.")
+        if not qty:
+            raise ServiceError("الرجاء إدخال كمية صحيحة.")
+        item_id, name, _ = entry
+        line = self.lines.get(item_id)
+        if line is None:
+            line = self.lines[item_id] = DeliveryLine(item_id, name, barcode)
+        line.quantity += qty
+        if cost_each is not None:
+            line.cost_each = cost_each
+        return line
+
+    def receive_as_ordered(self):
+        """Set every line's received quantity to the ordered quantity"""
+        for line in self.lines.values():
+            line.quantity = line.ordered
+
+    def import_rows(self, rows):
+        """Add rows with barcode, quantity and optional cost (e.g. a CSV); returns unmatched barcodes"""
+        unmatched = []
+        for r in rows:
+            barcode = (r.get("barcode") or "").strip()
+            try:
+                qty = float(r.get("quantity") or 0)
+                cost = float(r["cost"]) if (r.get("cost") or "").strip() else None
+            except ValueError:
+                unmatched.append(barcode)
+                continue
+            if barcode not in self.index or not qty:
+                unmatched.append(barcode)
+                continue
+            self.scan(barcode, qty, cost)
+        return unmatched
+
+    @property
+    def total_cost(self):
+        return sum(l.total_cost for l in self.lines.values())
+
+    def post(self, note=None):
+        """Record the receipt and add it to stock; returns the receipt id"""
+        lines = [(l.item_id, l.quantity, l.cost_each) for l in self.lines.values() if l.quantity]
+        if not lines:
+            raise ServiceError("لم يتم استلام أي صنف.")
+        if any(qty < 0 or cost < 0 for _, qty, cost in lines):
+            raise ServiceError("الرجاء إدخال كمية صحيحة.")
+        return models.post_goods_receipt(lines, self.supplier, self.po_id, note)
+
+# ---------- Sales amendments ----------
+class SalesAmendmentService:
+    """Edits of already saved sales, with stock restored or taken accordingly"""
+
+    def _refuse_archived(self, table, row_id):
+        # Archived periods are closed: their sales are read-only
+        if models.is_archived(table, row_id):
+            raise ServiceError("هذه العملية مؤرشفة ولا يمكن تعديلها.")
+
+    def change_quantity(self, detail_id, new_qty):
+        """Set a sold line's quantity; returns the previous quantity"""
+        self._refuse_archived("sale_details", detail_id)
+        if new_qty <= 0:
+            raise ServiceError("الرجاء إدخال كمية صحيحة.")
+        old_qty = models.set_sale_detail_quantity(detail_id, new_qty)
+        if old_qty is None:
+            raise ServiceError("الصنف غير موجود في العملية.")
+        return old_qty
+
+    def remove_line(self, detail_id):
+        self._refuse_archived("sale_details", detail_id)
+        models.delete_sale_detail(detail_id, restock=True)
+
+    def delete_sale(self, sale_id):
+        self._refuse_archived("sales", sale_id)
+        models.delete_sale(sale_id, restock=True)
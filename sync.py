@@ -0,0 +1,411 @@
+# sync.py
+"""
+Offline-first replication between store.db replicas (one per register).
+
+Every replica records row changes of items, sales and sale_details in
+change_log (see database._setup_change_capture). Syncing exchanges
+zlib-compressed JSON batches built only from the log entries the peer has not
+seen yet, so the cost follows the number of changes, not the database size.
+
+- Rows are identified across replicas by (origin replica id, id on origin).
+- Every change carries the replica it started on and its seq there, so a
+  change relayed around a ring or over two paths is applied only once.
+- Stock is merged as additive deltas, never last-writer-wins.
+- Other item columns are last-writer-wins on items.updated_at; edits made
+  in the same second are settled by comparing the values themselves, so
+  every replica keeps the same one whatever order they arrive in.
+"""
+import json
+import sqlite3
+import uuid
+import zlib
+from datetime import datetime
+
+from database import get_connection, run_write, CAPTURED_TABLES
+
+SYNC_BATCH_SIZE = 500
+BATCH_FORMAT_VERSION = 2
+
+# Upserts are applied parents first, deletes children first
+_UPSERT_ORDER = ("items", "sales", "sale_details")
+_DELETE_ORDER = ("sale_details", "sales", "items")
+
+# ---------- Replica identity ----------
+def get_replica_id(conn):
+    """Get the id of the replica behind a connection"""
+    row = conn.execute("SELECT replica_id FROM sync_state WHERE id=1").fetchone()
+    return row["replica_id"]
+
+def clone_replica(src_path, dst_path):
+    """
+    Create a new replica (e.g. for a new till) from an existing database.
+    The copy gets its own replica id, and rows it inherited are mapped back to
+    the source so both sides agree on their identity.
+    """
+    src = get_connection(src_path)
+    dst = sqlite3.connect(dst_path)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+
+    dst = get_connection(dst_path)
+    try:
+        src_id = get_replica_id(src)
+        src_max_seq = src.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+        dst_id = uuid.uuid4().hex
+        now = datetime.now().isoformat(timespec="seconds")
+
+        cur = dst.cursor()
+        cur.execute("UPDATE sync_state SET replica_id=?, created_at=? WHERE id=1", (dst_id, now))
+        for table in CAPTURED_TABLES:
+            cur.execute(f"""
+                INSERT OR IGNORE INTO sync_rowmap (origin, table_name, origin_id, local_id)
+                SELECT ?, ?, t.id, t.id FROM {table} t
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM sync_rowmap m WHERE m.table_name = ? AND m.local_id = t.id
+                )
+            """, (src_id, table, table))
+        # History up to the clone is the source's to forward, not ours
+        cur.execute("DELETE FROM change_log")
+        cur.execute("""
+            INSERT INTO sync_origins (origin, last_seq) VALUES (?, ?)
+            ON CONFLICT(origin) DO UPDATE SET last_seq=MAX(last_seq, excluded.last_seq)
+        """, (src_id, src_max_seq))
+        cur.execute("""
+            INSERT INTO sync_peers (peer_id, last_sent_seq, last_received_seq, last_sync_at)
+            VALUES (?, 0, ?, ?)
+            ON CONFLICT(peer_id) DO UPDATE SET last_received_seq=excluded.last_received_seq
+        """, (src_id, src_max_seq, now))
+        dst.commit()
+
+        src.execute("""
+            INSERT INTO sync_peers (peer_id, last_sent_seq, last_received_seq, last_sync_at)
+            VALUES (?, ?, 0, ?)
+        """, (dst_id, src_max_seq, now))
+        src.commit()
+        return dst_id
+    finally:
+        dst.close()
+        src.close()
+
+def _get_peer(conn, peer_id):
+    conn.execute("INSERT OR IGNORE INTO sync_peers (peer_id) VALUES (?)", (peer_id,))
+    return conn.execute("SELECT * FROM sync_peers WHERE peer_id=?", (peer_id,)).fetchone()
+
+def _global_key(conn, self_id, table, local_id):
+    """Identity of a local row as (origin replica, id on origin)"""
+    row = conn.execute("""
+        SELECT origin, origin_id FROM sync_rowmap WHERE table_name=? AND local_id=?
+    """, (table, local_id)).fetchone()
+    if row:
+        return [row["origin"], row["origin_id"]]
+    return [self_id, local_id]
+
+def _resolve(conn, self_id, table, key):
+    """Local id of a row identified by a global key, or None if unknown here"""
+    origin, origin_id = key
+    if origin == self_id:
+        return origin_id
+    row = conn.execute("""
+        SELECT local_id FROM sync_rowmap WHERE origin=? AND table_name=? AND origin_id=?
+    """, (origin, table, origin_id)).fetchone()
+    return row["local_id"] if row else None
+
+def _map_row(conn, table, key, local_id):
+    conn.execute("""
+        INSERT OR REPLACE INTO sync_rowmap (origin, table_name, origin_id, local_id)
+        VALUES (?, ?, ?, ?)
+    """, (key[0], table, key[1], local_id))
+
+# ---------- Export ----------
+def _row_payload(conn, self_id, table, local_id):
+    """Current contents of a row in replica-neutral form, or None if it is gone"""
+    if table == "items":
+        r = conn.execute("""
+            SELECT i.name, i.barcode, i.price, i.photo_path, i.add_date, i.updated_at,
+                   c.name AS category_name
+            FROM items i LEFT JOIN categories c ON c.id = i.category_id
+            WHERE i.id=?
+        """, (local_id,)).fetchone()
+        return dict(r) if r else None
+    if table == "sales":
+        r = conn.execute("SELECT datetime, total_price, created_at FROM sales WHERE id=?", (local_id,)).fetchone()
+        return dict(r) if r else None
+    r = conn.execute("""
+        SELECT sale_id, item_id, quantity, price_each, cost_each, created_at FROM sale_details WHERE id=?
+    """, (local_id,)).fetchone()
+    if not r:
+        return None
+    payload = dict(r)
+    payload["sale_id"] = _global_key(conn, self_id, "sales", r["sale_id"])
+    payload["item_id"] = _global_key(conn, self_id, "items", r["item_id"])
+    return payload
+
+def export_batch(conn, peer_id, batch_size=SYNC_BATCH_SIZE):
+    """
+    Build the next compressed batch of changes for a peer, or None if the peer
+    is up to date. Log entries for the same row and origin replica collapse
+    into one change; stock deltas are summed. Changes that started on the
+    peer are never sent back to it. The cursor only moves on acknowledge().
+    """
+    self_id = get_replica_id(conn)
+    peer = _get_peer(conn, peer_id)
+    rows = conn.execute("""
+        SELECT seq, table_name, row_id, op, stock_delta, origin, origin_seq
+        FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?
+    """, (peer["last_sent_seq"], batch_size)).fetchall()
+    if not rows:
+        return None
+
+    pending = {}
+    for r in rows:
+        origin = r["origin"] or self_id
+        if origin == peer_id:
+            continue  # Started on the peer, don't echo it back
+        entry = pending.setdefault((r["table_name"], r["row_id"], origin),
+                                   {"deleted": False, "delta": 0.0, "seq": None})
+        entry["deleted"] = r["op"] == "D"
+        if r["stock_delta"]:
+            entry["delta"] += r["stock_delta"]
+        seq = r["seq"] if r["origin"] is None else r["origin_seq"]
+        if seq is not None:
+            entry["seq"] = max(entry["seq"] or 0, seq)
+
+    changes = []
+    for (table, row_id, origin), entry in pending.items():
+        key = _global_key(conn, self_id, table, row_id)
+        if entry["deleted"]:
+            change = {"t": table, "k": key, "op": "D"}
+        else:
+            payload = _row_payload(conn, self_id, table, row_id)
+            if payload is None:
+                continue  # Deleted after this batch; the delete comes in a later one
+            change = {"t": table, "k": key, "op": "U", "row": payload}
+            if table == "items":
+                change["stock_delta"] = entry["delta"]
+        change["o"] = origin
+        if entry["seq"] is not None:
+            change["s"] = entry["seq"]
+        changes.append(change)
+
+    batch = {
+        "v": BATCH_FORMAT_VERSION,
+        "origin": self_id,
+        "from_seq": peer["last_sent_seq"],
+        "to_seq": rows[-1]["seq"],
+        "changes": changes,
+    }
+    conn.commit()
+    return zlib.compress(json.dumps(batch, ensure_ascii=False).encode("utf-8"))
+
+def acknowledge(conn, peer_id, to_seq):
+    """Record that a peer applied our changes up to to_seq"""
+    conn.execute("""
+        UPDATE sync_peers SET last_sent_seq = MAX(last_sent_seq, ?), last_sync_at = ?
+        WHERE peer_id=?
+    """, (to_seq, datetime.now().isoformat(timespec="seconds"), peer_id))
+    conn.commit()
+
+# ---------- Apply ----------
+def _category_id(conn, name):
+    if not name:
+        return None
+    row = conn.execute("SELECT id FROM categories WHERE name=?", (name,)).fetchone()
+    if row:
+        return row["id"]
+    cur = conn.execute("INSERT INTO categories (name, created_at) VALUES (?, ?)",
+                       (name, datetime.now().isoformat()))
+    return cur.lastrowid
+
+def _item_version(row):
+    """Last-writer-wins order of an item's values: updated_at, then the values"""
+    return (row["updated_at"] or "", row["name"] or "", row["barcode"] or "",
+            float(row["price"] or 0), row["photo_path"] or "", row["category_name"] or "")
+
+def _apply_item(conn, self_id, change, stats):
+    key, row, delta = change["k"], change["row"], change.get("stock_delta") or 0
+    local_id = _resolve(conn, self_id, "items", key)
+    if local_id is None and row["barcode"]:
+        # Same product created independently on both tills
+        match = conn.execute("SELECT id FROM items WHERE barcode=?", (row["barcode"],)).fetchone()
+        if match:
+            local_id = match["id"]
+            _map_row(conn, "items", key, local_id)
+
+    cat_id = _category_id(conn, row["category_name"])
+    if local_id is None:
+        cur = conn.execute("""
+            INSERT INTO items (name, category_id, barcode, price, stock_count, photo_path, add_date, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (row["name"], cat_id, row["barcode"], row["price"], delta,
+              row["photo_path"], row["add_date"], row["updated_at"]))
+        local_id = cur.lastrowid
+        _map_row(conn, "items", key, local_id)
+        return local_id
+
+    local = conn.execute("""
+        SELECT i.name, i.barcode, i.price, i.photo_path, i.updated_at, c.name AS category_name
+        FROM items i LEFT JOIN categories c ON c.id = i.category_id
+        WHERE i.id=?
+    """, (local_id,)).fetchone()
+    if local is None:
+        return None  # Deleted here; deletes win
+    if not local["updated_at"] or _item_version(row) > _item_version(local):
+        try:
+            conn.execute("""
+                UPDATE items SET name=?, category_id=?, barcode=?, price=?, photo_path=?, updated_at=?
+                WHERE id=?
+            """, (row["name"], cat_id, row["barcode"], row["price"], row["photo_path"],
+                  row["updated_at"], local_id))
+        except sqlite3.IntegrityError:
+            stats["conflicts"] += 1  # Barcode taken by another local item; keep local values
+    if delta:
+        conn.execute("UPDATE items SET stock_count = stock_count + ? WHERE id=?", (delta, local_id))
+    return local_id
+
+def _apply_sale(conn, self_id, change, stats):
+    key, row = change["k"], change["row"]
+    local_id = _resolve(conn, self_id, "sales", key)
+    if local_id is None:
+        cur = conn.execute("INSERT INTO sales (datetime, total_price, created_at) VALUES (?, ?, ?)",
+                           (row["datetime"], row["total_price"], row["created_at"]))
+        local_id = cur.lastrowid
+        _map_row(conn, "sales", key, local_id)
+        return local_id
+    cur = conn.execute("UPDATE sales SET datetime=?, total_price=? WHERE id=?",
+                       (row["datetime"], row["total_price"], local_id))
+    return local_id if cur.rowcount else None
+
+def _apply_sale_detail(conn, self_id, change, stats):
+    key, row = change["k"], change["row"]
+    sale_id = _resolve(conn, self_id, "sales", row["sale_id"])
+    item_id = _resolve(conn, self_id, "items", row["item_id"])
+    if sale_id is None or item_id is None:
+        stats["conflicts"] += 1  # Parent row unknown or deleted here
+        return None
+    local_id = _resolve(conn, self_id, "sale_details", key)
+    if local_id is None:
+        cur = conn.execute("""
+            INSERT INTO sale_details (sale_id, item_id, quantity, price_each, cost_each, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (sale_id, item_id, row["quantity"], row["price_each"], row.get("cost_each", 0), row["created_at"]))
+        local_id = cur.lastrowid
+        _map_row(conn, "sale_details", key, local_id)
+        return local_id
+    cur = conn.execute("UPDATE sale_details SET quantity=?, price_each=? WHERE id=?",
+                       (row["quantity"], row["price_each"], local_id))
+    return local_id if cur.rowcount else None
+
+_APPLIERS = {"items": _apply_item, "sales": _apply_sale, "sale_details": _apply_sale_detail}
+
+def apply_batch(conn, blob):
+    """
+    Apply a batch produced by a peer's export_batch() in one transaction.
+    Returns stats including ack_seq, which the sender passes to acknowledge().
+    Re-applying an already applied batch is a no-op, and so are changes that
+    started here or were already applied through another peer.
+    """
+    batch = json.loads(zlib.decompress(blob).decode("utf-8"))
+    if batch.get("v") != BATCH_FORMAT_VERSION:
+        raise ValueError(f"Unsupported sync batch version: {batch.get('v')}")
+    sender = batch["origin"]
+    self_id = get_replica_id(conn)
+    stats = {"applied": 0, "conflicts": 0, "duplicates": 0, "ack_seq": batch["to_seq"]}
+
+    peer = _get_peer(conn, sender)
+    if batch["to_seq"] <= peer["last_received_seq"]:
+        conn.commit()
+        return stats
+
+    seen = dict(conn.execute("SELECT origin, last_seq FROM sync_origins").fetchall())
+    last_seqs = {}
+    by_table = {table: {"U": [], "D": []} for table in CAPTURED_TABLES}
+    for change in batch["changes"]:
+        origin, seq = change["o"], change.get("s")
+        if origin == self_id or (seq is not None and seq <= seen.get(origin, 0)):
+            stats["duplicates"] += 1
+            continue
+        if seq is not None:
+            last_seqs[origin] = max(last_seqs.get(origin, 0), seq)
+        by_table[change["t"]][change["op"]].append(change)
+
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Our own triggers must not capture the remote rows as local changes;
+        # they are logged below with their origin so they are never echoed back.
+        # Stock changes still reach the ledger, labelled as sync.
+        conn.execute("UPDATE trigger_control SET suppress_capture = 1, stock_reason = 'sync' WHERE id=1")
+        relayed = []
+        for table in _UPSERT_ORDER:
+            for change in by_table[table]["U"]:
+                local_id = _APPLIERS[table](conn, self_id, change, stats)
+                if local_id is not None:
+                    relayed.append((table, local_id, "U", change.get("stock_delta"), change["o"], change.get("s")))
+                    stats["applied"] += 1
+        for table in _DELETE_ORDER:
+            for change in by_table[table]["D"]:
+                local_id = _resolve(conn, self_id, table, change["k"])
+                if local_id is None:
+                    continue
+                cur = conn.execute(f"DELETE FROM {table} WHERE id=?", (local_id,))
+                if cur.rowcount:
+                    relayed.append((table, local_id, "D", None, change["o"], change.get("s")))
+                    stats["applied"] += 1
+        conn.executemany("""
+            INSERT INTO change_log (table_name, row_id, op, stock_delta, origin, origin_seq)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, relayed)
+        conn.executemany("""
+            INSERT INTO sync_origins (origin, last_seq) VALUES (?, ?)
+            ON CONFLICT(origin) DO UPDATE SET last_seq=MAX(last_seq, excluded.last_seq)
+        """, list(last_seqs.items()))
+        conn.execute("UPDATE trigger_control SET suppress_capture = 0, stock_reason = NULL WHERE id=1")
+        conn.execute("""
+            UPDATE sync_peers SET last_received_seq=?, last_sync_at=? WHERE peer_id=?
+        """, (batch["to_seq"], datetime.now().isoformat(timespec="seconds"), sender))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return stats
+
+# ---------- Sync between database files ----------
+def _push(src, dst, batch_size):
+    src_id, dst_id = get_replica_id(src), get_replica_id(dst)
+    result = {"batches": 0, "changes": 0, "bytes": 0, "conflicts": 0}
+    while True:
+        blob = export_batch(src, dst_id, batch_size)
+        if blob is None:
+            break
+        stats = apply_batch(dst, blob)
+        acknowledge(src, dst_id, stats["ack_seq"])
+        result["batches"] += 1
+        result["changes"] += stats["applied"]
+        result["conflicts"] += stats["conflicts"]
+        result["bytes"] += len(blob)
+    return result
+
+def sync_databases(path_a, path_b, batch_size=SYNC_BATCH_SIZE):
+    """Exchange all pending changes between two replica database files"""
+    a = get_connection(path_a)
+    b = get_connection(path_b)
+    try:
+        return {"a_to_b": _push(a, b, batch_size), "b_to_a": _push(b, a, batch_size)}
+    finally:
+        a.close()
+        b.close()
+
+def prune_change_log():
+    """
+    Delete log entries every known peer has already received. A database
+    without peers (a single till) keeps no log at all: new replicas start
+    from clone_replica, a full copy, so nothing would ever read it.
+    """
+    def _write(conn):
+        peers, min_sent = conn.execute("SELECT COUNT(*), MIN(last_sent_seq) FROM sync_peers").fetchone()
+        if not peers:
+            min_sent = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+        return conn.execute("DELETE FROM change_log WHERE seq <= ?", (min_sent,)).rowcount
+    return run_write(_write)
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """A fresh store.db in a temporary directory, used as the default database"""
+    path = str(tmp_path / "store.db")
+    monkeypatch.setattr(database, "DB_NAME", path)
+    database.setup_database(path)
+    yield path
+    database.shutdown_writers()
+
+
+@pytest.fixture
+def use_db(monkeypatch):
+    """Point the default database (models, run_write) at another file"""
+    def _use(path):
+        monkeypatch.setattr(database, "DB_NAME", path)
+    yield _use
+    database.shutdown_writers()
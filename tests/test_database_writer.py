@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+import database
+
+
+def _insert_category(conn, name):
+    return conn.execute("INSERT INTO categories (name) VALUES (?)", (name,)).lastrowid
+
+
+def _category_names(path):
+    conn = database.get_connection(path)
+    try:
+        return {r["name"] for r in conn.execute("SELECT name FROM categories")}
+    finally:
+        conn.close()
+
+
+def test_jobs_queued_together_share_one_commit(store):
+    writer = database.DatabaseWriter(store, commit_window=0.2)
+    try:
+        futures = [writer.submit(_insert_category, f"c{i}") for i in range(20)]
+        ids = [f.result(timeout=5) for f in futures]
+    finally:
+        writer.stop()
+    assert len(set(ids)) == 20
+    assert writer.jobs_done == 20
+    assert writer.commits < 20
+    assert {f"c{i}" for i in range(20)} <= _category_names(store)
+
+
+def test_failing_job_is_rolled_back_alone(store):
+    def _fail(conn):
+        _insert_category(conn, "lost")
+        raise ValueError("boom")
+
+    writer = database.DatabaseWriter(store, commit_window=0.2)
+    try:
+        before = writer.submit(_insert_category, "before")
+        failed = writer.submit(_fail)
+        after = writer.submit(_insert_category, "after")
+        before.result(timeout=5)
+        after.result(timeout=5)
+        with pytest.raises(ValueError):
+            failed.result(timeout=5)
+    finally:
+        writer.stop()
+    names = _category_names(store)
+    assert {"before", "after"} <= names
+    assert "lost" not in names
+    assert writer.commits == 1
+
+
+def test_concurrent_callers_all_land(store):
+    errors = []
+
+    def _worker(n):
+        try:
+            for i in range(10):
+                database.run_write(_insert_category, f"t{n}-{i}")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=_worker, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert {f"t{n}-{i}" for n in range(4) for i in range(10)} <= _category_names(store)
+
+
+def test_run_is_reentrant_on_the_writer_thread(store):
+    def _outer(conn):
+        return database.run_write(_insert_category, "nested")
+
+    assert database.run_write(_outer)
+    assert "nested" in _category_names(store)
@@ -0,0 +1,74 @@
+import database
+import models
+
+
+def _sale(qty_a=2, qty_b=3):
+    a = models.add_item("a", None, "11111111", 10, 20, None)
+    b = models.add_item("b", None, "22222222", 5, 20, None)
+    sale_id = models.save_sale(qty_a * 10 + qty_b * 5, [(a, qty_a, 10), (b, qty_b, 5)])
+    return a, b, sale_id
+
+
+def _detail_id(sale_id, item_id):
+    conn = database.get_connection()
+    try:
+        return conn.execute("SELECT id FROM sale_details WHERE sale_id=? AND item_id=?",
+                            (sale_id, item_id)).fetchone()["id"]
+    finally:
+        conn.close()
+
+
+def _stock(item_id):
+    conn = database.get_connection()
+    try:
+        return conn.execute("SELECT stock_count FROM items WHERE id=?", (item_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_sale_is_in_line(store):
+    _sale()
+    assert models.reconcile_stock(full=True)["drifted"] == 0
+    assert not models.get_stock_discrepancies()
+
+
+def test_changed_quantity_is_in_line(store):
+    a, b, sale_id = _sale()
+    detail_id = _detail_id(sale_id, a)
+    models.set_sale_detail_quantity(detail_id, 5)
+    assert _stock(a) == 15
+    assert models.reconcile_stock(full=True)["drifted"] == 0
+    models.set_sale_detail_quantity(detail_id, 1)
+    assert _stock(a) == 19
+    assert models.reconcile_stock(full=True)["drifted"] == 0
+    assert not models.get_stock_discrepancies()
+
+
+def test_deleted_line_with_restock_is_in_line(store):
+    a, b, sale_id = _sale()
+    models.delete_sale_detail(_detail_id(sale_id, a), restock=True)
+    assert _stock(a) == 20
+    assert models.reconcile_stock(full=True)["drifted"] == 0
+
+
+def test_deleted_line_without_restock_is_in_line(store):
+    a, b, sale_id = _sale()
+    models.delete_sale_detail(_detail_id(sale_id, a), restock=False)
+    assert _stock(a) == 18
+    assert models.reconcile_stock(full=True)["drifted"] == 0
+    assert not models.get_stock_discrepancies()
+
+
+def test_line_changed_behind_the_ledger_drifts(store):
+    a, b, sale_id = _sale()
+    conn = database.get_connection()
+    try:
+        conn.execute("UPDATE sale_details SET quantity = 7 WHERE id=?", (_detail_id(sale_id, a),))
+        conn.commit()
+    finally:
+        conn.close()
+    result = models.reconcile_stock()
+    assert result["drifted"] == 1
+    assert models.reconcile_stock(repair=True)["repaired"] == 1
+    assert _stock(a) == 13
+    assert models.reconcile_stock(full=True)["drifted"] == 0
@@ -0,0 +1,93 @@
+import database
+import models
+import sync
+
+
+def _items(path):
+    conn = database.get_connection(path)
+    try:
+        return sorted(tuple(r) for r in conn.execute(
+            "SELECT barcode, name, price, stock_count FROM items WHERE barcode IS NOT NULL"))
+    finally:
+        conn.close()
+
+
+def _sale_count(path):
+    conn = database.get_connection(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM sales").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _item_id(path, barcode):
+    conn = database.get_connection(path)
+    try:
+        return conn.execute("SELECT id FROM items WHERE barcode=?", (barcode,)).fetchone()["id"]
+    finally:
+        conn.close()
+
+
+def _replicas(tmp_path, use_db, names):
+    paths = [str(tmp_path / f"{n}.db") for n in names]
+    database.setup_database(paths[0])
+    use_db(paths[0])
+    models.add_item("tea", None, "11111111", 10, 100, None)
+    database.shutdown_writers()
+    for path in paths[1:]:
+        sync.clone_replica(paths[0], path)
+    return paths
+
+
+def _sell(use_db, path, barcode, qty):
+    use_db(path)
+    item_id = _item_id(path, barcode)
+    models.save_sale(qty * 10, [(item_id, qty, 10)])
+
+
+def test_three_replicas_converge(tmp_path, use_db):
+    a, b, c = _replicas(tmp_path, use_db, "abc")
+    _sell(use_db, a, "11111111", 1)
+    _sell(use_db, b, "11111111", 2)
+    _sell(use_db, c, "11111111", 4)
+    use_db(b)
+    models.add_item("coffee", None, "22222222", 20, 10, None)
+    database.shutdown_writers()
+
+    # A ring plus a shortcut: changes reach some replicas over two paths
+    for _ in range(2):
+        for x, y in ((a, b), (b, c), (c, a), (a, c)):
+            sync.sync_databases(x, y)
+
+    assert _items(a) == _items(b) == _items(c)
+    assert dict((r[0], r[3]) for r in _items(a)) == {"11111111": 93, "22222222": 10}
+    assert _sale_count(a) == _sale_count(b) == _sale_count(c) == 3
+
+
+def _same_second_edits(tmp_path, use_db, first, second):
+    a, b = _replicas(tmp_path, use_db, (f"{first}1", f"{first}2"))
+    sync.sync_databases(a, b)
+    for path, price in ((a, 11), (b, 12)):
+        conn = database.get_connection(path)
+        conn.execute("UPDATE items SET price=?, updated_at='2030-01-01T10:00:00' WHERE barcode='11111111'",
+                     (price,))
+        conn.commit()
+        conn.close()
+    order = {"a": a, "b": b}
+    sync.sync_databases(order[first], order[second])
+    sync.sync_databases(a, b)
+    assert _items(a) == _items(b)
+    return _items(a)
+
+
+def test_same_second_edits_settle_the_same_whoever_pushes_first(tmp_path, use_db):
+    assert _same_second_edits(tmp_path, use_db, "a", "b") == _same_second_edits(tmp_path, use_db, "b", "a")
+
+
+def test_nothing_left_to_send_after_sync(tmp_path, use_db):
+    a, b = _replicas(tmp_path, use_db, "ab")
+    _sell(use_db, a, "11111111", 3)
+    database.shutdown_writers()
+    sync.sync_databases(a, b)
+    again = sync.sync_databases(a, b)
+    assert again["a_to_b"]["changes"] == again["b_to_a"]["changes"] == 0
@@ -70,6 +70,8 @@ class MainUI(QWidget):
         self._build_stock_tab()
         self._build_sales_tab()
         self._build_settings_tab()
+        self._build_stocktake_tab()
+        self._build_receiving_tab()
 
         # Tab icons
         try:
@@ -295,6 +297,24 @@ class MainUI(QWidget):
         self.btn_print_bill.setMinimumWidth(130)
         
         footer.addWidget(self.btn_print_bill)
+
+        # Parked bills: set the current bill aside and serve the next customer
+        self.btn_bill_park = QPushButton("تعليق الفاتورة")
+        self.btn_bill_park.setObjectName("secondary")
+        self.btn_bill_park.setMinimumHeight(45)
+        self.btn_bill_park.setMinimumWidth(120)
+
+        self.cmb_parked = QComboBox()
+        self.cmb_parked.setMinimumHeight(45)
+        self.cmb_parked.setMinimumWidth(200)
+
+        self.btn_bill_resume = QPushButton("استئناف")
+        self.btn_bill_resume.setMinimumHeight(45)
+        self.btn_bill_resume.setMinimumWidth(100)
+
+        footer.addWidget(self.btn_bill_park)
+        footer.addWidget(self.cmb_parked)
+        footer.addWidget(self.btn_bill_resume)
         footer.addStretch(1)
         
         self.lbl_total = QLabel("الإجمالي: 0.00")
@@ -445,6 +465,41 @@ class MainUI(QWidget):
         table_group = QGroupBox("قائمة المخزون")
         table_layout = QVBoxLayout(table_group)
 
+        # Filter bar (filtering and sorting run in SQL, see models.query_items)
+        filter_row = QHBoxLayout()
+        filter_row.setSpacing(8)
+
+        self.stk_filter_text = QLineEdit()
+        self.stk_filter_text.setPlaceholderText("بحث بالاسم أو الباركود")
+        self.stk_filter_text.setMinimumHeight(35)
+        self.stk_filter_text.setClearButtonEnabled(True)
+
+        self.cmb_stk_filter_cat = QComboBox()
+        self.cmb_stk_filter_cat.setMinimumHeight(35)
+
+        self.cmb_stk_filter_status = QComboBox()
+        self.cmb_stk_filter_status.setMinimumHeight(35)
+        for label, status in (("كل الحالات", None), ("نفد المخزون", "out"), ("منخفض", "low"), ("متاح", "ok")):
+            self.cmb_stk_filter_status.addItem(label, status)
+
+        # 0 shows as "-" and means no bound
+        self.stk_filter_price_min = QDoubleSpinBox()
+        self.stk_filter_price_max = QDoubleSpinBox()
+        for spin, prefix in ((self.stk_filter_price_min, "من: "), (self.stk_filter_price_max, "إلى: ")):
+            spin.setMaximum(10**9)
+            spin.setDecimals(2)
+            spin.setMinimumHeight(35)
+            spin.setPrefix(prefix)
+            spin.setSpecialValueText("-")
+
+        filter_row.addWidget(self.stk_filter_text, 2)
+        filter_row.addWidget(self.cmb_stk_filter_cat, 1)
+        filter_row.addWidget(self.cmb_stk_filter_status, 1)
+        filter_row.addWidget(QLabel("السعر:"), 0)
+        filter_row.addWidget(self.stk_filter_price_min, 1)
+        filter_row.addWidget(self.stk_filter_price_max, 1)
+        table_layout.addLayout(filter_row)
+
         self.tbl_stock = QTableWidget(0, 10)
         self.tbl_stock.setHorizontalHeaderLabels([
             "ID", "الاسم", "التصنيف", "الباركود", "السعر", 
@@ -472,6 +527,9 @@ class MainUI(QWidget):
         
         # Disable auto-selection on double-click for better editing experience
         self.tbl_stock.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        # Header clicks sort on the server, not in the widget
+        header.setSectionsClickable(True)
+        header.setSortIndicatorShown(True)
         
         table_layout.addWidget(self.tbl_stock)
         
@@ -522,8 +580,13 @@ class MainUI(QWidget):
         self.lbl_today_sales.setObjectName("KPI")
         self.lbl_today_sales.setMinimumWidth(200)
         
+        self.lbl_today_profit = QLabel("ربح اليوم: 0.00")
+        self.lbl_today_profit.setObjectName("KPI")
+        self.lbl_today_profit.setMinimumWidth(200)
+        
         kpi_row1.addWidget(self.lbl_total_sales)
         kpi_row1.addWidget(self.lbl_today_sales)
+        kpi_row1.addWidget(self.lbl_today_profit)
         kpi_row1.addStretch()
         kpi_layout.addLayout(kpi_row1)
         
@@ -546,6 +609,41 @@ class MainUI(QWidget):
         sales_group = QGroupBox("قائمة المبيعات")
         sales_layout = QVBoxLayout(sales_group)
 
+        # Search bar (runs in SQL over hot and archived sales, see models.search_sales)
+        search_row = QHBoxLayout()
+        search_row.setSpacing(8)
+
+        self.sales_filter_id = QLineEdit()
+        self.sales_filter_id.setPlaceholderText("رقم العملية")
+        self.sales_filter_item = QLineEdit()
+        self.sales_filter_item.setPlaceholderText("صنف (اسم أو باركود)")
+        self.sales_filter_from = QLineEdit()
+        self.sales_filter_from.setPlaceholderText("من تاريخ YYYY-MM-DD")
+        self.sales_filter_to = QLineEdit()
+        self.sales_filter_to.setPlaceholderText("إلى تاريخ YYYY-MM-DD")
+        for edit in (self.sales_filter_id, self.sales_filter_item, self.sales_filter_from, self.sales_filter_to):
+            edit.setMinimumHeight(35)
+            edit.setClearButtonEnabled(True)
+
+        # 0 shows as "-" and means no bound
+        self.sales_filter_min = QDoubleSpinBox()
+        self.sales_filter_max = QDoubleSpinBox()
+        for spin, prefix in ((self.sales_filter_min, "من: "), (self.sales_filter_max, "إلى: ")):
+            spin.setMaximum(10**9)
+            spin.setDecimals(2)
+            spin.setMinimumHeight(35)
+            spin.setPrefix(prefix)
+            spin.setSpecialValueText("-")
+
+        search_row.addWidget(self.sales_filter_id, 1)
+        search_row.addWidget(self.sales_filter_item, 2)
+        search_row.addWidget(self.sales_filter_from, 1)
+        search_row.addWidget(self.sales_filter_to, 1)
+        search_row.addWidget(QLabel("المبلغ:"), 0)
+        search_row.addWidget(self.sales_filter_min, 1)
+        search_row.addWidget(self.sales_filter_max, 1)
+        sales_layout.addLayout(search_row)
+
         self.tbl_sales = QTableWidget(0, 3)
         self.tbl_sales.setHorizontalHeaderLabels([
             "رقم العملية", "التاريخ والوقت", "الإجمالي"
@@ -558,6 +656,7 @@ class MainUI(QWidget):
         header.setSectionResizeMode(2, QHeaderView.ResizeToContents)
         
         self.tbl_sales.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.tbl_sales.setSelectionMode(QAbstractItemView.ExtendedSelection)  # Batch reprint
         self.tbl_sales.setAlternatingRowColors(True)
         self.tbl_sales.setMaximumHeight(250)
         
@@ -600,7 +699,12 @@ class MainUI(QWidget):
         self.btn_sale_refresh.setMinimumHeight(40)
         self.btn_sale_refresh.setMinimumWidth(80)
 
+        self.btn_sale_reprint = QPushButton("إعادة طباعة الفواتير المحددة")
+        self.btn_sale_reprint.setObjectName("secondary")
+        self.btn_sale_reprint.setMinimumHeight(40)
+
         sales_btn_row.addWidget(self.btn_sale_view)
+        sales_btn_row.addWidget(self.btn_sale_reprint)
         sales_btn_row.addWidget(self.btn_sale_delete)
         sales_btn_row.addStretch()
         sales_btn_row.addWidget(self.btn_sale_refresh)
@@ -654,6 +758,195 @@ class MainUI(QWidget):
 
         self.tabs.addTab(tab, "المبيعات")
 
+    # ---------- Stocktake Tab ----------
+    def _build_stocktake_tab(self):
+        tab = QWidget()
+        outer = QVBoxLayout(tab)
+        outer.setSpacing(12)
+
+        scan_group = QGroupBox("الجرد")
+        scan_layout = QVBoxLayout(scan_group)
+
+        row1 = QHBoxLayout()
+        row1.setSpacing(10)
+
+        self.st_barcode = QLineEdit()
+        self.st_barcode.setObjectName("barcode_field")
+        self.st_barcode.setPlaceholderText("امسح الباركود لعدّ الصنف")
+        self.st_barcode.setMinimumHeight(50)
+        self.st_barcode.setFont(QFont("Courier New", 14, QFont.Bold))
+
+        self.st_qty = QDoubleSpinBox()
+        self.st_qty.setRange(-10**6, 10**6)
+        self.st_qty.setDecimals(3)
+        self.st_qty.setValue(1.0)
+        self.st_qty.setMinimumHeight(45)
+        self.st_qty.setMinimumWidth(100)
+
+        self.st_counter = QLineEdit()
+        self.st_counter.setPlaceholderText("اسم العدّاد")
+        self.st_counter.setMinimumHeight(45)
+        self.st_counter.setMaximumWidth(200)
+
+        row1.addWidget(QLabel("الباركود:"), 0)
+        row1.addWidget(self.st_barcode, 3)
+        row1.addWidget(QLabel("الكمية:"), 0)
+        row1.addWidget(self.st_qty, 1)
+        row1.addWidget(QLabel("العدّاد:"), 0)
+        row1.addWidget(self.st_counter, 1)
+        scan_layout.addLayout(row1)
+
+        row2 = QHBoxLayout()
+        row2.setSpacing(10)
+
+        self.btn_st_start = QPushButton("بدء / استئناف الجرد")
+        self.btn_st_start.setMinimumHeight(45)
+
+        self.chk_st_zero = QCheckBox("تصفير الأصناف غير المجرودة")
+        self.chk_st_zero.setMinimumHeight(45)
+
+        self.btn_st_commit = QPushButton("اعتماد الجرد")
+        self.btn_st_commit.setObjectName("secondary")
+        self.btn_st_commit.setMinimumHeight(45)
+
+        self.btn_st_cancel = QPushButton("إلغاء الجرد")
+        self.btn_st_cancel.setObjectName("danger")
+        self.btn_st_cancel.setMinimumHeight(45)
+
+        row2.addWidget(self.btn_st_start)
+        row2.addStretch()
+        row2.addWidget(self.chk_st_zero)
+        row2.addWidget(self.btn_st_commit)
+        row2.addWidget(self.btn_st_cancel)
+        scan_layout.addLayout(row2)
+        outer.addWidget(scan_group)
+
+        self.tbl_stocktake = QTableWidget(0, 5)
+        self.tbl_stocktake.setHorizontalHeaderLabels([
+            "الاسم", "الباركود", "المخزون المتوقع", "المعدود", "الفرق"
+        ])
+        header = self.tbl_stocktake.horizontalHeader()
+        header.setSectionResizeMode(0, QHeaderView.Stretch)
+        for col in range(1, 5):
+            header.setSectionResizeMode(col, QHeaderView.ResizeToContents)
+        self.tbl_stocktake.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.tbl_stocktake.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.tbl_stocktake.setAlternatingRowColors(True)
+        self.tbl_stocktake.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        outer.addWidget(self.tbl_stocktake)
+
+        self.lbl_st_summary = QLabel("لا يوجد جرد مفتوح")
+        self.lbl_st_summary.setObjectName("KPI")
+        outer.addWidget(self.lbl_st_summary)
+
+        self.tabs.addTab(tab, "الجرد")
+
+    def _build_receiving_tab(self):
+        tab = QWidget()
+        outer = QVBoxLayout(tab)
+        outer.setSpacing(12)
+
+        group = QGroupBox("استلام البضاعة")
+        group_layout = QVBoxLayout(group)
+
+        row1 = QHBoxLayout()
+        row1.setSpacing(10)
+
+        self.rcv_supplier = QLineEdit()
+        self.rcv_supplier.setPlaceholderText("اسم المورد")
+        self.rcv_supplier.setMinimumHeight(45)
+
+        self.cmb_rcv_po = QComboBox()
+        self.cmb_rcv_po.setMinimumHeight(45)
+        self.cmb_rcv_po.setMinimumWidth(220)
+
+        self.btn_rcv_start = QPushButton("بدء الاستلام")
+        self.btn_rcv_start.setMinimumHeight(45)
+
+        self.btn_rcv_import = QPushButton("استيراد ملف CSV")
+        self.btn_rcv_import.setObjectName("secondary")
+        self.btn_rcv_import.setMinimumHeight(45)
+
+        row1.addWidget(QLabel("المورد:"), 0)
+        row1.addWidget(self.rcv_supplier, 2)
+        row1.addWidget(QLabel("أمر الشراء:"), 0)
+        row1.addWidget(self.cmb_rcv_po, 2)
+        row1.addWidget(self.btn_rcv_start)
+        row1.addWidget(self.btn_rcv_import)
+        group_layout.addLayout(row1)
+
+        row2 = QHBoxLayout()
+        row2.setSpacing(10)
+
+        self.rcv_barcode = QLineEdit()
+        self.rcv_barcode.setObjectName("barcode_field")
+        self.rcv_barcode.setPlaceholderText("امسح الباركود لاستلام الصنف")
+        self.rcv_barcode.setMinimumHeight(50)
+        self.rcv_barcode.setFont(QFont("Courier New", 14, QFont.Bold))
+
+        self.rcv_qty = QDoubleSpinBox()
+        self.rcv_qty.setRange(-10**6, 10**6)
+        self.rcv_qty.setDecimals(3)
+        self.rcv_qty.setValue(1.0)
+        self.rcv_qty.setMinimumHeight(45)
+        self.rcv_qty.setMinimumWidth(100)
+
+        self.rcv_cost = QDoubleSpinBox()
+        self.rcv_cost.setRange(0, 10**9)
+        self.rcv_cost.setDecimals(2)
+        self.rcv_cost.setSpecialValueText("—")  # 0 keeps the line's cost
+        self.rcv_cost.setMinimumHeight(45)
+        self.rcv_cost.setMinimumWidth(100)
+
+        row2.addWidget(QLabel("الباركود:"), 0)
+        row2.addWidget(self.rcv_barcode, 3)
+        row2.addWidget(QLabel("الكمية:"), 0)
+        row2.addWidget(self.rcv_qty, 1)
+        row2.addWidget(QLabel("التكلفة:"), 0)
+        row2.addWidget(self.rcv_cost, 1)
+        group_layout.addLayout(row2)
+
+        row3 = QHBoxLayout()
+        row3.setSpacing(10)
+
+        self.btn_rcv_as_ordered = QPushButton("استلام كما في الأمر")
+        self.btn_rcv_as_ordered.setMinimumHeight(45)
+
+        self.btn_rcv_post = QPushButton("ترحيل الاستلام")
+        self.btn_rcv_post.setObjectName("secondary")
+        self.btn_rcv_post.setMinimumHeight(45)
+
+        self.btn_rcv_cancel = QPushButton("إلغاء")
+        self.btn_rcv_cancel.setObjectName("danger")
+        self.btn_rcv_cancel.setMinimumHeight(45)
+
+        row3.addWidget(self.btn_rcv_as_ordered)
+        row3.addStretch()
+        row3.addWidget(self.btn_rcv_post)
+        row3.addWidget(self.btn_rcv_cancel)
+        group_layout.addLayout(row3)
+        outer.addWidget(group)
+
+        self.tbl_receiving = QTableWidget(0, 6)
+        self.tbl_receiving.setHorizontalHeaderLabels([
+            "الاسم", "الباركود", "المطلوب", "المستلم", "التكلفة", "الإجمالي"
+        ])
+        header = self.tbl_receiving.horizontalHeader()
+        header.setSectionResizeMode(0, QHeaderView.Stretch)
+        for col in range(1, 6):
+            header.setSectionResizeMode(col, QHeaderView.ResizeToContents)
+        self.tbl_receiving.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.tbl_receiving.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.tbl_receiving.setAlternatingRowColors(True)
+        self.tbl_receiving.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        outer.addWidget(self.tbl_receiving)
+
+        self.lbl_rcv_summary = QLabel("لا يوجد استلام مفتوح")
+        self.lbl_rcv_summary.setObjectName("KPI")
+        outer.addWidget(self.lbl_rcv_summary)
+
+        self.tabs.addTab(tab, "الاستلام")
+
     # ---------- Settings Tab ----------
     def _build_settings_tab(self):
         tab = QWidget()